@@ -0,0 +1,201 @@
+"""
+Offline load/latency benchmark.
+
+Replays the example prompts of the README's Examples section (and any
+prompts found in --prompts files) through the router pool ->
+make_humanized_api_request at a configurable concurrency. DeepSeek and the upstream APIs are replaced by the
+local stand-ins from benchmarks/standins.py, so no keys or network are needed.
+With CAPTURE_MODE=replay, every exchange is served from the capture log in
+CAPTURE_DIR instead (see tools/capture.py), which makes runs deterministic.
+Record with --concurrency 1 to replay exactly: concurrent prompts can fetch a
+live quote in a different order than when recorded, and then ask the humanizer
+about a response it was never asked about. Speculative builds cancelled while
+recording show up as harmless capture.deepseek.replay_misses.
+
+The result is a JSON document (throughput, end-to-end and per-stage
+p50/p95/p99, error rates, counters) tagged with the current git commit, so
+runs can be compared across commits.
+
+Usage:
+    python benchmarks/load.py --concurrency 32 --repeat 5 --output bench.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+
+from benchmarks.standins import start_standins, stop_standins
+from tools.fast_path import fast_path_builder
+from tools.humanized_api import API_FAILURE_MESSAGE, async_make_humanized_api_request, async_stream_humanized_api_request
+from tools.response_cache import response_cache
+from tools.router import candidate_apis
+from tools.router_pool import router_pool
+from tools.semantic_cache import semantic_request_cache
+from tools.single_flight import deepseek_flights, deepseek_stream_flights, upstream_flights
+from tools.tracing import metrics
+
+ERROR_MESSAGES = (API_FAILURE_MESSAGE, "Sorry, I couldn't generate a response.")
+
+def load_prompts(paths) -> list:
+    prompts = []
+    with open(os.path.join(REPO_ROOT, "README.md"), encoding="utf-8") as readme:
+        section = None
+        for line in readme:
+            if line.startswith("# "):
+                section = line[2:].strip()
+            # Only the Examples section lists prompts; the other bullets are documentation.
+            elif section == "Examples" and line.startswith("- "):
+                prompts.append(re.sub(r"\s+# TODO.*$", "", line[2:]).strip())
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as prompts_file:
+            for line in prompts_file:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("{"):
+                    record = json.loads(line)
+                    prompt = record.get("user_query") or record.get("query") or record.get("prompt")
+                    if isinstance(prompt, str):
+                        prompts.append(prompt)
+                else:
+                    prompts.append(line)
+    return prompts
+
+def _percentiles(values) -> dict:
+    if not values:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "mean": float(np.mean(values)), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+async def run_one(prompt: str, stream: bool, results: dict):
+    started = time.perf_counter()
+    try:
+        apis = candidate_apis(await router_pool.async_route(prompt))
+        if not apis:
+            results["unrouted"] += 1
+            return
+        api, alternative_api = apis[0], apis[1] if len(apis) > 1 else None
+        first_chunk_at = None
+        if stream:
+            chunks = []
+            async for chunk in async_stream_humanized_api_request(prompt, api, alternative_api):
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                chunks.append(chunk)
+            answer = "".join(chunks)
+        else:
+            answer = await async_make_humanized_api_request(prompt, api, alternative_api)
+        elapsed = time.perf_counter() - started
+        results["latencies"].append(elapsed)
+        if first_chunk_at is not None:
+            results["time_to_first_chunk"].append(first_chunk_at - started)
+        if answer.startswith(ERROR_MESSAGES):
+            results["errors"] += 1
+    except Exception as e:
+        results["exceptions"].append(repr(e))
+
+async def run(prompts: list, concurrency: int, stream: bool) -> dict:
+    results = {"latencies": [], "time_to_first_chunk": [], "errors": 0, "unrouted": 0, "exceptions": []}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(prompt):
+        async with semaphore:
+            await run_one(prompt, stream, results)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(bounded(prompt) for prompt in prompts))
+    results["wall_seconds"] = time.perf_counter() - started
+    return results
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3, help="How many times to replay the prompt set.")
+    parser.add_argument("--prompts", action="append", default=[],
+                        help="Extra prompt files: JSONL with a query/user_query/prompt field, or plain lines.")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming pipeline and report time to first chunk.")
+    parser.add_argument("--deepseek-latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--upstream-latency", type=float, default=0.05)
+    parser.add_argument("--deepseek-fail-rate", type=float, default=0.0)
+    parser.add_argument("--no-caches", action="store_true", help="Disable the response and semantic caches.")
+    parser.add_argument("--no-fast-path", action="store_true", help="Always build requests with the LLM.")
+    parser.add_argument("--output", help="Write the JSON result to this file as well as stdout.")
+    args = parser.parse_args()
+
+    prompts = load_prompts(args.prompts) * args.repeat
+    if args.no_caches:
+        response_cache.max_entries = 0
+        semantic_request_cache.threshold = 2.0
+    if args.no_fast_path:
+        fast_path_builder.intents = {}
+
+    standins = start_standins(args.deepseek_latency, args.token_latency, args.upstream_latency, args.deepseek_fail_rate)
+    try:
+        # The pipeline logs every stage with print; keep the benchmark output clean.
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Like the server, start the router workers (ROUTER_PROCESSES) before timing anything.
+            router_pool.start()
+            metrics.reset()
+            results = asyncio.run(run(prompts, args.concurrency, args.stream))
+    finally:
+        stop_standins(standins)
+        router_pool.close()
+
+    snapshot = metrics.snapshot()
+    completed = len(results["latencies"])
+    failed = results["errors"] + len(results["exceptions"])
+    report = {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "prompts")},
+        "queries": len(prompts),
+        "completed": completed,
+        "unrouted": results["unrouted"],
+        "wall_seconds": results["wall_seconds"],
+        "throughput_qps": completed / results["wall_seconds"] if results["wall_seconds"] else 0.0,
+        "error_rate": failed / max(1, len(prompts) - results["unrouted"]),
+        "errors": results["errors"],
+        "exceptions": results["exceptions"][:20],
+        "latency_seconds": _percentiles(results["latencies"]),
+        "time_to_first_chunk_seconds": _percentiles(results["time_to_first_chunk"]),
+        "stages": {
+            name[len("stage."):-len(".seconds")]: histogram
+            for name, histogram in snapshot["histograms"].items()
+            if name.startswith("stage.")
+        },
+        "counters": snapshot["counters"],
+        "router": router_pool.stats(),
+        "fast_path": fast_path_builder.stats(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_request_cache.stats(),
+        "single_flight": {"upstream": upstream_flights.stats(), "deepseek": deepseek_flights.stats(), "deepseek_stream": deepseek_stream_flights.stats()},
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
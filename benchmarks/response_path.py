@@ -0,0 +1,123 @@
+"""
+Benchmark of the upstream response path on large CoinCap history payloads.
+
+Compares, against the CoinCap stand-in:
+
+- legacy: `response.json()`, `json.dumps` into a string, then `json.loads`
+  again in the reducer (the pipeline before raw bodies were kept).
+- raw: the current path; the body stays as the bytes read from the socket
+  and the reducer parses them once, with orjson when it is installed.
+
+Reports the median latency of fetch + reduce, the median latency of the
+client-side processing alone (from the received bytes to the reduced
+response; the stand-in's own time to build the payload dominates the former),
+and the peak of memory allocated while processing one response, measured with
+tracemalloc in separate runs.
+
+Usage:
+    python benchmarks/response_path.py [--points 100000] [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.standins import CoinCapStandIn, start_standins, stop_standins
+from tools import json_codec
+from tools.api_requestor import ApiRequestorResponse, async_send_upstream
+from tools.http_client import get_async_client, rewrite_url, run_sync
+from tools.models import APIRequest
+from tools.response_reducer import reduce_api_response
+
+USER_PROMPT = "How did the price of Bitcoin change over the last year?"
+
+def history_request(points: int) -> APIRequest:
+    step = CoinCapStandIn.INTERVALS_MS["m5"]
+    end = int(time.time() * 1000) // step * step
+    return APIRequest(
+        method="GET", server="https://api.coincap.io", path="/v2/assets/bitcoin/history",
+        query={"interval": "m5", "start": str(end - points * step), "end": str(end)},
+    )
+
+async def legacy_path(api_request: APIRequest) -> int:
+    response = await get_async_client().request(method="GET", url=rewrite_url(api_request.to_full_url()))
+    response.raise_for_status()
+    requestor_response = ApiRequestorResponse(result="success", api_response=json.dumps(response.json()))
+    reduced = reduce_api_response(USER_PROMPT, api_request, requestor_response.api_response)
+    return reduced.original_bytes
+
+def legacy_processing(api_request: APIRequest, body: bytes):
+    api_response = json.dumps(json.loads(body))
+    reduce_api_response(USER_PROMPT, api_request, ApiRequestorResponse(result="success", api_response=api_response).api_response)
+
+def raw_processing(api_request: APIRequest, body: bytes):
+    reduce_api_response(USER_PROMPT, api_request, ApiRequestorResponse(result="success", body=body).body)
+
+async def raw_path(api_request: APIRequest) -> int:
+    # Straight upstream, like the legacy path: no response cache or history store.
+    requestor_response = await async_send_upstream(api_request)
+    reduced = reduce_api_response(USER_PROMPT, api_request, requestor_response.body)
+    return reduced.original_bytes
+
+def measure(path, processing, api_request: APIRequest, body: bytes, runs: int, orjson_enabled: bool) -> dict:
+    saved_orjson = json_codec.orjson
+    json_codec.orjson = saved_orjson if orjson_enabled else None
+    try:
+        run_sync(path(api_request))  # Warm up the connection.
+        latencies = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            payload_bytes = run_sync(path(api_request))
+            latencies.append(time.perf_counter() - started)
+
+        processing_latencies = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            processing(api_request, body)
+            processing_latencies.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        processing(api_request, body)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        json_codec.orjson = saved_orjson
+    return {
+        "payload_bytes": payload_bytes,
+        "median_latency_s": statistics.median(latencies),
+        "median_processing_s": statistics.median(processing_latencies),
+        "peak_allocated_bytes": peak,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=100_000, help="History points per response.")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    standins = start_standins(upstream_latency=0.0)
+    try:
+        api_request = history_request(args.points)
+        body = run_sync(async_send_upstream(api_request)).body
+        results = {
+            "legacy": measure(legacy_path, legacy_processing, api_request, body, args.runs, orjson_enabled=False),
+            "raw": measure(raw_path, raw_processing, api_request, body, args.runs, orjson_enabled=True),
+        }
+    finally:
+        stop_standins(standins)
+
+    legacy, raw = results["legacy"], results["raw"]
+    results["speedup"] = legacy["median_latency_s"] / raw["median_latency_s"]
+    results["processing_speedup"] = legacy["median_processing_s"] / raw["median_processing_s"]
+    results["allocation_ratio"] = legacy["peak_allocated_bytes"] / raw["peak_allocated_bytes"]
+    results["orjson"] = json_codec.orjson is not None
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Startup-time benchmark for the router.
+
+Each scenario runs in a fresh interpreter so import and model-loading costs
+are measured the way a new worker process pays them:
+
+- cold: no route index on disk, so the utterances are encoded and saved.
+- warm: the index from the cold run is memory-mapped instead.
+
+Usage:
+    python benchmarks/router_startup.py [--runs 3]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+import tools.router as router
+imported = time.perf_counter()
+router.get_route_index()
+index_loaded = time.perf_counter()
+router.route_query("What is the price of Bitcoin?")
+first_query = time.perf_counter()
+router.route_query("Will it rain tomorrow?")
+second_query = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "index_load_s": index_loaded - imported,
+    "first_route_query_s": first_query - index_loaded,
+    "second_route_query_s": second_query - first_query,
+    "total_s": first_query - started,
+}))
+"""
+
+def run_probe(index_dir: str) -> dict:
+    python_path = os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")]))
+    env = dict(os.environ, ROUTE_INDEX_DIR=index_dir, PYTHONPATH=python_path)
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=REPO_ROOT, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    results = {"cold": [], "warm": []}
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as index_dir:
+            results["cold"].append(run_probe(index_dir))
+            results["warm"].append(run_probe(index_dir))
+
+    summary = {
+        scenario: {key: min(run[key] for run in runs) for key in runs[0]}
+        for scenario, runs in results.items()
+    }
+    print(json.dumps({"runs": args.runs, "best_of": summary}, indent=2))
+
+if __name__ == "__main__":
+    main()
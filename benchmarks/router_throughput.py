@@ -0,0 +1,91 @@
+"""
+Routing throughput benchmark of the router pool.
+
+Routes distinct queries (so the query cache never hits) from many concurrent
+callers, the way the server does, with:
+
+- threads: the encoder in the calling process (ROUTER_PROCESSES=0), on
+  --concurrency threads, which take turns on the GIL.
+- processes=N: the worker pool with N processes and batching.
+
+Reports the queries routed per second and the routing latency percentiles.
+The pool should scale with the cores up to N; on a single core it can only
+gain from batching.
+
+Usage:
+    python benchmarks/router_throughput.py [--queries 2000] [--concurrency 32] [--processes 1 2 4]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from tools.router_pool import RouterPool
+
+TEMPLATES = [
+    "What is the price of coin number {} right now?",
+    "Will it rain in city {} tomorrow?",
+    "When is the next public holiday in country {}?",
+    "Show the {}-day price chart of Bitcoin.",
+]
+
+def make_queries(count: int) -> list:
+    return [TEMPLATES[index % len(TEMPLATES)].format(index) for index in range(count)]
+
+async def route_all(pool: RouterPool, queries: list, concurrency: int) -> list:
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def route_one(query: str):
+        async with semaphore:
+            started = time.perf_counter()
+            await pool.async_route(query, executor=executor)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(route_one(query) for query in queries))
+    executor.shutdown()
+    return latencies
+
+def measure(processes: int, queries: list, concurrency: int) -> dict:
+    pool = RouterPool(processes=processes, cache_size=0)
+    try:
+        pool.start()
+        # One round first, so every worker has compiled its kernels.
+        asyncio.run(route_all(pool, make_queries(concurrency), concurrency))
+        started = time.perf_counter()
+        latencies = asyncio.run(route_all(pool, queries, concurrency))
+        wall_seconds = time.perf_counter() - started
+    finally:
+        pool.close()
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "queries_per_second": len(queries) / wall_seconds,
+        "latency_seconds": {"p50": float(p50), "p95": float(p95), "p99": float(p99)},
+        "mean_batch_size": pool.stats()["mean_batch_size"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    # Distinct from the warm-up round's queries.
+    queries = [f"{query} (run)" for query in make_queries(args.queries)]
+    results = {"threads": measure(0, queries, args.concurrency)}
+    for processes in args.processes:
+        results[f"processes={processes}"] = measure(processes, queries, args.concurrency)
+    print(json.dumps({"cpus": os.cpu_count(), "queries": args.queries, "concurrency": args.concurrency, "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
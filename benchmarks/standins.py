@@ -0,0 +1,357 @@
+"""
+Local stand-ins for DeepSeek and the upstream APIs.
+
+Each stand-in is a small threaded HTTP server that answers like the real
+service closely enough for the pipeline to run end to end without keys or
+network access:
+
+- DeepSeekStandIn mimics POST /chat/completions. It has configurable latency,
+  templated request-builder completions and SSE streaming.
+- CoinCapStandIn mimics /v2/assets, /v2/assets/{id} and /v2/assets/{id}/history.
+- NagerStandIn mimics the Nager.Date v3 holiday endpoints.
+- WeatherApiStandIn mimics /v1/current.json and /v1/forecast.json.
+
+`start_standins()` starts all four and redirects the pipeline to them.
+"""
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from tools.fast_path import FastPathBuilder
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+class StandIn:
+    """Base class: a threaded HTTP server with a simulated latency."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                standin._handle(self, "GET")
+
+            def do_POST(self):
+                standin._handle(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _Server(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> "StandIn":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        with self._lock:
+            self.requests += 1
+        parsed = urlparse(handler.path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        body = None
+        length = int(handler.headers.get("Content-Length") or 0)
+        if length:
+            body = json.loads(handler.rfile.read(length))
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            status, payload = self.route(method, parsed.path, query, body, handler)
+        except Exception as e:
+            status, payload = 500, {"error": repr(e)}
+        if payload is _STREAMED:
+            return
+        self._send_json(handler, status, payload)
+
+    @staticmethod
+    def _send_json(handler: BaseHTTPRequestHandler, status: int, payload):
+        encoded = b"" if payload is None else json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(encoded)))
+        handler.end_headers()
+        handler.wfile.write(encoded)
+
+    def route(self, method, path, query, body, handler):
+        raise NotImplementedError
+
+_STREAMED = object()
+
+def _seeded(*parts) -> float:
+    """A deterministic pseudo-random number in [0, 1) derived from the inputs."""
+    digest = hashlib.sha256("|".join(map(str, parts)).encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+class CoinCapStandIn(StandIn):
+    ASSETS = ["bitcoin", "ethereum", "tether", "binance-coin", "solana", "usd-coin", "xrp", "dogecoin",
+              "cardano", "tron", "avalanche", "shiba-inu", "polkadot", "chainlink", "polygon", "litecoin",
+              "uniswap", "stellar", "monero"]
+    INTERVALS_MS = {"m1": 60_000, "m5": 300_000, "m15": 900_000, "m30": 1_800_000,
+                    "h1": 3_600_000, "h2": 7_200_000, "h6": 21_600_000, "h12": 43_200_000, "d1": 86_400_000}
+
+    def _price(self, asset_id: str, timestamp_ms: int) -> float:
+        base = 10 ** (1 + 4 * _seeded(asset_id))
+        return base * (1 + 0.2 * math.sin(timestamp_ms / 86_400_000 / 7 + _seeded(asset_id, "phase") * 6))
+
+    def _asset(self, asset_id: str) -> dict:
+        now = int(time.time() * 1000)
+        rank = self.ASSETS.index(asset_id) + 1
+        price = self._price(asset_id, now)
+        return {
+            "id": asset_id, "rank": str(rank), "symbol": asset_id[:3].upper(), "name": asset_id.title(),
+            "supply": "19000000.0", "maxSupply": None, "marketCapUsd": str(price * 19_000_000 / rank),
+            "volumeUsd24Hr": str(price * 100_000), "priceUsd": str(price),
+            "changePercent24Hr": str(_seeded(asset_id, now // 86_400_000) * 10 - 5), "vwap24Hr": str(price),
+            "explorer": f"https://example.com/{asset_id}",
+        }
+
+    def route(self, method, path, query, body, handler):
+        now = int(time.time() * 1000)
+        match = re.fullmatch(r"/v2/assets/([^/]+)/history", path)
+        if match:
+            asset_id = match.group(1)
+            if asset_id not in self.ASSETS:
+                return 404, {"error": f"{asset_id} not found"}
+            interval = query.get("interval")
+            if interval not in self.INTERVALS_MS:
+                return 400, {"error": "missing interval"}
+            step = self.INTERVALS_MS[interval]
+            end = int(query.get("end", now))
+            start = int(query.get("start", end - 86_400_000 * 365))
+            if end <= start:
+                return 400, {"error": "end must be greater than start"}
+            first = (start + step - 1) // step * step
+            points = [
+                {"priceUsd": str(self._price(asset_id, t)), "time": t,
+                 "date": datetime.fromtimestamp(t / 1000, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")}
+                for t in range(first, min(end, now), step)
+            ]
+            return 200, {"data": points, "timestamp": now}
+        match = re.fullmatch(r"/v2/assets/([^/]+)", path)
+        if match:
+            if match.group(1) not in self.ASSETS:
+                return 404, {"error": f"{match.group(1)} not found"}
+            return 200, {"data": self._asset(match.group(1)), "timestamp": now}
+        if path == "/v2/assets":
+            ids = query["ids"].split(",") if query.get("ids") else self.ASSETS
+            assets = [self._asset(asset_id) for asset_id in ids if asset_id in self.ASSETS]
+            return 200, {"data": assets[: int(query.get("limit", 100))], "timestamp": now}
+        return 404, {"error": "not found"}
+
+class NagerStandIn(StandIn):
+    COUNTRIES = ["US", "TR", "DE", "FR", "GB", "CA", "BR", "IT", "ES", "NL", "JP", "AU", "MX"]
+    FIXED = [("01-01", "New Year's Day"), ("05-01", "Labour Day"), ("12-25", "Christmas Day"), ("11-11", "Veterans Day")]
+
+    def _holidays(self, year: int, country: str) -> list:
+        holidays = []
+        for month_day, name in self.FIXED:
+            holidays.append({
+                "date": f"{year}-{month_day}", "localName": name, "name": name, "countryCode": country,
+                "fixed": True, "global": True, "counties": None, "launchYear": None, "types": ["Public"],
+            })
+        # One movable holiday per country, different every year.
+        movable = date(year, 3, 1) + timedelta(days=int(_seeded(country, year) * 200))
+        holidays.append({
+            "date": movable.isoformat(), "localName": f"{country} Day", "name": f"{country} Day",
+            "countryCode": country, "fixed": False, "global": True, "counties": None,
+            "launchYear": None, "types": ["Public"],
+        })
+        return sorted(holidays, key=lambda holiday: holiday["date"])
+
+    def _next(self, country: str) -> list:
+        today = date.today()
+        upcoming = self._holidays(today.year, country) + self._holidays(today.year + 1, country)
+        return [holiday for holiday in upcoming if today.isoformat() <= holiday["date"] < (today + timedelta(days=365)).isoformat()]
+
+    def route(self, method, path, query, body, handler):
+        match = re.fullmatch(r"/api/v3/PublicHolidays/(\d{4})/([A-Za-z]{2})", path)
+        if match:
+            country = match.group(2).upper()
+            if country not in self.COUNTRIES:
+                return 404, None
+            return 200, self._holidays(int(match.group(1)), country)
+        match = re.fullmatch(r"/api/v3/NextPublicHolidays/([A-Za-z]{2})", path)
+        if match:
+            country = match.group(1).upper()
+            if country not in self.COUNTRIES:
+                return 404, None
+            return 200, self._next(country)
+        if path == "/api/v3/NextPublicHolidaysWorldwide":
+            upcoming = [holiday for country in self.COUNTRIES for holiday in self._next(country)]
+            return 200, sorted(upcoming, key=lambda holiday: holiday["date"])[:50]
+        match = re.fullmatch(r"/api/v3/IsTodayPublicHoliday/([A-Za-z]{2})", path)
+        if match:
+            today = date.today().isoformat()
+            holiday = any(h["date"] == today for h in self._holidays(date.today().year, match.group(1).upper()))
+            return (200 if holiday else 204), None
+        if path == "/api/v3/AvailableCountries":
+            return 200, [{"countryCode": country, "name": country} for country in self.COUNTRIES]
+        return 404, None
+
+class WeatherApiStandIn(StandIn):
+    def _condition(self, city: str, day: int) -> dict:
+        conditions = ["Sunny", "Partly cloudy", "Cloudy", "Light rain", "Snow"]
+        return {"text": conditions[int(_seeded(city, day) * len(conditions))], "icon": "", "code": 1000}
+
+    def route(self, method, path, query, body, handler):
+        if not query.get("key"):
+            return 401, {"error": {"code": 1002, "message": "API key is invalid or not provided."}}
+        city = query.get("q")
+        if not city:
+            return 400, {"error": {"code": 1003, "message": "Parameter q is missing."}}
+        today = date.today()
+        temperature = round(30 * _seeded(city, today) - 5, 1)
+        location = {"name": city, "region": "", "country": "", "lat": 0.0, "lon": 0.0,
+                    "tz_id": "UTC", "localtime": datetime.now().strftime("%Y-%m-%d %H:%M")}
+        current = {"temp_c": temperature, "temp_f": round(temperature * 1.8 + 32, 1),
+                   "condition": self._condition(city, today.toordinal()), "wind_kph": 12.0, "humidity": 60,
+                   "feelslike_c": temperature - 1, "uv": 3.0, "last_updated_epoch": int(time.time())}
+        if path == "/v1/current.json":
+            return 200, {"location": location, "current": current}
+        if path == "/v1/forecast.json":
+            days = int(query.get("days", 1))
+            forecastday = []
+            for offset in range(days):
+                day = today + timedelta(days=offset)
+                high = round(30 * _seeded(city, day) - 5, 1)
+                forecastday.append({
+                    "date": day.isoformat(),
+                    "day": {"maxtemp_c": high, "mintemp_c": high - 8, "condition": self._condition(city, day.toordinal()),
+                            "daily_chance_of_rain": int(100 * _seeded(city, day, "rain"))},
+                    "astro": {"sunrise": "06:30 AM", "sunset": "07:45 PM"},
+                    "hour": [{"time": f"{day} {hour:02d}:00", "temp_c": high - 8 + 8 * math.sin(hour / 24 * math.pi),
+                              "condition": self._condition(city, hour)} for hour in range(24)],
+                })
+            return 200, {"location": location, "current": current, "forecast": {"forecastday": forecastday}}
+        return 404, {"error": {"code": 1005, "message": "API URL is invalid."}}
+
+class DeepSeekStandIn(StandIn):
+    """
+    Mimics DeepSeek chat completions.
+
+    Request-builder prompts get an APIRequest built by the fast path, or a
+    per-API default when the fast path misses; humanizer prompts get a canned
+    answer of `answer_tokens` tokens. `latency` is the time to first token and
+    `token_latency` the delay between streamed tokens.
+    """
+
+    API_NAMES = {"CoinCap v2": "coincap", "Nager.Date v3": "nager", "WeatherAPI": "weatherapi"}
+    DEFAULT_REQUESTS = {
+        "coincap": {"method": "GET", "server": "https://api.coincap.io", "path": "/v2/assets/bitcoin"},
+        "nager": {"method": "GET", "server": "https://date.nager.at", "path": "/api/v3/NextPublicHolidays/US"},
+        "weatherapi": {"method": "GET", "server": "http://api.weatherapi.com/v1", "path": "/forecast.json",
+                       "query": {"q": "London", "days": "3", "key": "standin"}},
+    }
+
+    def __init__(self, latency: float = 0.2, token_latency: float = 0.005, answer_tokens: int = 60, fail_rate: float = 0.0):
+        super().__init__(latency)
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.fail_rate = fail_rate
+        # A private builder, so the stand-in does not skew the pipeline's fast-path stats.
+        self._builder = FastPathBuilder()
+
+    def _completion_text(self, system_prompt: str, user_prompt: str) -> str:
+        match = re.search(r"HTTP request builder for (.+?) API", system_prompt)
+        if match is None:
+            words = ["Here", "is", "what", "the", "API", "says:"] + ["data"] * self.answer_tokens
+            return " ".join(words[: self.answer_tokens])
+        api = self.API_NAMES.get(match.group(1), "coincap")
+        api_request = self._builder.build(user_prompt, api)
+        request = api_request.model_dump() if api_request is not None else dict(self.DEFAULT_REQUESTS[api])
+        if api == "weatherapi":
+            request.setdefault("query", {})
+            request["query"] = dict(request["query"] or {}, key="standin")
+        return "```json\n" + json.dumps(request) + "\n```"
+
+    def route(self, method, path, query, body, handler):
+        if method != "POST" or not path.endswith("/chat/completions"):
+            return 404, {"error": "not found"}
+        if self.fail_rate and _seeded(time.time_ns()) < self.fail_rate:
+            return 503, {"error": {"message": "Service unavailable (stand-in)"}}
+        messages = body["messages"]
+        system_prompt = next((m["content"] for m in messages if m["role"] == "system"), "")
+        user_prompt = next((m["content"] for m in messages if m["role"] == "user"), "")
+        text = self._completion_text(system_prompt, user_prompt)
+        tokens = re.findall(r"\S+\s*", text) or [text]
+        usage = {"prompt_tokens": (len(system_prompt) + len(user_prompt)) // 4,
+                 "completion_tokens": len(tokens), "total_tokens": (len(system_prompt) + len(user_prompt)) // 4 + len(tokens)}
+
+        if not body.get("stream"):
+            time.sleep(self.token_latency * len(tokens))
+            return 200, {
+                "id": "standin", "object": "chat.completion", "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+
+        def send_event(payload: str):
+            event = f"data: {payload}\n\n".encode()
+            handler.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+            handler.wfile.flush()
+
+        for token in tokens:
+            send_event(json.dumps({"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}))
+            time.sleep(self.token_latency)
+        send_event(json.dumps({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}))
+        send_event("[DONE]")
+        handler.wfile.write(b"0\r\n\r\n")
+        return 200, _STREAMED
+
+def start_standins(deepseek_latency: float = 0.2, token_latency: float = 0.005, upstream_latency: float = 0.05,
+                   deepseek_fail_rate: float = 0.0) -> dict:
+    """
+    Start every stand-in and point the pipeline at them.
+
+    Returns:
+        dict: The running stand-ins by name.
+    """
+    import tools.deepseek as deepseek
+    from tools.http_client import set_url_overrides
+
+    standins = {
+        "deepseek": DeepSeekStandIn(deepseek_latency, token_latency, fail_rate=deepseek_fail_rate).start(),
+        "coincap": CoinCapStandIn(upstream_latency).start(),
+        "nager": NagerStandIn(upstream_latency).start(),
+        "weatherapi": WeatherApiStandIn(upstream_latency).start(),
+    }
+    set_url_overrides({
+        deepseek.API_URL.rsplit("/chat/completions", 1)[0]: standins["deepseek"].url,
+        "https://api.coincap.io": standins["coincap"].url,
+        "https://date.nager.at": standins["nager"].url,
+        "http://api.weatherapi.com": standins["weatherapi"].url,
+        "https://api.weatherapi.com": standins["weatherapi"].url,
+    })
+    return standins
+
+def stop_standins(standins: dict):
+    from tools.http_client import set_url_overrides
+    set_url_overrides({})
+    for standin in standins.values():
+        standin.stop()
@@ -1,38 +1,47 @@
-from tools.router import route_query
-from tools.humanized_api import make_humanized_api_request
+from tools.router_pool import router_pool
+from tools.humanized_api import stream_humanized_api_request
 
-while True:
-    print("How can I help you today? You can ask me questions related to the weather, public holidays, and cryptocurrencies.")
-    user_query = input("> ")
-
-    selected_route = route_query(user_query)
-    print("Selected route: ", selected_route)
+def print_streamed_response(user_query, api):
+    print("API Mediator response: ", end="", flush=True)
+    for chunk in stream_humanized_api_request(user_query, api):
+        print(chunk, end="", flush=True)
     print()
 
-    if selected_route == "weather":
-        print("Routing to the weather API(WeatherApi).")
+def main():
+    while True:
+        print("How can I help you today? You can ask me questions related to the weather, public holidays, and cryptocurrencies.")
+        user_query = input("> ")
 
-        response = make_humanized_api_request(user_query, "weatherapi")
-        print("API Mediator response: ", response)
-        print()
-    elif selected_route == "finance":
-        print("Routing to the finance API.")
-    elif selected_route == "news":
-        print("Routing to the news API.")
-    elif selected_route == "coin":
-        print("Routing to the coin API(CoinCap).")
-
-        response = make_humanized_api_request(user_query, "coincap")
-        print("API Mediator response: ", response)
+        # Routed through the pool, so the semantic request cache reuses the query's embedding.
+        selected_route = router_pool.route(user_query).name
+        print("Selected route: ", selected_route)
         print()
-    elif selected_route == "public_holidays":
-        print("Routing to the public holidays API(Nager.Date).")
 
-        response = make_humanized_api_request(user_query, "nager")
-        print("API Mediator response: ", response)
-        print()
-    else:
-        print("I can only answer questions about the weather, finance, news, and cryptocurrencies.")
-        print()
+        if selected_route == "weather":
+            print("Routing to the weather API(WeatherApi).")
+
+            print_streamed_response(user_query, "weatherapi")
+            print()
+        elif selected_route == "finance":
+            print("Routing to the finance API.")
+        elif selected_route == "news":
+            print("Routing to the news API.")
+        elif selected_route == "coin":
+            print("Routing to the coin API(CoinCap).")
+
+            print_streamed_response(user_query, "coincap")
+            print()
+        elif selected_route == "public_holidays":
+            print("Routing to the public holidays API(Nager.Date).")
+
+            print_streamed_response(user_query, "nager")
+            print()
+        else:
+            print("I can only answer questions about the weather, finance, news, and cryptocurrencies.")
+            print()
+
+        print("-" * 100)
 
-    print("-" * 100)
\ No newline at end of file
+# Guarded, so processes spawned by the tools (e.g. `router_pool.start()`) do not run the prompt loop.
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+import uvicorn
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from tools import example_bank
+from tools.capture import warm_start
+from tools.fast_path import fast_path_builder
+from tools.holiday_index import async_run_refresh_job
+from tools.http_client import aclose_client
+from tools.humanized_api import async_make_humanized_api_request, async_stream_humanized_api_request
+from tools.response_cache import response_cache
+from tools.router import candidate_apis
+from tools.router_pool import router_pool
+from tools.semantic_cache import semantic_request_cache
+from tools.single_flight import deepseek_flights, deepseek_stream_flights, upstream_flights
+from tools.tracing import metrics, span
+
+load_dotenv()
+
+HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+PORT = int(os.getenv("SERVER_PORT", "8000"))
+# Queries processed at once; LLM and upstream I/O of all of them overlap.
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "256"))
+# Queries allowed to wait for a slot before new ones are rejected with 503.
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "512"))
+# Threads for blocking startup work, and for the encoder when ROUTER_PROCESSES=0.
+ROUTER_WORKERS = int(os.getenv("ROUTER_WORKERS", str(min(4, os.cpu_count() or 1))))
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30"))
+
+UNSUPPORTED_ROUTE_MESSAGE = "I can only answer questions about the weather, public holidays, and cryptocurrencies."
+
+class QueryRequest(BaseModel):
+    query: str
+
+class QueryResponse(BaseModel):
+    route: Optional[str] = None
+    api: Optional[str] = None
+    answer: str
+
+class Overloaded(Exception):
+    pass
+
+class AdmissionController:
+    """
+    Caps concurrent queries and the queue of queries waiting for a slot.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.queued = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    def overloaded(self) -> bool:
+        return self.in_flight >= self.max_in_flight and self.queued >= self.max_queue
+
+    @asynccontextmanager
+    async def admit(self):
+        if self.overloaded():
+            metrics.increment("server.rejected")
+            raise Overloaded()
+        self.queued += 1
+        self._publish()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        self._publish()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("server.in_flight", self.in_flight)
+        metrics.set_gauge("server.queue_depth", self.queued)
+        metrics.observe("server.queue_depth", self.queued)
+
+router_executor = ThreadPoolExecutor(max_workers=ROUTER_WORKERS, thread_name_prefix="router")
+admission = AdmissionController(MAX_IN_FLIGHT, MAX_QUEUE)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the router workers (encoder, route index) and load the example indexes before taking traffic.
+    await asyncio.get_running_loop().run_in_executor(router_executor, router_pool.start)
+    await asyncio.get_running_loop().run_in_executor(router_executor, example_bank.warmup)
+    # Start with the response cache of the last hours of traffic (WARM_START_HOURS).
+    await asyncio.get_running_loop().run_in_executor(router_executor, warm_start)
+    holiday_refresh = asyncio.create_task(async_run_refresh_job())
+    yield
+    # Uvicorn has stopped accepting connections and drained in-flight requests.
+    holiday_refresh.cancel()
+    router_executor.shutdown(wait=True)
+    router_pool.close()
+    await aclose_client()
+
+app = FastAPI(title="API Mediator", lifespan=lifespan)
+
+async def _route(query: str):
+    """
+    Route a query.
+
+    Returns:
+        tuple: (route name, API to ask, alternative API to try too when routing was ambiguous).
+    """
+    route_result = await router_pool.async_route(query, executor=router_executor)
+    apis = candidate_apis(route_result)
+    return route_result.name, apis[0] if apis else None, apis[1] if len(apis) > 1 else None
+
+def _overloaded_response() -> JSONResponse:
+    return JSONResponse({"error": "Server is overloaded, please retry."}, status_code=503, headers={"Retry-After": "1"})
+
+@app.post("/query", response_model=QueryResponse)
+async def query(request: QueryRequest):
+    try:
+        async with admission.admit():
+            with span("request", endpoint="query"):
+                route, api, alternative_api = await _route(request.query)
+                if api is None:
+                    return QueryResponse(route=route, answer=UNSUPPORTED_ROUTE_MESSAGE)
+                answer = await async_make_humanized_api_request(request.query, api, alternative_api)
+                return QueryResponse(route=route, api=api, answer=answer)
+    except Overloaded:
+        return _overloaded_response()
+
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest):
+    """
+    Stream the answer as newline-delimited JSON events: first {"route", "api"},
+    then {"delta"} pieces as the answer is generated, then {"done": true}.
+    """
+    if admission.overloaded():
+        metrics.increment("server.rejected")
+        return _overloaded_response()
+
+    async def events():
+        try:
+            async with admission.admit():
+                route, api, alternative_api = await _route(request.query)
+                yield json.dumps({"route": route, "api": api}) + "\n"
+                if api is None:
+                    yield json.dumps({"delta": UNSUPPORTED_ROUTE_MESSAGE}) + "\n"
+                else:
+                    async for content in async_stream_humanized_api_request(request.query, api, alternative_api):
+                        yield json.dumps({"delta": content}, ensure_ascii=False) + "\n"
+                yield json.dumps({"done": True}) + "\n"
+        except Overloaded:
+            yield json.dumps({"error": "Server is overloaded, please retry."}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        **metrics.snapshot(),
+        "admission": {"in_flight": admission.in_flight, "queued": admission.queued,
+                      "max_in_flight": admission.max_in_flight, "max_queue": admission.max_queue},
+        "router": router_pool.stats(),
+        "fast_path": fast_path_builder.stats(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_request_cache.stats(),
+        "single_flight": {"upstream": upstream_flights.stats(), "deepseek": deepseek_flights.stats(), "deepseek_stream": deepseek_stream_flights.stats()},
+    }
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=HOST, port=PORT, timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS)
@@ -1,27 +1,328 @@
-import requests
-from pydantic import BaseModel
-from typing import Optional
+import asyncio
+import os
+import time
+import httpx
+from dotenv import load_dotenv
+from pydantic import BaseModel, PrivateAttr, computed_field
+from typing import Any, Optional
+from tools import json_codec
+from tools.capture import ReplayMiss, capture_log, describe_api_request
+from tools.history_store import HISTORY_GAP_CONCURRENCY, history_store
+from tools.holiday_index import PUBLIC_HOLIDAYS_PATTERN, holiday_index
 from tools.models import APIRequest
-import json
+from tools.http_client import get_async_client, rewrite_url, run_sync
+from tools.response_cache import canonical_request_key, response_cache
+from tools.retry import Deadline, retry_policy
+from tools.single_flight import upstream_flights
+from tools.tracing import Span, metrics, span
+
+load_dotenv()
+
+# How much of an upstream error body is kept to explain the failure to the builder.
+MAX_ERROR_DETAIL_CHARS = 500
+# Larger upstream bodies are refused while streaming, before they are fully in memory.
+MAX_RESPONSE_BODY_BYTES = int(os.getenv("MAX_RESPONSE_BODY_BYTES", str(16 * 1024 * 1024)))
+
+_UNPARSED = object()
+
+class ResponseTooLarge(httpx.HTTPError):
+    """The upstream response body is larger than MAX_RESPONSE_BODY_BYTES."""
 
 class ApiRequestorResponse(BaseModel):
+    """
+    Result of an API request.
+
+    A successful response keeps the upstream body as the raw bytes it arrived
+    in; the text (`api_response`) and the parsed JSON (`data()`) are only
+    produced when asked for, once. Build it with either `api_response=` (text)
+    or `body=` (bytes).
+    """
+
     result: str
     message: Optional[str] = None
-    api_response: Optional[str] = None
+    status_code: Optional[int] = None
+    _body: Optional[bytes] = PrivateAttr(default=None)
+    _text: Optional[str] = PrivateAttr(default=None)
+    _data: Any = PrivateAttr(default_factory=lambda: _UNPARSED)
+
+    def __init__(self, api_response: Optional[str] = None, body: Optional[bytes] = None, **fields):
+        super().__init__(**fields)
+        self._text = api_response
+        self._body = body
+
+    @computed_field
+    @property
+    def api_response(self) -> Optional[str]:
+        """The response body as text."""
+        if self._text is None and self._body is not None:
+            self._text = self._body.decode("utf-8", errors="replace")
+        return self._text
+
+    @property
+    def body(self) -> Optional[bytes]:
+        """The response body as raw bytes."""
+        if self._body is None and self._text is not None:
+            self._body = self._text.encode()
+        return self._body
+
+    def data(self) -> Any:
+        """
+        The parsed response body, parsed on first use and shared afterwards; do not modify it.
+
+        Raises:
+            json.JSONDecodeError: If the body is not valid JSON.
+        """
+        if self._data is _UNPARSED:
+            self._data = json_codec.loads(self._body if self._body is not None else self._text)
+        return self._data
+
+async def async_send_request(api_request: APIRequest, deadline: Optional[Deadline] = None) -> ApiRequestorResponse:
+    """
+    Send an API request, re-sending it on 429/5xx and transport errors.
+
+    Identical requests already in flight share one upstream call.
+
+    Args:
+        api_request (APIRequest): The request to send.
+        deadline (Deadline, optional): The deadline of the user request.
+
+    Returns:
+        ApiRequestorResponse: The response. On a 4xx the message carries the
+            upstream error, so the request builder can correct the request.
+    """
+    if history_store.handles(api_request):
+        return await _async_send_history_request(api_request, deadline)
+    if holiday_index.handles(api_request):
+        indexed_response = await _async_answer_from_holiday_index(api_request, deadline)
+        if indexed_response is not None:
+            return indexed_response
+
+    with span("upstream", server=api_request.server, path=api_request.path) as upstream_span:
+        cached_response = await response_cache.async_get(api_request)
+        upstream_span.set(cache_hit=cached_response is not None)
+        metrics.increment("response_cache.hit" if cached_response is not None else "response_cache.miss")
+        if isinstance(cached_response, bytes):
+            return ApiRequestorResponse(result="success", body=cached_response)
+        if cached_response is not None:
+            return ApiRequestorResponse(result="success", api_response=cached_response)
+
+        response = await upstream_flights.do(
+            canonical_request_key(api_request), lambda: _async_fetch(api_request, deadline, upstream_span)
+        )
+
+    match = PUBLIC_HOLIDAYS_PATTERN.match("/" + api_request.path.lstrip("/"))
+    if match and response.result == "success" and holiday_index.handles(api_request):
+        try:
+            await holiday_index.async_record(match.group("country"), int(match.group("year")), response.data())
+        except ValueError as e:
+            print(f"Could not index the holidays: {e}")
+    return response
+
+async def async_send_upstream(api_request: APIRequest, deadline: Optional[Deadline] = None) -> ApiRequestorResponse:
+    """
+    Send an API request upstream, bypassing the response cache and the local
+    stores. Used by the stores themselves to fill and refresh their data.
+
+    Args:
+        api_request (APIRequest): The request to send.
+        deadline (Deadline, optional): The deadline of the caller.
+
+    Returns:
+        ApiRequestorResponse: The response.
+    """
+    with span("upstream", server=api_request.server, path=api_request.path) as upstream_span:
+        return await upstream_flights.do(
+            canonical_request_key(api_request), lambda: _async_fetch(api_request, deadline, upstream_span, cache=False)
+        )
+
+async def _async_answer_from_holiday_index(api_request: APIRequest, deadline: Optional[Deadline] = None) -> Optional[ApiRequestorResponse]:
+    """
+    Answer a Nager.Date request from the local holiday index.
 
-def send_request(api_request: APIRequest) -> ApiRequestorResponse:
+    Returns:
+        Optional[ApiRequestorResponse]: The response, or None when the request must go upstream.
+    """
+    with span("holiday_index", path=api_request.path) as index_span:
+        indexed_response = holiday_index.answer(api_request)
+        missing_year = holiday_index.missing_year(api_request)
+        if indexed_response is None and missing_year is not None:
+            # Nager.Date has no cross-country endpoint, and downloading every country's list of
+            # the year is too slow for a request; it is filled in the background instead.
+            holiday_index.schedule_fill([missing_year])
+            index_span.status = "error"
+            metrics.increment("holiday_index.filling")
+            return ApiRequestorResponse(
+                result="error", message=f"The holidays of {missing_year} are still being downloaded. Please try again in a minute."
+            )
+        index_span.set(hit=indexed_response is not None)
+        metrics.increment("holiday_index.hit" if indexed_response is not None else "holiday_index.miss")
+        if indexed_response is None:
+            return None
+        return ApiRequestorResponse(result="success", api_response=indexed_response)
+
+async def _async_send_history_request(api_request: APIRequest, deadline: Optional[Deadline] = None) -> ApiRequestorResponse:
+    """
+    Answer a CoinCap history request from the local history store, fetching
+    only the parts of its time range the store does not have yet.
+    """
+    with span("history_store", path=api_request.path) as history_span:
+        missing_requests = history_store.missing_requests(api_request)
+        history_span.set(missing_requests=len(missing_requests))
+        metrics.increment("history_store.hit" if not missing_requests else "history_store.miss")
+
+        semaphore = asyncio.Semaphore(HISTORY_GAP_CONCURRENCY)
+
+        async def fill(gap_request: APIRequest) -> Optional[ApiRequestorResponse]:
+            # Each chunk is stored as soon as it arrives, so a failed chunk does not lose the others.
+            async with semaphore:
+                response = await async_send_upstream(gap_request, deadline)
+            if response.result != "success":
+                return response
+            try:
+                await history_store.async_record(gap_request, response.body)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                print(f"Could not store the history: {e}")
+                return ApiRequestorResponse(result="error", message="The API answered with a malformed history.")
+            return None
+
+        errors = [error for error in await asyncio.gather(*(fill(gap_request) for gap_request in missing_requests)) if error]
+        if errors:
+            history_span.status = "error"
+            return errors[0]
+
+        return ApiRequestorResponse(result="success", body=history_store.read(api_request))
+
+async def _read_body(response: httpx.Response, max_bytes: int) -> bytes:
+    """
+    Read a streamed response body, refusing it as soon as it grows past `max_bytes`.
+
+    Raises:
+        ResponseTooLarge: If the body is larger than `max_bytes`.
+    """
+    content_length = response.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise ResponseTooLarge(f"The API response is {content_length} bytes, more than the {max_bytes} allowed.")
+    chunks = []
+    size = 0
+    async for chunk in response.aiter_bytes():
+        size += len(chunk)
+        if size > max_bytes:
+            raise ResponseTooLarge(f"The API response is larger than the {max_bytes} bytes allowed.")
+        chunks.append(chunk)
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+def _is_json(response: httpx.Response, api_response: ApiRequestorResponse) -> bool:
+    """
+    Whether a successful response carries a JSON body.
+
+    A body declared as JSON is trusted without parsing it here, so it is
+    parsed once, where it is used. Anything else is parsed to find out, and
+    the parse is kept on the response.
+    """
+    if "json" in response.headers.get("content-type", "").lower():
+        return True
+    try:
+        api_response.data()
+    except ValueError:
+        return False
+    return True
+
+async def _async_fetch(api_request: APIRequest, deadline: Optional[Deadline], upstream_span: Span, cache: bool = True) -> ApiRequestorResponse:
+    """Fetch a request upstream, or from the capture log in replay mode, and log the exchange in record mode."""
+    key = canonical_request_key(api_request)
+    if capture_log.replaying:
+        upstream_span.set(replayed=True)
+        try:
+            recorded = await capture_log.replay("upstream", key)
+        except ReplayMiss as e:
+            upstream_span.status = "error"
+            return ApiRequestorResponse(result="error", message=str(e))
+        body = recorded["body"].encode() if recorded.get("body") is not None else None
+        return ApiRequestorResponse(
+            result=recorded["result"], message=recorded.get("message"), status_code=recorded.get("status_code"), body=body
+        )
+
+    started = time.perf_counter()
+    response = await _async_fetch_live(api_request, deadline, upstream_span, cache)
+    if capture_log.recording:
+        capture_log.record("upstream", key, describe_api_request(api_request), {
+            "result": response.result, "message": response.message,
+            "status_code": response.status_code, "body": response.api_response,
+        }, time.perf_counter() - started)
+    return response
+
+async def _async_fetch_live(api_request: APIRequest, deadline: Optional[Deadline], upstream_span: Span, cache: bool = True) -> ApiRequestorResponse:
     try:
-        url = api_request.to_full_url()
-        response = requests.request(
+        client = get_async_client()
+        upstream_request = client.build_request(
             method=api_request.method,
-            url=url,
+            url=rewrite_url(api_request.to_full_url()),
             headers=api_request.headers,
             json=api_request.body,  # Body is sent as JSON
         )
 
-        response.raise_for_status()  # Raise an error for bad status codes
-        
-        return ApiRequestorResponse(result="success", api_response=json.dumps(response.json()))
-    except requests.exceptions.RequestException as e:
+        async def send(timeout):
+            upstream_request.extensions["timeout"] = timeout.as_dict()
+            return await client.send(upstream_request, stream=True)
+
+        response = await retry_policy.send("upstream", send, deadline)
+        try:
+            if 400 <= response.status_code < 500 and not retry_policy.is_retryable(response.status_code):
+                detail = (await _read_body(response, MAX_RESPONSE_BODY_BYTES))[:MAX_ERROR_DETAIL_CHARS].decode("utf-8", errors="replace")
+                print(f"API Request failed: {response.status_code} {detail}")
+                upstream_span.set(status=response.status_code)
+                upstream_span.status = "error"
+                metrics.increment("upstream.client_errors")
+                return ApiRequestorResponse(
+                    result="error",
+                    message=f"The API answered {response.status_code}: {detail}",
+                    status_code=response.status_code,
+                )
+
+            response.raise_for_status()  # Raise an error for bad status codes
+
+            # Kept as the raw bytes; parsed only where a stage needs the structure.
+            body = await _read_body(response, MAX_RESPONSE_BODY_BYTES)
+        finally:
+            await response.aclose()
+        upstream_span.set(status=response.status_code, payload_bytes=len(body))
+        metrics.observe("upstream.payload_bytes", len(body))
+
+        if not body.strip():
+            # Some endpoints answer with the status alone (Nager.Date's IsTodayPublicHoliday: 200
+            # for a holiday, 204 otherwise); spell it out, so the answer survives caching and reduction.
+            upstream_span.set(empty=True)
+            body = json_codec.dumps_bytes({"statusCode": response.status_code})
+
+        api_response = ApiRequestorResponse(result="success", body=body, status_code=response.status_code)
+        if not _is_json(response, api_response):
+            # An HTML error page behind a 2xx: never cached, recorded or indexed.
+            print(f"API Request failed: {response.status_code} with a body that is not JSON")
+            upstream_span.status = "error"
+            metrics.increment("upstream.not_json")
+            return ApiRequestorResponse(
+                result="error", message="The API answered with a response that is not JSON.", status_code=response.status_code
+            )
+
+        if cache:
+            await response_cache.async_set(api_request, body)
+
+        return api_response
+    except ResponseTooLarge as e:
         print(f"API Request failed: {e}")
-        return ApiRequestorResponse(result="error", message="An error occurred during the API request.")
+        upstream_span.status = "error"
+        upstream_span.set(error=repr(e))
+        metrics.increment("upstream.too_large")
+        return ApiRequestorResponse(result="error", message=str(e))
+    except httpx.HTTPError as e:
+        print(f"API Request failed: {e}")
+        upstream_span.status = "error"
+        upstream_span.set(error=repr(e))
+        metrics.increment("upstream.errors")
+        status_code = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+        return ApiRequestorResponse(
+            result="error", message="An error occurred during the API request.", status_code=status_code
+        )
+
+def send_request(api_request: APIRequest, deadline: Optional[Deadline] = None) -> ApiRequestorResponse:
+    return run_sync(async_send_request(api_request, deadline))
@@ -0,0 +1,183 @@
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterator, Optional, Tuple
+import httpx
+from dotenv import load_dotenv
+from tools.models import APIRequest
+from tools.response_cache import VOLATILE_QUERY_KEYS, response_cache
+from tools.tracing import metrics
+
+load_dotenv()
+
+# Bumped when the record layout changes; records of other versions are skipped.
+CAPTURE_VERSION = 1
+# off: nothing is captured. record: every DeepSeek and upstream exchange is appended to the log.
+# replay: exchanges are answered from the log, without network.
+CAPTURE_MODE = os.getenv("CAPTURE_MODE", "off").lower()
+CAPTURE_DIR = os.getenv("CAPTURE_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "capture"
+)
+# Replayed exchanges take their recorded latency times this factor (0 answers at once).
+# Keeping the recorded pace makes races, like speculative builds, end as they did when recorded.
+CAPTURE_REPLAY_LATENCY = float(os.getenv("CAPTURE_REPLAY_LATENCY", "1"))
+# A log file is closed once it reaches this size; the oldest files beyond CAPTURE_MAX_FILES are deleted.
+CAPTURE_MAX_FILE_BYTES = int(os.getenv("CAPTURE_MAX_FILE_BYTES", str(64 * 1024 * 1024)))
+CAPTURE_MAX_FILES = int(os.getenv("CAPTURE_MAX_FILES", "20"))
+# Upstream responses of the last N hours of the log are loaded into the response cache at boot (0 disables it).
+WARM_START_HOURS = float(os.getenv("WARM_START_HOURS", "0"))
+
+class ReplayMiss(httpx.HTTPError):
+    """No recorded exchange matches a call made in replay mode."""
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+def describe_api_request(api_request: APIRequest) -> dict:
+    """The request as recorded: credentials (volatile query keys) are left out."""
+    query = {key: value for key, value in (api_request.query or {}).items() if key.lower() not in VOLATILE_QUERY_KEYS}
+    return {
+        "method": api_request.method,
+        "server": api_request.server,
+        "path": api_request.path,
+        "query": query or None,
+        "body": api_request.body,
+    }
+
+class CaptureLog:
+    """
+    Log of DeepSeek and upstream exchanges, for replay and cache warming.
+
+    Each record is one JSON line: {"v", "kind", "key", "at", "latency",
+    "request", "response"}, where `key` is the key the call is coalesced on
+    (the prompt hash or the canonical request key). Every process appends to
+    its own file, `capture-<start time>-<pid>.jsonl`, and starts a new one
+    when it grows past CAPTURE_MAX_FILE_BYTES, so writers never share a file.
+    """
+
+    def __init__(self, directory: str = CAPTURE_DIR, mode: str = CAPTURE_MODE,
+                 max_file_bytes: int = CAPTURE_MAX_FILE_BYTES, max_files: int = CAPTURE_MAX_FILES):
+        self.directory = directory
+        self.mode = mode
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._file = None
+        self._replay_index: Optional[Dict[Tuple[str, str], Deque[dict]]] = None
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def record(self, kind: str, key: str, request: dict, response: dict, latency: float):
+        """Append one exchange to the log (only in record mode)."""
+        if not self.recording:
+            return
+        line = json.dumps({
+            "v": CAPTURE_VERSION, "kind": kind, "key": key, "at": time.time(),
+            "latency": round(latency, 4), "request": request, "response": response,
+        }, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.max_file_bytes:
+                self._rotate()
+            self._file.write(line + "\n")
+            self._file.flush()
+        metrics.increment(f"capture.{kind}.recorded")
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"capture-{time.time_ns()}-{os.getpid()}.jsonl")
+        self._file = open(path, "a", encoding="utf-8")
+        for old_path in self._paths()[: -self.max_files]:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def _paths(self):
+        # Named after their start time, so sorting by name sorts them by age.
+        return sorted(glob.glob(os.path.join(self.directory, "capture-*.jsonl")), key=os.path.basename)
+
+    def read(self, since: Optional[float] = None) -> Iterator[dict]:
+        """
+        Iterate over the logged records, oldest file first.
+
+        Args:
+            since (float, optional): Skip records older than this Unix time.
+        """
+        for path in self._paths():
+            if since is not None and os.path.getmtime(path) < since:
+                continue
+            with open(path, encoding="utf-8") as capture_file:
+                for line in capture_file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # A line cut short by a crash.
+                    if record.get("v") != CAPTURE_VERSION or (since is not None and record["at"] < since):
+                        continue
+                    yield record
+
+    async def replay(self, kind: str, key: str) -> dict:
+        """
+        Return the recorded response of an exchange, after its recorded latency
+        (scaled by CAPTURE_REPLAY_LATENCY).
+
+        A key recorded several times (a live quote fetched again, a completion
+        sampled again) replays its responses in the recorded order, then keeps
+        returning the last one, so everything derived from them, like the
+        humanizer prompts, matches the recording too.
+
+        Raises:
+            ReplayMiss: If the log has no such exchange.
+        """
+        with self._lock:
+            if self._replay_index is None:
+                self._replay_index = {}
+                for record in self.read():
+                    self._replay_index.setdefault((record["kind"], record["key"]), deque()).append(record)
+                print(f"Loaded {len(self._replay_index)} exchanges to replay from {self.directory}.")
+            responses = self._replay_index.get((kind, key))
+            record = (responses.popleft() if len(responses) > 1 else responses[0]) if responses else None
+        if record is None:
+            metrics.increment(f"capture.{kind}.replay_misses")
+            raise ReplayMiss(f"No recorded {kind} exchange for {key}")
+        metrics.increment(f"capture.{kind}.replayed")
+        if CAPTURE_REPLAY_LATENCY > 0:
+            await asyncio.sleep(record["latency"] * CAPTURE_REPLAY_LATENCY)
+        return record["response"]
+
+capture_log = CaptureLog()
+
+def warm_start(hours: float = WARM_START_HOURS) -> int:
+    """
+    Load the upstream responses logged in the last hours into the response cache.
+
+    Entries keep the expiry they had when they were recorded, so nothing stale
+    is served. Run it at boot so a fresh worker does not start cold.
+
+    Returns:
+        int: The number of responses loaded.
+    """
+    if hours <= 0:
+        return 0
+    loaded = 0
+    for record in capture_log.read(since=time.time() - hours * 3600):
+        response = record["response"]
+        if record["kind"] != "upstream" or response.get("result") != "success":
+            continue
+        if response_cache.set(APIRequest(**record["request"]), response["body"].encode(), stored_at=record["at"]):
+            loaded += 1
+    print(f"Warmed the response cache with {loaded} responses from the capture log.")
+    return loaded
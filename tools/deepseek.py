@@ -1,16 +1,22 @@
 import os
-import requests
+import json
+import time
+import httpx
+from contextlib import aclosing
+from typing import AsyncIterator, Iterator, Optional
 from dotenv import load_dotenv
+from tools.capture import capture_log, text_hash
+from tools.http_client import get_async_client, iterate_sync, rewrite_url, run_sync
+from tools.retry import Deadline, DeadlineExceeded, retry_policy
+from tools.single_flight import deepseek_flights, deepseek_stream_flights, prompt_key
+from tools.tracing import Span, finish_span, record_usage, span, start_span
 
 load_dotenv()
 
 API_KEY = os.getenv('DEEPSEEK_API_KEY')
-API_URL = "https://api.deepseek.com/chat/completions"
+API_URL = os.getenv('DEEPSEEK_API_URL', "https://api.deepseek.com/chat/completions")
 
-def call_deepseek(user_prompt: str, system_prompt: str):
-    """
-    Internal helper to send prompt + system instructions to DeepSeek Chat.
-    """
+def _build_request(user_prompt: str, system_prompt: str, stream: bool):
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {API_KEY}",
@@ -21,9 +27,176 @@ def call_deepseek(user_prompt: str, system_prompt: str):
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ],
-        "stream": False,
+        "stream": stream,
+    }
+    return headers, data
+
+async def async_call_deepseek(user_prompt: str, system_prompt: str, deadline: Optional[Deadline] = None):
+    """
+    Internal helper to send prompt + system instructions to DeepSeek Chat.
+
+    Rate limits, server errors and dropped connections are retried with backoff
+    until the deadline. Identical prompts already in flight share one call.
+    """
+    headers, data = _build_request(user_prompt, system_prompt, stream=False)
+
+    async def send(timeout):
+        return await get_async_client().post(rewrite_url(API_URL), headers=headers, json=data, timeout=timeout)
+
+    key = prompt_key(data["model"], system_prompt, user_prompt)
+
+    async def call():
+        if capture_log.replaying:
+            deepseek_span.set(replayed=True)
+            return await _async_replayed_completion(key)
+        started = time.perf_counter()
+        response = await retry_policy.send("deepseek", send, deadline)
+        deepseek_span.set(status=response.status_code)
+        response.raise_for_status()
+        response_data = response.json()
+        record_usage(response_data.get("usage"), target_span=deepseek_span)
+        _record_completion(key, data["model"], system_prompt, user_prompt, response_data["choices"][0]["message"]["content"],
+                           response_data.get("usage"), time.perf_counter() - started)
+        return response_data
+
+    with span("deepseek", stream=False) as deepseek_span:
+        return await deepseek_flights.do(key, call)
+
+def _record_completion(key: str, model: str, system_prompt: str, user_prompt: str, content: str, usage: Optional[dict], latency: float):
+    # The system prompt is long and repeated across calls; the log keeps its hash only.
+    capture_log.record(
+        "deepseek", key,
+        {"model": model, "system_prompt_hash": text_hash(system_prompt), "user_prompt": user_prompt},
+        {"content": content, "usage": usage},
+        latency,
+    )
+
+async def _async_replayed_completion(key: str) -> dict:
+    recorded = await capture_log.replay("deepseek", key)
+    return {
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": recorded["content"]}, "finish_reason": "stop"}],
+        "usage": recorded.get("usage"),
     }
 
-    response = requests.post(API_URL, headers=headers, json=data)
-    response.raise_for_status()
-    return response.json()
\ No newline at end of file
+def call_deepseek(user_prompt: str, system_prompt: str, deadline: Optional[Deadline] = None):
+    """
+    Blocking wrapper around `async_call_deepseek`.
+    """
+    return run_sync(async_call_deepseek(user_prompt, system_prompt, deadline))
+
+def parse_sse_line(line: str):
+    """
+    Parse one line of a DeepSeek server-sent event stream.
+
+    Args:
+        line (str): A line of the stream, without the trailing newline.
+
+    Returns:
+        The decoded chunk, the string "[DONE]" at the end of the stream, or
+        None for blank lines, comments and keep-alives.
+    """
+    if not line.startswith("data:"):
+        return None
+    payload = line[len("data:"):].strip()
+    if payload == "[DONE]":
+        return payload
+    return json.loads(payload)
+
+async def async_stream_deepseek(user_prompt: str, system_prompt: str, parent_span: Optional[Span] = None, deadline: Optional[Deadline] = None) -> AsyncIterator[str]:
+    """
+    Stream a DeepSeek Chat completion, yielding content deltas as they arrive.
+
+    Opening the stream is retried like `async_call_deepseek`; once content has
+    been yielded, a failure is raised instead, since it cannot be taken back.
+    Identical prompts already streaming share one completion: a later caller
+    gets the deltas produced so far, then the rest as they arrive.
+    """
+    _, data = _build_request(user_prompt, system_prompt, stream=True)
+    key = prompt_key(data["model"], system_prompt, user_prompt)
+    async with aclosing(deepseek_stream_flights.stream(
+        key, lambda: _async_stream_completion(user_prompt, system_prompt, parent_span, deadline)
+    )) as stream:
+        async for content in stream:
+            yield content
+
+async def _async_stream_completion(user_prompt: str, system_prompt: str, parent_span: Optional[Span] = None, deadline: Optional[Deadline] = None) -> AsyncIterator[str]:
+    headers, data = _build_request(user_prompt, system_prompt, stream=True)
+
+    deepseek_span = start_span("deepseek", parent=parent_span, stream=True)
+    started = time.perf_counter()
+    error = None
+    attempt = 0
+    yielded = False
+    key = prompt_key(data["model"], system_prompt, user_prompt)
+    contents = []
+    usage = None
+    try:
+        if capture_log.replaying:
+            deepseek_span.set(replayed=True)
+            yield (await _async_replayed_completion(key))["choices"][0]["message"]["content"]
+            return
+        while True:
+            # One child span per attempt, so retries show up in the trace with their own timing.
+            attempt_span = start_span("http_attempt", parent=deepseek_span, stage="deepseek", number=attempt + 1)
+            attempt_error = None
+            retry_after = None
+            try:
+                async with get_async_client().stream(
+                    "POST", rewrite_url(API_URL), headers=headers, json=data, timeout=retry_policy.timeout(deadline)
+                ) as response:
+                    deepseek_span.set(status=response.status_code)
+                    attempt_span.set(status=response.status_code)
+                    if retry_policy.is_retryable(response.status_code):
+                        retry_after = response.headers.get("Retry-After")
+                    else:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            chunk = parse_sse_line(line)
+                            if chunk is None:
+                                continue
+                            if chunk == "[DONE]":
+                                break
+                            # The final chunk carries the token usage of the whole completion.
+                            record_usage(chunk.get("usage"), target_span=deepseek_span)
+                            usage = chunk.get("usage") or usage
+                            for choice in chunk.get("choices") or []:
+                                content = (choice.get("delta") or {}).get("content")
+                                if content:
+                                    if "first_token_seconds" not in deepseek_span.attributes:
+                                        deepseek_span.set(first_token_seconds=time.perf_counter() - started)
+                                    yielded = True
+                                    if capture_log.recording:
+                                        contents.append(content)
+                                    yield content
+                        if capture_log.recording:
+                            _record_completion(key, data["model"], system_prompt, user_prompt, "".join(contents), usage, time.perf_counter() - started)
+                        return
+            except DeadlineExceeded as e:
+                attempt_error = e
+                raise
+            except httpx.TransportError as e:
+                attempt_error = e
+                if yielded:
+                    raise
+            except Exception as e:
+                attempt_error = e
+                raise
+            finally:
+                finish_span(attempt_span, attempt_error)
+            # A retryable status, or a transport error before any content was yielded.
+            if not await retry_policy.backoff("deepseek", attempt, deadline, retry_after):
+                if attempt_error is not None:
+                    raise attempt_error
+                response.raise_for_status()
+            attempt += 1
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        finish_span(deepseek_span, error)
+
+def stream_deepseek(user_prompt: str, system_prompt: str, deadline: Optional[Deadline] = None) -> Iterator[str]:
+    """
+    Blocking generator wrapper around `async_stream_deepseek`.
+    """
+    return iterate_sync(async_stream_deepseek(user_prompt, system_prompt, deadline=deadline))
@@ -0,0 +1,335 @@
+import os
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from pydantic import BaseModel
+from tools.history_store import INTERVALS_MS
+from tools.models import APIRequest
+
+load_dotenv()
+
+# Parameter specs:
+#   type:     "string" (default), "int", "timestamp_ms", "date" (YYYY-MM-DD), "country" (ISO 3166-1 alpha-2),
+#             "slug" (lowercase id like "bitcoin")
+#   required: the request is invalid without it
+#   min/max:  bounds of an "int"
+#   one_of:   allowed values, matched case-insensitively
+#   env:      the value always comes from this environment variable (credentials)
+# Endpoint constraints:
+#   ("range", start, end): both or neither given, and end > start (reversed ranges are swapped)
+#   ("one_required", a, b): at least one of the two is given
+# Query parameters missing from an endpoint's spec are errors: the builder is told which ones exist.
+COINCAP_PAGING = {"limit": {"type": "int", "min": 1, "max": 2000}, "offset": {"type": "int", "min": 0}}
+WEATHER_QUERY = {
+    "key": {"required": True, "env": "WEATHER_API_KEY"},
+    "q": {"required": True},
+    "lang": {},
+}
+
+ENDPOINT_CATALOG: Dict[str, dict] = {
+    "coincap": {
+        "server": "https://api.coincap.io",
+        "endpoints": [
+            {"path": "/v2/assets", "query": {"search": {}, "ids": {}, **COINCAP_PAGING}},
+            {"path": "/v2/assets/{id}", "params": {"id": {"type": "slug"}}},
+            {
+                "path": "/v2/assets/{id}/history",
+                "params": {"id": {"type": "slug"}},
+                "query": {
+                    "interval": {"required": True, "one_of": list(INTERVALS_MS)},
+                    "start": {"type": "timestamp_ms"},
+                    "end": {"type": "timestamp_ms"},
+                },
+                "constraints": [("range", "start", "end")],
+            },
+            {"path": "/v2/assets/{id}/markets", "params": {"id": {"type": "slug"}}, "query": COINCAP_PAGING},
+            {"path": "/v2/rates"},
+            {"path": "/v2/rates/{id}", "params": {"id": {"type": "slug"}}},
+            {"path": "/v2/exchanges"},
+            {"path": "/v2/exchanges/{id}", "params": {"id": {"type": "slug"}}},
+            {
+                "path": "/v2/markets",
+                "query": {"exchangeId": {}, "baseSymbol": {}, "quoteSymbol": {}, "baseId": {}, "quoteId": {},
+                          "assetSymbol": {}, "assetId": {}, **COINCAP_PAGING},
+            },
+            {
+                "path": "/v2/candles",
+                "query": {
+                    "exchange": {"required": True}, "baseId": {"required": True}, "quoteId": {"required": True},
+                    "interval": {"required": True, "one_of": ["m1", "m5", "m15", "m30", "h1", "h2", "h4", "h8", "h12", "d1", "w1"]},
+                    "start": {"type": "timestamp_ms"}, "end": {"type": "timestamp_ms"},
+                },
+                "constraints": [("range", "start", "end")],
+            },
+        ],
+    },
+    "nager": {
+        "server": "https://date.nager.at",
+        "endpoints": [
+            {"path": "/api/v3/PublicHolidays/{year}/{countryCode}",
+             "params": {"year": {"type": "int", "min": 1975, "max": 2075}, "countryCode": {"type": "country"}}},
+            {"path": "/api/v3/NextPublicHolidays/{countryCode}", "params": {"countryCode": {"type": "country"}}},
+            {"path": "/api/v3/NextPublicHolidaysWorldwide"},
+            {"path": "/api/v3/IsTodayPublicHoliday/{countryCode}", "params": {"countryCode": {"type": "country"}},
+             "query": {"countyCode": {}, "offset": {"type": "int", "min": -12, "max": 12}}},
+            {"path": "/api/v3/LongWeekend/{year}/{countryCode}",
+             "params": {"year": {"type": "int", "min": 1975, "max": 2075}, "countryCode": {"type": "country"}},
+             "query": {"subdivisionCode": {}}},
+            {"path": "/api/v3/CountryInfo/{countryCode}", "params": {"countryCode": {"type": "country"}}},
+            {"path": "/api/v3/AvailableCountries"},
+            # Answered by the local holiday index (see tools.holiday_index).
+            {"path": "/api/v3/PublicHolidaysOnDate/{date}", "params": {"date": {"type": "date"}}},
+        ],
+    },
+    "weatherapi": {
+        "server": "http://api.weatherapi.com/v1",
+        "endpoints": [
+            {"path": "/current.json", "query": {**WEATHER_QUERY, "aqi": {"one_of": ["yes", "no"]}}},
+            {
+                "path": "/forecast.json",
+                "query": {
+                    **WEATHER_QUERY,
+                    "days": {"type": "int", "min": 1, "max": 14},
+                    "dt": {"type": "date"},
+                    "unixdt": {"type": "int", "min": 0},
+                    "hour": {"type": "int", "min": 0, "max": 23},
+                    "aqi": {"one_of": ["yes", "no"]},
+                    "alerts": {"one_of": ["yes", "no"]},
+                    "tp": {"one_of": ["15"]},
+                },
+            },
+            {
+                "path": "/history.json",
+                "query": {**WEATHER_QUERY, "dt": {"type": "date"}, "unixdt": {"type": "int", "min": 0},
+                          "end_dt": {"type": "date"}, "unixend_dt": {"type": "int", "min": 0},
+                          "hour": {"type": "int", "min": 0, "max": 23}, "tp": {"one_of": ["15"]}},
+                "constraints": [("one_required", "dt", "unixdt")],
+            },
+            {"path": "/future.json", "query": {**WEATHER_QUERY, "dt": {"required": True, "type": "date"}}},
+            {"path": "/astronomy.json", "query": {**WEATHER_QUERY, "dt": {"type": "date"}}},
+            {
+                "path": "/marine.json",
+                "query": {**WEATHER_QUERY, "days": {"type": "int", "min": 1, "max": 7}, "dt": {"type": "date"},
+                          "unixdt": {"type": "int", "min": 0}, "hour": {"type": "int", "min": 0, "max": 23},
+                          "tides": {"one_of": ["yes", "no"]}, "tp": {"one_of": ["15"]}},
+            },
+            {"path": "/alerts.json", "query": WEATHER_QUERY},
+            {"path": "/timezone.json", "query": WEATHER_QUERY},
+            {"path": "/search.json", "query": WEATHER_QUERY},
+            {"path": "/ip.json", "query": WEATHER_QUERY},
+        ],
+    },
+}
+
+DATE_PATTERN = re.compile(r"^\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])$")
+SLUG_PATTERN = re.compile(r"^[a-z0-9]+(-[a-z0-9]+)*$")
+# Timestamps below this are in seconds, not milliseconds (it is March 1973 in ms).
+MIN_TIMESTAMP_MS = 100_000_000_000
+
+class ValidationResult(BaseModel):
+    api_request: APIRequest  # The request with the fixes applied
+    errors: List[str] = []
+    fixes: List[str] = []
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+def _check_value(name: str, value: str, spec: dict) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Check one parameter value against its spec.
+
+    Returns:
+        tuple: (the value, fixed if needed; a description of the fix; an error).
+    """
+    if spec.get("env") and os.getenv(spec["env"]):
+        expected = os.getenv(spec["env"])
+        return expected, None if value == expected else f"{name} set from {spec['env']}", None
+
+    value_type = spec.get("type", "string")
+    if value_type == "string" and not value.strip():
+        return value, None, f"{name} must not be empty"
+    if value_type in ("int", "timestamp_ms"):
+        if not re.fullmatch(r"-?\d+", value.strip()):
+            return value, None, f"{name} must be an integer, got {value!r}"
+        number = int(value)
+        if value_type == "timestamp_ms" and 0 < number < MIN_TIMESTAMP_MS:
+            return str(number * 1000), f"{name} converted from seconds to milliseconds", None
+        if "min" in spec and number < spec["min"]:
+            return value, None, f"{name} must be at least {spec['min']}, got {number}"
+        if "max" in spec and number > spec["max"]:
+            return value, None, f"{name} must be at most {spec['max']}, got {number}"
+        if value != str(number):
+            return str(number), f"{name} normalized", None
+    if value_type == "date" and not DATE_PATTERN.match(value):
+        return value, None, f"{name} must be a date as YYYY-MM-DD, got {value!r}"
+    if value_type == "country":
+        if not re.fullmatch(r"[A-Za-z]{2}", value):
+            return value, None, f"{name} must be a two-letter ISO 3166-1 country code, got {value!r}"
+        if value != value.upper():
+            return value.upper(), f"{name} upper-cased", None
+    if value_type == "slug":
+        slug = re.sub(r"\s+", "-", value.strip().lower())
+        if not SLUG_PATTERN.match(slug):
+            return value, None, f"{name} must be a lowercase id like 'bitcoin', got {value!r}"
+        if slug != value:
+            return slug, f"{name} normalized to {slug!r}", None
+    if "one_of" in spec:
+        allowed = {option.lower(): option for option in spec["one_of"]}
+        if value.lower() not in allowed:
+            return value, None, f"{name} must be one of {', '.join(spec['one_of'])}, got {value!r}"
+        if value != allowed[value.lower()]:
+            return allowed[value.lower()], f"{name} normalized", None
+    return value, None, None
+
+class _Endpoint:
+    """An endpoint of the catalog, compiled into a path matcher and parameter checks."""
+
+    def __init__(self, spec: dict):
+        self.template = spec["path"]
+        self.method = spec.get("method", "GET")
+        self.params: Dict[str, dict] = spec.get("params", {})
+        self.query: Dict[str, dict] = spec.get("query", {})
+        self.constraints: List[tuple] = spec.get("constraints", [])
+        pattern = re.sub(r"\\\{(\w+)\\\}", r"(?P<\1>[^/]+)", re.escape(self.template))
+        self.pattern = re.compile(f"^{pattern}$", re.IGNORECASE)
+        self.literal_prefix = self.template.split("{", 1)[0]
+
+    def check(self, path: str, query: Dict[str, str], errors: List[str], fixes: List[str]) -> Tuple[str, Dict[str, str]]:
+        """Check the parameters of a request matching this endpoint; return its fixed path and query."""
+        match = self.pattern.match(path)
+        values = match.groupdict()
+        for name, spec in self.params.items():
+            values[name], fix, error = _check_value(name, values[name], spec)
+            fixes.extend([fix] if fix else [])
+            errors.extend([error] if error else [])
+        fixed_path = self.template.format(**values)
+
+        fixed_query: Dict[str, str] = {}
+        for name, value in query.items():
+            spec = self.query.get(name)
+            if spec is None:
+                # Not dropped: some would change what the request asks for (e.g. a sort order).
+                known = ", ".join(self.query) or "none"
+                errors.append(f"unknown query parameter {name} for {self.template} (known parameters: {known})")
+                continue
+            fixed_query[name], fix, error = _check_value(name, str(value), spec)
+            fixes.extend([fix] if fix else [])
+            errors.extend([error] if error else [])
+        for name, spec in self.query.items():
+            if name in fixed_query or not spec.get("required"):
+                continue
+            if spec.get("env") and os.getenv(spec["env"]):
+                fixed_query[name] = os.getenv(spec["env"])
+                fixes.append(f"{name} added from {spec['env']}")
+            else:
+                errors.append(f"{name} is required")
+
+        for constraint in self.constraints:
+            if constraint[0] == "range":
+                self._check_range(fixed_query, constraint[1], constraint[2], errors, fixes)
+            elif constraint[0] == "one_required" and not (constraint[1] in fixed_query or constraint[2] in fixed_query):
+                errors.append(f"{constraint[1]} or {constraint[2]} is required")
+        return fixed_path, fixed_query
+
+    @staticmethod
+    def _check_range(query: Dict[str, str], start: str, end: str, errors: List[str], fixes: List[str]):
+        if (start in query) != (end in query):
+            errors.append(f"{start} and {end} must be given together")
+            return
+        if start not in query:
+            return
+        try:
+            start_value, end_value = int(query[start]), int(query[end])
+        except ValueError:
+            return  # Already reported.
+        if start_value == end_value:
+            errors.append(f"{end} must be greater than {start}")
+        elif start_value > end_value:
+            query[start], query[end] = query[end], query[start]
+            fixes.append(f"{start} and {end} swapped")
+
+class _Api:
+    def __init__(self, name: str, spec: dict):
+        self.name = name
+        self.server = spec["server"]
+        server_url = urlsplit(self.server)
+        self.host = server_url.hostname
+        self.base_path = server_url.path.rstrip("/")
+        self.endpoints = [_Endpoint(endpoint) for endpoint in spec["endpoints"]]
+
+    def find(self, path: str) -> Optional[_Endpoint]:
+        for endpoint in self.endpoints:
+            if endpoint.pattern.match(path):
+                return endpoint
+        return None
+
+_apis = {name: _Api(name, spec) for name, spec in ENDPOINT_CATALOG.items()}
+_apis_by_host = {api.host: api for api in _apis.values()}
+
+def _endpoint_path(api: _Api, api_request: APIRequest) -> Tuple[Optional[str], Optional[str]]:
+    """Split the request URL against the API's base path; returns (endpoint path, server host)."""
+    server = api_request.server if "://" in api_request.server else f"https://{api_request.server}"
+    server_url = urlsplit(server)
+    full_path = server_url.path.rstrip("/") + "/" + api_request.path.lstrip("/")
+    if api.base_path and full_path.startswith(api.base_path + "/"):
+        full_path = full_path[len(api.base_path):]
+    return full_path, server_url.hostname
+
+def validate_request(api_request: APIRequest, api: Optional[str] = None) -> ValidationResult:
+    """
+    Check a generated request against the endpoint catalog, before it is sent.
+
+    Cheap, unambiguous mistakes are fixed (the server of the API, case of ids
+    and country codes, seconds instead of milliseconds, a reversed time range,
+    the WeatherAPI key...); anything else is reported precisely enough for the
+    request builder to correct it.
+
+    Args:
+        api_request (APIRequest): The request to check.
+        api (str, optional): The API the request is meant for; found from the server if not given.
+
+    Returns:
+        ValidationResult: The fixed request, the fixes applied and the errors left.
+    """
+    errors: List[str] = []
+    fixes: List[str] = []
+    catalog_api = _apis.get(api) if api else None
+    if catalog_api is None:
+        server = api_request.server if "://" in api_request.server else f"https://{api_request.server}"
+        catalog_api = _apis_by_host.get(urlsplit(server).hostname)
+        if catalog_api is None:
+            return ValidationResult(api_request=api_request, errors=[f"Unknown server {api_request.server}"])
+
+    path, host = _endpoint_path(catalog_api, api_request)
+    if host in _apis_by_host and _apis_by_host[host] is not catalog_api:
+        return ValidationResult(
+            api_request=api_request,
+            errors=[f"{api_request.server} is not the {catalog_api.name} API; its server is {catalog_api.server}"],
+        )
+    endpoint = catalog_api.find(path)
+    if endpoint is None:
+        known_paths = ", ".join(endpoint.template for endpoint in catalog_api.endpoints)
+        return ValidationResult(
+            api_request=api_request, errors=[f"Unknown path {path}; the {catalog_api.name} API has {known_paths}"]
+        )
+
+    method = api_request.method
+    if method != endpoint.method:
+        if api_request.body:
+            errors.append(f"{endpoint.template} takes {endpoint.method}, not {method}")
+        else:
+            method = endpoint.method
+            fixes.append(f"method changed to {endpoint.method}")
+
+    fixed_path, fixed_query = endpoint.check(path, api_request.query or {}, errors, fixes)
+    server = api_request.server.rstrip("/")
+    if host != catalog_api.host or urlsplit(server if "://" in server else f"https://{server}").path.rstrip("/") != catalog_api.base_path:
+        server = catalog_api.server
+        fixes.append(f"server changed to {catalog_api.server}")
+    if fixed_path != path:
+        fixes.append(f"path changed to {fixed_path}")
+
+    fixed_request = api_request.model_copy(update={"method": method, "server": server, "path": fixed_path, "query": fixed_query or None})
+    return ValidationResult(api_request=fixed_request, errors=errors, fixes=fixes)
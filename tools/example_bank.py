@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from tools.models import InteractionExample
+from tools.router import ENCODER_NAME, ROUTE_INDEX_DIR, get_encoder
+
+load_dotenv()
+
+# One JSONL file per API: {"prompt": ..., "response": <request object or list of them>} per line.
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+# Examples put in each request-builder prompt.
+EXAMPLES_PER_PROMPT = int(os.getenv("EXAMPLES_PER_PROMPT", "3"))
+
+_lock = threading.RLock()
+_examples: Dict[str, List[InteractionExample]] = {}
+_indexes: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+def load_examples(api: str) -> List[InteractionExample]:
+    """
+    Load and validate the example bank of an API.
+
+    `{WEATHER_API_KEY}` in a response is replaced with the configured key.
+
+    Args:
+        api (str): The name of the API (coincap, nager, or weatherapi).
+
+    Returns:
+        List[InteractionExample]: The examples, in file order.
+    """
+    if api not in _examples:
+        with _lock:
+            if api not in _examples:
+                examples = []
+                with open(os.path.join(EXAMPLES_DIR, f"{api}.jsonl"), encoding="utf-8") as examples_file:
+                    for line in examples_file:
+                        if not line.strip():
+                            continue
+                        record = json.loads(line)
+                        response = json.dumps(record["response"], indent=4, ensure_ascii=False)
+                        response = response.replace("{WEATHER_API_KEY}", os.getenv("WEATHER_API_KEY") or "")
+                        examples.append(InteractionExample(prompt=record["prompt"], response=response))
+                _examples[api] = examples
+    return _examples[api]
+
+def _example_index_path(api: str, examples: List[InteractionExample]) -> str:
+    payload = json.dumps([ENCODER_NAME, [example.prompt for example in examples]], ensure_ascii=False)
+    return os.path.join(ROUTE_INDEX_DIR, f"examples-{api}-{hashlib.sha256(payload.encode()).hexdigest()[:16]}.npy")
+
+def get_example_index(api: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the prompt embeddings of an API's examples and their norms.
+
+    Like the route index, the embeddings are computed once, stored under
+    ROUTE_INDEX_DIR in a file named after a hash of the encoder and the
+    prompts, and memory-mapped.
+
+    Returns:
+        tuple: (embeddings matrix, row norms).
+    """
+    if api not in _indexes:
+        with _lock:
+            if api not in _indexes:
+                examples = load_examples(api)
+                path = _example_index_path(api, examples)
+                if not os.path.exists(path):
+                    print(f"Building example index at {path}.")
+                    embeddings = np.asarray(get_encoder()([example.prompt for example in examples]), dtype=np.float32)
+                    os.makedirs(ROUTE_INDEX_DIR, exist_ok=True)
+                    temporary_path = f"{path}.{os.getpid()}.tmp"
+                    with open(temporary_path, "wb") as index_file:
+                        np.save(index_file, embeddings)
+                    os.replace(temporary_path, path)
+                embeddings = np.load(path, mmap_mode="r")
+                _indexes[api] = (embeddings, np.linalg.norm(embeddings, axis=1))
+    return _indexes[api]
+
+def select_examples(api: str, user_prompt: Optional[str] = None, vector=None, k: int = EXAMPLES_PER_PROMPT) -> List[InteractionExample]:
+    """
+    Pick the examples most similar to the user prompt.
+
+    Args:
+        api (str): The name of the API (coincap, nager, or weatherapi).
+        user_prompt (str, optional): The user prompt; without it the first k examples are used.
+        vector (optional): The prompt's embedding, if already computed by the router.
+        k (int): How many examples to return.
+
+    Returns:
+        List[InteractionExample]: The examples, least similar first, so the closest one sits next to the question.
+    """
+    examples = load_examples(api)
+    if len(examples) <= k or (user_prompt is None and vector is None):
+        return examples[:k]
+    if vector is None:
+        vector = get_encoder()([user_prompt])[0]
+    embeddings, norms = get_example_index(api)
+    query = np.asarray(vector, dtype=np.float32)
+    similarities = (embeddings @ query) / (norms * np.linalg.norm(query))
+    top = np.argpartition(similarities, -k)[-k:]
+    return [examples[index] for index in top[np.argsort(similarities[top])]]
+
+def warmup():
+    """Load and index every example bank ahead of the first query."""
+    for file_name in sorted(os.listdir(EXAMPLES_DIR)):
+        if file_name.endswith(".jsonl"):
+            get_example_index(file_name[: -len(".jsonl")])
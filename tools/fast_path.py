@@ -0,0 +1,228 @@
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from tools.models import APIRequest
+
+load_dotenv()
+
+# CoinCap asset ids by the names, symbols and Turkish spellings users type.
+COINCAP_ASSETS: Dict[str, str] = {
+    "bitcoin": "bitcoin", "btc": "bitcoin",
+    "ethereum": "ethereum", "eth": "ethereum", "ether": "ethereum",
+    "litecoin": "litecoin", "ltc": "litecoin",
+    "dogecoin": "dogecoin", "doge": "dogecoin",
+    "cardano": "cardano",
+    "solana": "solana",
+    "ripple": "xrp", "xrp": "xrp",
+    "polkadot": "polkadot",
+    "binance coin": "binance-coin", "bnb": "binance-coin",
+    "avalanche": "avalanche", "avax": "avalanche",
+    "chainlink": "chainlink",
+    "uniswap": "uniswap",
+    "tether": "tether", "usdt": "tether",
+    "usd coin": "usd-coin", "usdc": "usd-coin",
+    "tron": "tron", "trx": "tron",
+    "shiba inu": "shiba-inu", "shib": "shiba-inu",
+    "polygon": "polygon", "matic": "polygon",
+    "stellar": "stellar", "xlm": "stellar",
+    "monero": "monero", "xmr": "monero",
+}
+
+# ISO 3166-1 alpha-2 codes by English and Turkish country names.
+COUNTRIES: Dict[str, str] = {
+    "united states": "US", "usa": "US", "america": "US", "abd": "US", "amerika": "US",
+    "turkey": "TR", "türkiye": "TR", "turkiye": "TR",
+    "germany": "DE", "almanya": "DE",
+    "france": "FR", "fransa": "FR",
+    "united kingdom": "GB", "uk": "GB", "england": "GB", "ingiltere": "GB", "birleşik krallık": "GB",
+    "canada": "CA", "kanada": "CA",
+    "brazil": "BR", "brezilya": "BR",
+    "italy": "IT", "italya": "IT",
+    "spain": "ES", "ispanya": "ES",
+    "netherlands": "NL", "hollanda": "NL",
+    "japan": "JP", "japonya": "JP",
+    "australia": "AU", "avustralya": "AU",
+    "mexico": "MX", "meksika": "MX",
+    "russia": "RU", "rusya": "RU",
+    "china": "CN", "çin": "CN",
+    "india": "IN", "hindistan": "IN",
+    "greece": "GR", "yunanistan": "GR",
+    "austria": "AT", "avusturya": "AT",
+    "switzerland": "CH", "isviçre": "CH",
+    "sweden": "SE", "isveç": "SE",
+    "norway": "NO", "norveç": "NO",
+    "poland": "PL", "polonya": "PL",
+    "portugal": "PT", "portekiz": "PT",
+    "belgium": "BE", "belçika": "BE",
+}
+
+# WeatherAPI `q` values by English and Turkish city names.
+CITIES: Dict[str, str] = {
+    "istanbul": "Istanbul", "i̇stanbul": "Istanbul",
+    "ankara": "Ankara", "izmir": "Izmir", "i̇zmir": "Izmir", "antalya": "Antalya", "bursa": "Bursa",
+    "adana": "Adana", "konya": "Konya", "trabzon": "Trabzon", "eskişehir": "Eskisehir",
+    "new york": "New York City", "new york city": "New York City", "nyc": "New York City",
+    "london": "London", "londra": "London",
+    "paris": "Paris", "berlin": "Berlin", "tokyo": "Tokyo", "madrid": "Madrid",
+    "rome": "Rome", "roma": "Rome", "moscow": "Moscow", "moskova": "Moscow",
+    "los angeles": "Los Angeles", "chicago": "Chicago", "san francisco": "San Francisco",
+    "amsterdam": "Amsterdam", "vienna": "Vienna", "viyana": "Vienna",
+    "dubai": "Dubai", "sydney": "Sydney", "toronto": "Toronto", "beijing": "Beijing", "pekin": "Beijing",
+}
+
+# Turkish case suffixes that follow a proper noun, with or without an apostrophe
+# ("bitcoinin", "Ethereum'un", "İstanbul'da", "Türkiyede").
+TURKISH_SUFFIX = r"(?:'?(?:n?[ıiuü]n|[dt][ae]k?i?|n?[ıiuü]|y?[ae]|n?[ıiuü]n?da|n?[ıiuü]n?de))?"
+
+# Anything about a specific time, a range or the future needs the LLM.
+NEEDS_LLM_PATTERN = re.compile(
+    r"\d{4}|\b(was|were|on|at|ago|last|past|history|historical|chart|yesterday|tomorrow|forecast|"
+    r"will|week|month|year|hourly|daily|tonight|weekend|"
+    r"neydi|idi|tarihsel|grafi|son|geçen|dün|yarın|haftaya|hafta|ay|yıl|tahmin|olacak|olur|saatlik)\b",
+    re.IGNORECASE,
+)
+PRICE_PATTERN = re.compile(r"\b(price|prices|worth|cost|fiyat\w*|kaç dolar|ne kadar)\b", re.IGNORECASE)
+TOP_ASSETS_PATTERN = re.compile(
+    r"\b(?:top|largest|biggest|en büyük|en yüksek)\s+(?P<limit>\d{1,3})\s+(?:coin|coins|crypto|cryptocurrencies|kripto|cryptos)",
+    re.IGNORECASE,
+)
+NEXT_HOLIDAYS_PATTERN = re.compile(
+    r"\b(next|upcoming|önümüzdeki|sonraki|yaklaşan|gelecek)\b.*\b(public holidays?|holidays|resmi tatil\w*|tatil\w*)",
+    re.IGNORECASE,
+)
+CURRENT_WEATHER_PATTERN = re.compile(r"\b(weather|temperature|hava\w*|sıcaklık\w*)\b", re.IGNORECASE)
+
+def _gazetteer_pattern(names) -> re.Pattern:
+    alternatives = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)(?P<name>{alternatives}){TURKISH_SUFFIX}(?!\w)", re.IGNORECASE)
+
+_asset_pattern = _gazetteer_pattern(COINCAP_ASSETS)
+_country_pattern = _gazetteer_pattern(COUNTRIES)
+_city_pattern = _gazetteer_pattern(CITIES)
+
+def _find_all(pattern: re.Pattern, gazetteer: Dict[str, str], text: str) -> List[str]:
+    found = []
+    for match in pattern.finditer(text):
+        value = gazetteer[match.group("name").lower()]
+        if value not in found:
+            found.append(value)
+    return found
+
+def prompt_entities(text: str) -> frozenset:
+    """
+    The assets, countries and cities a prompt names, as ("asset" | "country" | "city", value) pairs.
+
+    Spellings are resolved through the gazetteers, so "bitcoinin" and "BTC" give the same entity.
+    """
+    return frozenset(
+        [("asset", value) for value in _find_all(_asset_pattern, COINCAP_ASSETS, text)]
+        + [("country", value) for value in _find_all(_country_pattern, COUNTRIES, text)]
+        + [("city", value) for value in _find_all(_city_pattern, CITIES, text)]
+    )
+
+def _build_current_price(user_prompt: str) -> Optional[APIRequest]:
+    if not PRICE_PATTERN.search(user_prompt) or NEEDS_LLM_PATTERN.search(user_prompt):
+        return None
+    assets = _find_all(_asset_pattern, COINCAP_ASSETS, user_prompt)
+    if not assets:
+        return None
+    if len(assets) == 1:
+        return APIRequest(method="GET", server="https://api.coincap.io", path=f"/v2/assets/{assets[0]}")
+    # Several assets are looked up in one call.
+    return APIRequest(method="GET", server="https://api.coincap.io", path="/v2/assets", query={"ids": ",".join(assets)})
+
+def _build_top_assets(user_prompt: str) -> Optional[APIRequest]:
+    match = TOP_ASSETS_PATTERN.search(user_prompt)
+    if match is None:
+        return None
+    # CoinCap lists assets by rank, which is market cap order.
+    return APIRequest(
+        method="GET", server="https://api.coincap.io", path="/v2/assets", query={"limit": match.group("limit")}
+    )
+
+def _build_next_holidays(user_prompt: str) -> Optional[APIRequest]:
+    if not NEXT_HOLIDAYS_PATTERN.search(user_prompt):
+        return None
+    countries = _find_all(_country_pattern, COUNTRIES, user_prompt)
+    if len(countries) != 1:
+        return None
+    return APIRequest(method="GET", server="https://date.nager.at", path=f"/api/v3/NextPublicHolidays/{countries[0]}")
+
+def _build_current_weather(user_prompt: str) -> Optional[APIRequest]:
+    if not CURRENT_WEATHER_PATTERN.search(user_prompt) or NEEDS_LLM_PATTERN.search(user_prompt):
+        return None
+    cities = _find_all(_city_pattern, CITIES, user_prompt)
+    if len(cities) != 1:
+        return None
+    return APIRequest(
+        method="GET",
+        server="http://api.weatherapi.com/v1",
+        path="/current.json",
+        query={"q": cities[0], "key": os.getenv("WEATHER_API_KEY") or ""},
+    )
+
+# Intent builders per API, tried in order.
+INTENTS: Dict[str, List[Tuple[str, Callable[[str], Optional[APIRequest]]]]] = {
+    "coincap": [("top_assets", _build_top_assets), ("current_price", _build_current_price)],
+    "nager": [("next_public_holidays", _build_next_holidays)],
+    "weatherapi": [("current_weather", _build_current_weather)],
+}
+
+class FastPathBuilder:
+    """
+    Deterministic request builder for the most common intents.
+
+    It runs before the LLM and only answers when a compiled pattern and a
+    gazetteer lookup agree on a single, unambiguous request; anything else is
+    a miss and goes to the LLM builder.
+    """
+
+    def __init__(self, intents=INTENTS):
+        self.intents = intents
+        self._lock = threading.Lock()
+        self.hits_by_intent: Dict[str, int] = {}
+        self.misses = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    def build(self, user_prompt: str, api: str) -> Optional[APIRequest]:
+        """
+        Build the API request for a prompt without the LLM, if an intent matches.
+
+        Args:
+            user_prompt (str): The user prompt.
+            api (str): The name of the API(coincap, nager or weatherapi).
+
+        Returns:
+            Optional[APIRequest]: The request, or None on a miss.
+        """
+        started = time.perf_counter()
+        for intent, build in self.intents.get(api, []):
+            api_request = build(user_prompt)
+            if api_request is not None:
+                with self._lock:
+                    self.hits_by_intent[intent] = self.hits_by_intent.get(intent, 0) + 1
+                    self.hit_seconds += time.perf_counter() - started
+                return api_request
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += time.perf_counter() - started
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = sum(self.hits_by_intent.values())
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "hits_by_intent": dict(self.hits_by_intent),
+                "mean_hit_latency_ms": self.hit_seconds / hits * 1000 if hits else 0.0,
+                "mean_miss_latency_ms": self.miss_seconds / self.misses * 1000 if self.misses else 0.0,
+            }
+
+fast_path_builder = FastPathBuilder()
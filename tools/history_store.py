@@ -0,0 +1,262 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+from dotenv import load_dotenv
+from tools import json_codec
+from tools.models import APIRequest
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; concurrent writers from other processes are then not merged.
+    fcntl = None
+
+load_dotenv()
+
+HISTORY_STORE_DIR = os.getenv(
+    "HISTORY_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "history"),
+)
+
+# Spacing of the points of each CoinCap history interval.
+INTERVALS_MS: Dict[str, int] = {
+    "m1": 60_000, "m5": 300_000, "m15": 900_000, "m30": 1_800_000,
+    "h1": 3_600_000, "h2": 7_200_000, "h6": 21_600_000, "h12": 43_200_000, "d1": 86_400_000,
+}
+# Points asked for per upstream call when filling a gap.
+MAX_POINTS_PER_REQUEST = 2000
+# Gap requests of one history request in flight at once; CoinCap allows bursts of about 10.
+HISTORY_GAP_CONCURRENCY = int(os.getenv("HISTORY_GAP_CONCURRENCY", "3"))
+
+COINCAP_SERVER_PATTERN = re.compile(r"api\.coincap\.io")
+HISTORY_PATH_PATTERN = re.compile(r"^/v2/assets/(?P<asset>[\w-]+)/history$")
+
+def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _missing_ranges(covered: List[Tuple[int, int]], start: int, end: int) -> List[Tuple[int, int]]:
+    missing = []
+    cursor = start
+    for covered_start, covered_end in covered:
+        if covered_end <= cursor:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > cursor:
+            missing.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+    if cursor < end:
+        missing.append((cursor, end))
+    return missing
+
+def _iso_date(timestamp_ms: int) -> str:
+    moment = datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{timestamp_ms % 1000:03d}Z"
+
+class _Series:
+    """
+    Price history of one asset at one interval.
+
+    Stored as two sorted columns (`<asset>.<interval>.time.npy`, int64 ms, and
+    `<asset>.<interval>.price.npy`, float64 USD) that are memory-mapped on
+    load, plus the list of time ranges already fetched in `.coverage.json`.
+    Writers hold an exclusive `flock` on `.lock` and reload whatever another
+    process saved since, so points and coverage from several processes merge
+    instead of overwriting each other.
+    """
+
+    def __init__(self, directory: str, asset: str, interval: str):
+        self.base_path = os.path.join(directory, f"{asset}.{interval}")
+        self.lock = threading.Lock()
+        self.times = np.empty(0, dtype=np.int64)
+        self.prices = np.empty(0, dtype=np.float64)
+        self.covered: List[Tuple[int, int]] = []
+        self._loaded_version = None
+        self.reload()
+
+    def _version(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(f"{self.base_path}.coverage.json")
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def reload(self):
+        """Load the files again if another process replaced them since they were last read or written."""
+        version = self._version()
+        if version is None or version == self._loaded_version:
+            return
+        self.times = np.load(f"{self.base_path}.time.npy", mmap_mode="r")
+        self.prices = np.load(f"{self.base_path}.price.npy", mmap_mode="r")
+        with open(f"{self.base_path}.coverage.json") as coverage_file:
+            self.covered = [tuple(covered_range) for covered_range in json.load(coverage_file)]
+        self._loaded_version = version
+
+    def add(self, times: np.ndarray, prices: np.ndarray, start: int, end: int):
+        os.makedirs(os.path.dirname(self.base_path), exist_ok=True)
+        with open(f"{self.base_path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.reload()
+            all_times = np.concatenate([self.times, times])
+            all_prices = np.concatenate([self.prices, prices])
+            # Keep the newest value of duplicated timestamps.
+            order = np.argsort(all_times, kind="stable")[::-1]
+            unique_times, first = np.unique(all_times[order], return_index=True)
+            self.times = unique_times
+            self.prices = all_prices[order][first]
+            if end > start:
+                self.covered = _merge_ranges(self.covered + [(start, end)])
+            self._save()
+            # The lock is released when the file is closed.
+
+    def _save(self):
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        for column, values in (("time", self.times), ("price", self.prices)):
+            with open(f"{self.base_path}.{column}.npy{suffix}", "wb") as column_file:
+                np.save(column_file, values)
+        with open(f"{self.base_path}.coverage.json{suffix}", "w") as coverage_file:
+            json.dump(self.covered, coverage_file)
+        # Columns first and coverage last, so readers never see coverage without its points.
+        os.replace(f"{self.base_path}.time.npy{suffix}", f"{self.base_path}.time.npy")
+        os.replace(f"{self.base_path}.price.npy{suffix}", f"{self.base_path}.price.npy")
+        os.replace(f"{self.base_path}.coverage.json{suffix}", f"{self.base_path}.coverage.json")
+        self._loaded_version = self._version()
+
+    def slice(self, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+        first, last = np.searchsorted(self.times, [start, end], side="left")
+        return self.times[first:last], self.prices[first:last]
+
+class HistoryStore:
+    """
+    Local store of CoinCap price history.
+
+    A history request is answered from the store; only the parts of its time
+    range that were never fetched are requested upstream (in chunks of at most
+    MAX_POINTS_PER_REQUEST points), then merged in. Ranges reaching into the
+    last interval are not marked as covered, since new points still arrive.
+    """
+
+    def __init__(self, directory: str = HISTORY_STORE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], _Series] = {}
+
+    def _parse(self, api_request: APIRequest) -> Optional[Tuple[str, str, int, int]]:
+        if api_request.method != "GET" or not COINCAP_SERVER_PATTERN.search(api_request.server):
+            return None
+        match = HISTORY_PATH_PATTERN.match("/" + api_request.path.lstrip("/"))
+        query = api_request.query or {}
+        if match is None or query.get("interval") not in INTERVALS_MS or set(query) != {"interval", "start", "end"}:
+            return None
+        try:
+            start, end = int(query["start"]), int(query["end"])
+        except ValueError:
+            return None
+        if end <= start:
+            return None
+        return match.group("asset"), query["interval"], start, end
+
+    def handles(self, api_request: APIRequest) -> bool:
+        """Whether the request is a CoinCap history request with an explicit range, which the store can serve."""
+        return self._parse(api_request) is not None
+
+    def _get_series(self, asset: str, interval: str) -> _Series:
+        with self._lock:
+            series = self._series.get((asset, interval))
+            if series is None:
+                series = self._series[(asset, interval)] = _Series(self.directory, asset, interval)
+            return series
+
+    def missing_requests(self, api_request: APIRequest) -> List[APIRequest]:
+        """
+        The upstream requests needed to cover the request's time range.
+
+        Args:
+            api_request (APIRequest): A request the store handles.
+
+        Returns:
+            List[APIRequest]: History requests for the gaps; empty if the store can answer already.
+        """
+        asset, interval, start, end = self._parse(api_request)
+        series = self._get_series(asset, interval)
+        with series.lock:
+            series.reload()
+            gaps = _missing_ranges(series.covered, start, end)
+        chunk = INTERVALS_MS[interval] * MAX_POINTS_PER_REQUEST
+        requests = []
+        for gap_start, gap_end in gaps:
+            for chunk_start in range(gap_start, gap_end, chunk):
+                query = {"interval": interval, "start": str(chunk_start), "end": str(min(gap_end, chunk_start + chunk))}
+                requests.append(api_request.model_copy(update={"query": query}))
+        return requests
+
+    def record(self, api_request: APIRequest, api_response: Union[str, bytes]):
+        """
+        Merge the response of a gap request into the store.
+
+        Args:
+            api_request (APIRequest): One of the requests from `missing_requests`.
+            api_response (Union[str, bytes]): Its JSON response body.
+        """
+        asset, interval, start, end = self._parse(api_request)
+        points = json_codec.loads(api_response).get("data") or []
+        times = np.fromiter((int(point["time"]) for point in points), dtype=np.int64, count=len(points))
+        prices = np.fromiter((float(point["priceUsd"]) for point in points), dtype=np.float64, count=len(points))
+        # The current interval is still open; leave it uncovered so it is fetched again.
+        covered_end = min(end, int(time.time() * 1000) - INTERVALS_MS[interval])
+        series = self._get_series(asset, interval)
+        with series.lock:
+            series.add(times, prices, start, max(start, covered_end))
+
+    async def async_record(self, api_request: APIRequest, api_response: Union[str, bytes]):
+        """Like `record`, on a worker thread, so that rewriting the series files does not block the event loop."""
+        await asyncio.to_thread(self.record, api_request, api_response)
+
+    def query(self, asset: str, interval: str, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the stored points in [start, end), found by binary search.
+
+        Returns:
+            tuple: (timestamps in ms, USD prices).
+        """
+        series = self._get_series(asset, interval)
+        with series.lock:
+            series.reload()
+            times, prices = series.slice(start, end)
+            return np.array(times), np.array(prices)
+
+    def point(self, asset: str, interval: str, timestamp: int) -> Optional[Tuple[int, float]]:
+        """Return the last stored point at or before the timestamp, if any."""
+        series = self._get_series(asset, interval)
+        with series.lock:
+            series.reload()
+            index = int(np.searchsorted(series.times, timestamp, side="right")) - 1
+            if index < 0:
+                return None
+            return int(series.times[index]), float(series.prices[index])
+
+    def read(self, api_request: APIRequest) -> bytes:
+        """
+        Answer a history request from the store, as a JSON body in CoinCap's response format.
+        """
+        asset, interval, start, end = self._parse(api_request)
+        times, prices = self.query(asset, interval, start, end)
+        data = [
+            {"priceUsd": repr(float(price)), "time": int(timestamp), "date": _iso_date(int(timestamp))}
+            for timestamp, price in zip(times, prices)
+        ]
+        return json_codec.dumps_bytes({"data": data, "timestamp": int(time.time() * 1000)})
+
+history_store = HistoryStore()
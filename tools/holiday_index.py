@@ -0,0 +1,383 @@
+import asyncio
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from tools.models import APIRequest
+
+load_dotenv()
+
+HOLIDAY_INDEX_PATH = os.getenv("HOLIDAY_INDEX_PATH") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "holidays.json"
+)
+# How often the refresh job re-downloads the holidays.
+HOLIDAY_INDEX_REFRESH_SECONDS = int(os.getenv("HOLIDAY_INDEX_REFRESH_SECONDS", str(7 * 86_400)))
+
+NAGER_SERVER = "https://date.nager.at"
+NAGER_SERVER_PATTERN = re.compile(r"date\.nager\.at")
+PUBLIC_HOLIDAYS_PATTERN = re.compile(r"^/api/v3/PublicHolidays/(?P<year>\d{4})/(?P<country>[A-Za-z]{2})$")
+NEXT_PUBLIC_HOLIDAYS_PATTERN = re.compile(r"^/api/v3/NextPublicHolidays/(?P<country>[A-Za-z]{2})$")
+IS_TODAY_PUBLIC_HOLIDAY_PATTERN = re.compile(r"^/api/v3/IsTodayPublicHoliday/(?P<country>[A-Za-z]{2})$")
+# Not a Nager.Date endpoint: holidays of every country on one date, answered by the index only.
+PUBLIC_HOLIDAYS_ON_DATE_PATTERN = re.compile(r"^/api/v3/PublicHolidaysOnDate/(?P<date>\d{4}-\d{2}-\d{2})$")
+NEXT_PUBLIC_HOLIDAYS_WORLDWIDE_PATH = "/api/v3/NextPublicHolidaysWorldwide"
+
+def _path(api_request: APIRequest) -> str:
+    return "/" + api_request.path.lstrip("/")
+
+def _date_and_country(holiday: dict) -> Tuple[str, str]:
+    return holiday["date"], holiday["countryCode"]
+
+class HolidayIndex:
+    """
+    Local index of public holidays, built from bulk `PublicHolidays/{year}/{country}` fetches.
+
+    Holidays are kept per country and across countries as lists sorted by
+    date, so every supported Nager.Date lookup is a bisect over them:
+
+    - PublicHolidays/{year}/{country}
+    - NextPublicHolidays/{country} (the next 365 days)
+    - IsTodayPublicHoliday/{country}
+    - NextPublicHolidaysWorldwide (the next 7 days)
+    - PublicHolidaysOnDate/{date}, which Nager.Date lacks: every country's holidays on a date
+
+    Lookups the index cannot answer completely are misses and go upstream.
+    """
+
+    def __init__(self, path: Optional[str] = HOLIDAY_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.countries: List[str] = []
+        self.refreshed_at = 0.0
+        self._holidays: Dict[str, Dict[int, List[dict]]] = {}
+        # (country -> years) Nager.Date answered with a client error, e.g. a country it has no data for.
+        # They are not asked for again and do not keep cross-country lookups from being answered.
+        self._unavailable: Dict[str, Set[int]] = {}
+        self._country_dates: Dict[str, List[str]] = {}
+        self._country_holidays: Dict[str, List[dict]] = {}
+        self._dates: List[str] = []
+        self._all_holidays: List[dict] = []
+        self._save_lock = threading.Lock()
+        self._version = 0
+        self._saved_version = 0
+        self._fill_task: Optional[asyncio.Task] = None
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as index_file:
+            stored = json.load(index_file)
+        self.countries = stored["countries"]
+        self.refreshed_at = stored["refreshed_at"]
+        self._holidays = {
+            country: {int(year): holidays for year, holidays in years.items()}
+            for country, years in stored["holidays"].items()
+        }
+        self._unavailable = {country: set(years) for country, years in stored.get("unavailable", {}).items()}
+        self._rebuild()
+
+    def _snapshot(self) -> Tuple[int, dict]:
+        # Taken under the lock; the year lists are replaced, never changed, so shallow copies are enough.
+        with self._lock:
+            self._version += 1
+            return self._version, {
+                "countries": list(self.countries), "refreshed_at": self.refreshed_at,
+                "holidays": {country: dict(years) for country, years in self._holidays.items()},
+                "unavailable": {country: sorted(years) for country, years in self._unavailable.items()},
+            }
+
+    def _write(self, version: int, stored: dict):
+        with self._save_lock:
+            if version <= self._saved_version:
+                # A newer snapshot was written already.
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temporary_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as index_file:
+                json.dump(stored, index_file, ensure_ascii=False)
+            os.replace(temporary_path, self.path)
+            self._saved_version = version
+
+    async def async_save(self):
+        """Write the index file on a worker thread, so the event loop is not blocked by the JSON dump."""
+        if self.path:
+            await asyncio.to_thread(self._write, *self._snapshot())
+
+    def _rebuild(self):
+        self._country_holidays = {
+            country: sorted((holiday for holidays in years.values() for holiday in holidays), key=lambda holiday: holiday["date"])
+            for country, years in self._holidays.items()
+        }
+        self._country_dates = {
+            country: [holiday["date"] for holiday in holidays] for country, holidays in self._country_holidays.items()
+        }
+        self._all_holidays = sorted(
+            (holiday for holidays in self._country_holidays.values() for holiday in holidays),
+            key=_date_and_country,
+        )
+        self._dates = [holiday["date"] for holiday in self._all_holidays]
+
+    def record(self, country: str, year: int, holidays: List[dict]):
+        """
+        Add or replace one country's holidays for one year, in memory.
+
+        The sorted lists are updated in place with `bisect.insort` rather than
+        rebuilt; persist with `async_save`.
+        """
+        country = country.upper()
+        with self._lock:
+            years = self._holidays.setdefault(country, {})
+            previous = years.get(year, [])
+            years[year] = holidays
+            self._unavailable.get(country, set()).discard(year)
+            country_holidays = self._country_holidays.setdefault(country, [])
+            country_dates = self._country_dates.setdefault(country, [])
+            if previous:
+                self._remove(previous, country_holidays, country_dates)
+                self._remove(previous, self._all_holidays, self._dates)
+            for holiday in holidays:
+                index = bisect_right(country_dates, holiday["date"])
+                country_holidays.insert(index, holiday)
+                country_dates.insert(index, holiday["date"])
+                index = bisect_right(self._all_holidays, _date_and_country(holiday), key=_date_and_country)
+                self._all_holidays.insert(index, holiday)
+                self._dates.insert(index, holiday["date"])
+
+    async def async_record(self, country: str, year: int, holidays: List[dict]):
+        """`record`, then save the index file off the event loop."""
+        self.record(country, year, holidays)
+        await self.async_save()
+
+    @staticmethod
+    def _remove(removed: List[dict], holidays: List[dict], dates: List[str]):
+        # The removed holidays sit within the range of their dates; drop exactly those objects.
+        first = bisect_left(dates, min(holiday["date"] for holiday in removed))
+        last = bisect_right(dates, max(holiday["date"] for holiday in removed))
+        removed_ids = {id(holiday) for holiday in removed}
+        kept = [holiday for holiday in holidays[first:last] if id(holiday) not in removed_ids]
+        holidays[first:last] = kept
+        dates[first:last] = [holiday["date"] for holiday in kept]
+
+    def _has(self, country: str, *years: int) -> bool:
+        return all(year in self._holidays.get(country, {}) for year in years)
+
+    def _has_all(self, *years: int) -> bool:
+        return bool(self.countries) and not self.missing_pairs(years)
+
+    def missing_pairs(self, years) -> List[Tuple[str, int]]:
+        """The (country, year) lists that are neither indexed nor known to be unavailable."""
+        return [
+            (country, year) for country in self.countries for year in years
+            if not self._has(country, year) and year not in self._unavailable.get(country, ())
+        ]
+
+    def country_holidays(self, country: str, start: str, end: str) -> List[dict]:
+        """A country's holidays with start <= date < end (ISO dates)."""
+        dates = self._country_dates.get(country, [])
+        return self._country_holidays.get(country, [])[bisect_left(dates, start):bisect_left(dates, end)]
+
+    def holidays_between(self, start: str, end: str) -> List[dict]:
+        """Every country's holidays with start <= date < end (ISO dates)."""
+        return self._all_holidays[bisect_left(self._dates, start):bisect_left(self._dates, end)]
+
+    def holidays_on(self, day: str) -> List[dict]:
+        """Every country's holidays on one ISO date."""
+        return self._all_holidays[bisect_left(self._dates, day):bisect_right(self._dates, day)]
+
+    def handles(self, api_request: APIRequest) -> bool:
+        """Whether the request is a Nager.Date lookup the index knows how to answer."""
+        if api_request.method != "GET" or not NAGER_SERVER_PATTERN.search(api_request.server):
+            return False
+        path = _path(api_request)
+        return path == NEXT_PUBLIC_HOLIDAYS_WORLDWIDE_PATH or any(
+            pattern.match(path) for pattern in (
+                PUBLIC_HOLIDAYS_PATTERN, NEXT_PUBLIC_HOLIDAYS_PATTERN,
+                IS_TODAY_PUBLIC_HOLIDAY_PATTERN, PUBLIC_HOLIDAYS_ON_DATE_PATTERN,
+            )
+        )
+
+    def answer(self, api_request: APIRequest, today: Optional[date] = None) -> Optional[str]:
+        """
+        Answer a Nager.Date request from the index.
+
+        Args:
+            api_request (APIRequest): A request the index handles.
+            today (date, optional): The current date; defaults to today.
+
+        Returns:
+            Optional[str]: The JSON response body, or None on a miss.
+        """
+        today = today or date.today()
+        path = _path(api_request)
+        with self._lock:
+            match = PUBLIC_HOLIDAYS_PATTERN.match(path)
+            if match:
+                country, year = match.group("country").upper(), int(match.group("year"))
+                if not self._has(country, year):
+                    return None
+                return json.dumps(self._holidays[country][year], ensure_ascii=False)
+
+            match = NEXT_PUBLIC_HOLIDAYS_PATTERN.match(path)
+            if match:
+                country = match.group("country").upper()
+                if not self._has(country, today.year, today.year + 1):
+                    return None
+                upcoming = self.country_holidays(country, today.isoformat(), (today + timedelta(days=365)).isoformat())
+                return json.dumps(upcoming, ensure_ascii=False)
+
+            match = IS_TODAY_PUBLIC_HOLIDAY_PATTERN.match(path)
+            if match:
+                country = match.group("country").upper()
+                if not self._has(country, today.year):
+                    return None
+                holidays = self.country_holidays(country, today.isoformat(), (today + timedelta(days=1)).isoformat())
+                # Nager.Date answers 200/204 without a body; spell the answer out instead.
+                return json.dumps({
+                    "countryCode": country,
+                    "date": today.isoformat(),
+                    "isPublicHoliday": any(holiday.get("global", True) for holiday in holidays),
+                    "holidays": holidays,
+                }, ensure_ascii=False)
+
+            if path == NEXT_PUBLIC_HOLIDAYS_WORLDWIDE_PATH:
+                if not self._has_all(today.year, today.year + 1):
+                    return None
+                upcoming = self.holidays_between(today.isoformat(), (today + timedelta(days=8)).isoformat())
+                return json.dumps(upcoming, ensure_ascii=False)
+
+            match = PUBLIC_HOLIDAYS_ON_DATE_PATTERN.match(path)
+            if match:
+                day = match.group("date")
+                if not self._has_all(int(day[:4])):
+                    return None
+                return json.dumps(self.holidays_on(day), ensure_ascii=False)
+
+        return None
+
+    def missing_year(self, api_request: APIRequest) -> Optional[int]:
+        """The year a cross-country request needs to be refreshed first, if that is why it missed."""
+        match = PUBLIC_HOLIDAYS_ON_DATE_PATTERN.match(_path(api_request))
+        return int(match.group("date")[:4]) if match else None
+
+    def is_stale(self) -> bool:
+        return not self.countries or time.time() - self.refreshed_at > HOLIDAY_INDEX_REFRESH_SECONDS
+
+    async def async_refresh(self, years: Optional[List[int]] = None, deadline=None) -> Tuple[int, int]:
+        """
+        Download the holidays of every available country for the given years,
+        replacing what the index has. Run it from the background job.
+
+        Args:
+            years (List[int], optional): Defaults to this year and the next one.
+            deadline (Deadline, optional): Deadline for the whole refresh.
+
+        Returns:
+            Tuple[int, int]: The number of (country, year) lists fetched and the number that failed.
+        """
+        this_year = date.today().year
+        years = years or [this_year, this_year + 1]
+        countries = await self._async_available_countries(deadline)
+        fetched, failed = await self._async_fetch([(country, year) for country in countries for year in years], deadline)
+        # Lists that failed for a while are left to `async_fill`, so one flaky
+        # country does not make every later run download everything again.
+        self.refreshed_at = time.time()
+        await self.async_save()
+        print(f"Refreshed the holiday index: {fetched} lists, {failed} failed.")
+        return fetched, failed
+
+    async def async_fill(self, years: List[int], deadline=None) -> Tuple[int, int]:
+        """
+        Download only the (country, year) lists the index is missing.
+
+        Args:
+            years (List[int]): The years to complete.
+            deadline (Deadline, optional): Deadline for the downloads.
+
+        Returns:
+            Tuple[int, int]: The number of lists fetched and the number that failed.
+        """
+        if not self.countries:
+            await self._async_available_countries(deadline)
+        fetched, failed = await self._async_fetch(self.missing_pairs(years), deadline)
+        if fetched or failed:
+            await self.async_save()
+        return fetched, failed
+
+    def schedule_fill(self, years: List[int]):
+        """
+        Start `async_fill` for the years in the background, unless a fill is already running.
+
+        Requests never wait for it: downloading every country's list of a year
+        takes over a hundred upstream calls.
+        """
+        if self._fill_task is not None and not self._fill_task.done():
+            return
+        # Started from an empty context, so its spans do not join the trace of the request that asked for it.
+        self._fill_task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._async_background_fill(years))
+
+    async def _async_background_fill(self, years: List[int]):
+        try:
+            fetched, failed = await self.async_fill(years)
+            print(f"Filled the holiday index for {years}: {fetched} lists, {failed} failed.")
+        except Exception as e:
+            print(f"Could not fill the holiday index: {e}")
+
+    async def _async_available_countries(self, deadline) -> List[str]:
+        # Imported here: the requestor itself answers from this index.
+        from tools.api_requestor import async_send_upstream
+
+        response = await async_send_upstream(
+            APIRequest(method="GET", server=NAGER_SERVER, path="/api/v3/AvailableCountries"), deadline
+        )
+        if response.result == "success":
+            with self._lock:
+                self.countries = sorted(country["countryCode"].upper() for country in response.data())
+        return self.countries
+
+    async def _async_fetch(self, pairs: List[Tuple[str, int]], deadline) -> Tuple[int, int]:
+        from tools.api_requestor import async_send_upstream
+
+        responses = await asyncio.gather(*(
+            async_send_upstream(APIRequest(method="GET", server=NAGER_SERVER, path=f"/api/v3/PublicHolidays/{year}/{country}"), deadline)
+            for country, year in pairs
+        ))
+        failed = 0
+        for (country, year), response in zip(pairs, responses):
+            if response.result == "success":
+                self.record(country, year, response.data())
+                continue
+            failed += 1
+            if response.status_code is not None and 400 <= response.status_code < 500 and response.status_code != 429:
+                with self._lock:
+                    self._unavailable.setdefault(country, set()).add(year)
+        return len(pairs) - failed, failed
+
+holiday_index = HolidayIndex()
+
+async def async_run_refresh_job(interval: int = HOLIDAY_INDEX_REFRESH_SECONDS):
+    """
+    Keep the holiday index complete, forever (run it as a background task):
+    everything is downloaded again when the index is stale, and lists that
+    failed are retried every hour.
+    """
+    while True:
+        this_year = date.today().year
+        try:
+            if holiday_index.is_stale():
+                await holiday_index.async_refresh()
+            elif holiday_index.missing_pairs([this_year, this_year + 1]):
+                await holiday_index.async_fill([this_year, this_year + 1])
+        except Exception as e:
+            print(f"Could not refresh the holiday index: {e}")
+        await asyncio.sleep(min(interval, 3_600))
+
+if __name__ == "__main__":
+    # One-off refresh, e.g. from cron: python -m tools.holiday_index
+    from tools.http_client import run_sync
+    run_sync(holiday_index.async_refresh())
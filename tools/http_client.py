@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import weakref
+import httpx
+from tools.rate_limit import RateLimitedTransport
+
+# Keep-alive pool shared by every request made from the same event loop.
+# httpx keeps a separate connection pool per host inside a single client.
+POOL_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=30.0)
+
+# Base URL prefixes to redirect, e.g. to local stand-ins in benchmarks.
+_url_overrides = {}
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_sync_loop = None
+_sync_loop_lock = threading.Lock()
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Return the pooled HTTP client bound to the running event loop.
+
+    Returns:
+        httpx.AsyncClient: A client whose connections are reused across calls.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        # Every request goes through the rate limiter and adaptive concurrency limit of its API.
+        transport = RateLimitedTransport(httpx.AsyncHTTPTransport(limits=POOL_LIMITS), resolve_host=original_host)
+        client = httpx.AsyncClient(transport=transport, timeout=None)
+        _clients[loop] = client
+    return client
+
+def set_url_overrides(overrides: dict):
+    """
+    Redirect requests whose URL starts with a given prefix to another base URL.
+
+    Args:
+        overrides (dict): Maps an original prefix (e.g. "https://api.coincap.io")
+            to its replacement (e.g. "http://127.0.0.1:8001").
+    """
+    _url_overrides.clear()
+    _url_overrides.update(overrides)
+
+def rewrite_url(url: str) -> str:
+    for prefix, replacement in _url_overrides.items():
+        if url.startswith(prefix):
+            return replacement + url[len(prefix):]
+    return url
+
+def original_host(url: httpx.URL) -> str:
+    """The host a possibly redirected URL was originally meant for, so that it keeps its API's limits."""
+    text = str(url)
+    for prefix, replacement in _url_overrides.items():
+        if text.startswith(replacement):
+            return httpx.URL(prefix).host
+    return url.host
+
+async def aclose_client():
+    """Close the pooled client of the running event loop, if there is one."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            _sync_loop = asyncio.new_event_loop()
+            threading.Thread(target=_sync_loop.run_forever, name="tools-http-loop", daemon=True).start()
+        return _sync_loop
+
+def run_sync(coro):
+    """
+    Run a coroutine on the shared background event loop and wait for its result.
+
+    The sync API is a thin wrapper over the async one; running every sync call
+    on a single long-lived loop lets them share one connection pool, and it
+    works from any thread, including one that already runs its own loop.
+
+    Args:
+        coro: The coroutine to run.
+
+    Returns:
+        The coroutine's return value.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_sync_loop()).result()
+
+async def _anext(async_iterator):
+    return await async_iterator.__anext__()
+
+def iterate_sync(async_iterator):
+    """
+    Iterate an async iterator from sync code, one item at a time.
+
+    Each step runs on the shared background event loop, so items are yielded
+    as soon as they arrive instead of after the whole stream completes.
+
+    Args:
+        async_iterator: The async iterator (e.g. an async generator) to consume.
+
+    Yields:
+        The items produced by the async iterator.
+    """
+    loop = _get_sync_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(_anext(async_iterator), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        aclose = getattr(async_iterator, "aclose", None)
+        if aclose is not None:
+            asyncio.run_coroutine_threadsafe(aclose(), loop).result()
@@ -1,50 +1,48 @@
-import requests
-from pydantic import BaseModel, ValidationError, field_validator
-from typing import List, Optional, Dict, Literal
+import asyncio
+import httpx
+from contextlib import aclosing
+from functools import lru_cache
+from pydantic import ValidationError
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
 import json
 import re
 import os
-from tools.api_requestor import APIRequest, send_request
-from tools.deepseek import call_deepseek
+import time
+from tools import json_codec
+from tools.api_requestor import APIRequest, ApiRequestorResponse, async_send_request
+from tools.deepseek import async_call_deepseek, async_stream_deepseek
+from tools.endpoint_catalog import validate_request
+from tools.http_client import iterate_sync, run_sync
+from tools.example_bank import select_examples
+from tools.fast_path import fast_path_builder
+from tools.incremental_json import IncrementalJsonParser
+from tools.request_plan import PlanExecution, async_execute_plan, describe_request, is_mergeable
 from tools.models import ApiRequestBuilderResponse
+from tools.response_reducer import MAX_RESPONSE_BYTES, reduce_api_response
+from tools.retry import Deadline, retry_policy
+from tools.semantic_cache import semantic_request_cache
+from tools.tracing import Span, annotate, finish_span, metrics, span, start_span, use_span
 from dotenv import load_dotenv
 
 load_dotenv()
 
-class ResponseExample(BaseModel):
-    method: Literal["GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"]
-    server: str
-    path: str
-    query: Optional[Dict[str, str]] = None
-    headers: Optional[Dict[str, str]] = None
-    body: Optional[str] = None
+# Stream the request builder's completion and send each request as soon as it is complete.
+# Identical streamed builds in flight share one completion, like the one-call builds do.
+STREAM_REQUEST_BUILDER = os.getenv("STREAM_REQUEST_BUILDER", "true").lower() == "true"
 
-class InteractionExample(BaseModel):
-    prompt: str
-    response: str
-
-    @field_validator('response')
-    def validate_response_is_response_example(cls, value):
-        try:
-            # Parse the string into a JSON object
-            parsed_json = json.loads(value)
-            # Validate the JSON against the ResponseExample model
-            ResponseExample(**parsed_json)
-        except json.JSONDecodeError:
-            raise ValueError("response must be a valid JSON string")
-        except ValueError as e:
-            raise ValueError(f"response JSON does not match ResponseExample schema: {e}")
-        return value
-
-def _create_system_prompt (api: str) -> str:
+@lru_cache(maxsize=None)
+def _create_system_prompt_prefix(api: str) -> str:
     """
-    Create a system prompt based on the API name.
+    Create the static part of the request-builder prompt for an API.
+
+    It is built once per API and shared by every request, so DeepSeek can also
+    reuse it from its prompt cache; only the examples after it vary.
 
     Args:
         api (str): The name of the API(coincap, nager or weatherapi).
 
     Returns:
-        str: The system prompt for the API.
+        str: The system prompt up to the examples.
     """
 
     if api == "coincap":
@@ -55,63 +53,13 @@ def _create_system_prompt (api: str) -> str:
             - If 'start' and 'end' timestamps are needed, the 'end' timestamp must be greater than the 'start' timestamp. CoinCap's API requires the 'end' timestamp to be greater than the 'start' timestamp.
             - For time-based data, infer or calculate UNIX timestamps as required.
         '''
-        examples = [
-            InteractionExample(
-                prompt="What was the Bitcoin price on April 20, 2024?",
-                response='''{
-                    "method": "GET",
-                    "server": "https://api.coincap.io",
-                    "path": "/v2/assets/bitcoin/history",
-                    "query": {
-                        "interval": "d1",
-                        "start": "1713571200000",
-                        "end": "1713657600000"
-                    },
-                    "headers": null,
-                    "body": null
-                }'''
-            ),
-            InteractionExample(
-                prompt="Get the current price of Ethereum.",
-                response='''{
-                    "method": "GET",
-                    "server": "https://api.coincap.io",
-                    "path": "/v2/assets/ethereum",
-                    "query": null,
-                    "headers": null,
-                    "body": null
-                }'''
-            )
-        ]
     elif api == "nager":
         api_name = "Nager.Date v3"
         api_server = "https://date.nager.at"
         api_example_path = "api/v3/NextPublicHolidays/US"
-        additional_info = ""
-        examples = [
-            InteractionExample(
-                prompt="What are the next public holidays in the United States?",
-                response='''{
-                    "method": "GET",
-                    "server": "https://date.nager.at",
-                    "path": "/api/v3/NextPublicHolidays/US",
-                    "query": null,
-                    "headers": null,
-                    "body": null
-                }'''
-            ),
-            InteractionExample(
-                prompt="What are the public holidays in France in 2025?",
-                response='''{
-                    "method": "GET",
-                    "server": "https://date.nager.at",
-                    "path": "/api/v3/PublicHolidays/2025/FR",
-                    "query": null,
-                    "headers": null,
-                    "body": null
-                }'''
-            )
-        ]
+        additional_info = '''
+            - To find the public holidays of every country on one date, use the path 'api/v3/PublicHolidaysOnDate/{YYYY-MM-DD}'.
+        '''
     elif api == "weatherapi":
         api_name = "WeatherAPI"
         api_server = "http://api.weatherapi.com/v1"
@@ -120,37 +68,6 @@ def _create_system_prompt (api: str) -> str:
             "You need an API key to access WeatherAPI's free plan. "
             "Include 'key={os.getenv('WEATHER_API_KEY')}' as a query parameter."
         """
-        examples = [
-            InteractionExample(
-                prompt="What is the current weather in New York City?",
-                response=f'''{{
-                    "method": "GET",
-                    "server": "http://api.weatherapi.com/v1",
-                    "path": "/current.json",
-                    "query": {{
-                        "q": "New York City",
-                        "key": "{os.getenv('WEATHER_API_KEY')}"
-                    }},
-                    "headers": null,
-                    "body": null
-                }}'''
-            ),
-            InteractionExample(
-                prompt="What is the weather forecast for Tokyo for the next 3 days?",
-                response=f'''{{
-                    "method": "GET",
-                    "server": "http://api.weatherapi.com/v1",
-                    "path": "/forecast.json",
-                    "query": {{
-                        "q": "Tokyo",
-                        "days": "3",
-                        "key": "{os.getenv('WEATHER_API_KEY')}"
-                    }},
-                    "headers": null,
-                    "body": null
-                }}'''
-            )
-        ]
     else:
         raise ValueError("Invalid API name. Please provide a valid API name.")        
     
@@ -172,6 +89,7 @@ def _create_system_prompt (api: str) -> str:
         
         3. **Output Requirements**:
             - Always return a valid JSON object.
+            - If the prompt needs several calls (e.g. several assets, countries, cities or time ranges), return a JSON array with one request object per call instead.
             - Ensure the response is correctly structured for execution.
             - Do not include explanations or comments.
 
@@ -185,7 +103,26 @@ def _create_system_prompt (api: str) -> str:
         ### Example Interaction:
         """
     
-    for example in examples:
+    return system_prompt
+
+def _create_system_prompt (api: str, user_prompt: Optional[str] = None, query_vector=None) -> str:
+    """
+    Create a system prompt based on the API name.
+
+    The examples are the ones in the API's example bank closest to the user
+    prompt.
+
+    Args:
+        api (str): The name of the API(coincap, nager or weatherapi).
+        user_prompt (str, optional): The user prompt the examples are picked for.
+        query_vector (optional): The user prompt's embedding, if already computed.
+
+    Returns:
+        str: The system prompt for the API.
+    """
+    system_prompt = _create_system_prompt_prefix(api)
+
+    for example in select_examples(api, user_prompt, query_vector):
         system_prompt += f"""
         **User Prompt**: "{example.prompt}"
         
@@ -197,9 +134,25 @@ def _create_system_prompt (api: str) -> str:
 
     return system_prompt
 
-def _generate_api_request(user_prompt: str, system_prompt) -> ApiRequestBuilderResponse:
+def _create_feedback_prompt(user_prompt: str, failed_api_requests: List[APIRequest], error_message: str) -> str:
+    """
+    Ask the builder to correct a rejected request (by the API or the endpoint catalog), instead of building it again from scratch.
+    """
+    if len(failed_api_requests) == 1:
+        previous_requests = failed_api_requests[0].model_dump_json()
+    else:
+        previous_requests = json.dumps([api_request.model_dump() for api_request in failed_api_requests])
+    return f"""{user_prompt}
+
+        Your previous request for this prompt was:
+        {previous_requests}
+        It was rejected. {error_message}
+        Return a corrected request, or an object with property "error" if the API cannot answer the prompt.
+        """
+
+async def _async_generate_api_request(user_prompt: str, system_prompt, deadline: Optional[Deadline] = None) -> ApiRequestBuilderResponse:
     try:
-        response_data = call_deepseek(user_prompt, system_prompt)
+        response_data = await async_call_deepseek(user_prompt, system_prompt, deadline)
         
         assistant_content = response_data["choices"][0]["message"]["content"]
 
@@ -215,6 +168,20 @@ def _generate_api_request(user_prompt: str, system_prompt) -> ApiRequestBuilderR
             print("Assistant returned null.")
             return None
 
+        # A multi-entity prompt is answered with a plan: a list of independent requests.
+        if isinstance(parsed_content, list):
+            if not all(isinstance(request_content, dict) for request_content in parsed_content):
+                return ApiRequestBuilderResponse(result="error", message="Every item of a plan must be a request object.")
+            api_requests = [APIRequest(**request_content) for request_content in parsed_content]
+            if not api_requests:
+                return ApiRequestBuilderResponse(result="error", message="The assistant returned an empty plan.")
+            return ApiRequestBuilderResponse(
+                result="success", message=None, api_request=api_requests[0], api_requests=api_requests
+            )
+
+        if not isinstance(parsed_content, dict):
+            return ApiRequestBuilderResponse(result="error", message="The assistant did not return a request object.")
+
         # If LLM returns an error message, return it
         if(parsed_content.get("error")):
             error_message_from_llm = parsed_content.get("error")
@@ -233,7 +200,7 @@ def _generate_api_request(user_prompt: str, system_prompt) -> ApiRequestBuilderR
             api_request=None
         )
     
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         # log: f"Error calling DeepSeek API: {e}"
         print(f"Error calling DeepSeek API: {e}")
 
@@ -242,76 +209,494 @@ def _generate_api_request(user_prompt: str, system_prompt) -> ApiRequestBuilderR
             message="An unknown error occured", 
             api_request=None
         )
+
+def _generate_api_request(user_prompt: str, system_prompt, deadline: Optional[Deadline] = None) -> ApiRequestBuilderResponse:
+    return run_sync(_async_generate_api_request(user_prompt, system_prompt, deadline))
     
-def _generate_human_readable_response_from_api_response(initial_user_prompt: str, api_response: dict) -> str:
+def _create_humanizer_prompts(initial_user_prompt: str, api_response: dict):
+    usr_prompt = f"""
+        The user asked: "{initial_user_prompt}".
+        The API returned the following response: {api_response}.
+        Please provide a human-readable response based on the user's prompt and the API response.
+        """
+    sys_prompt = "You are a helpful assistant that generates human-readable responses based on API data."
+    return usr_prompt, sys_prompt
+
+async def _async_generate_human_readable_response_from_api_response(initial_user_prompt: str, api_response: dict, deadline: Optional[Deadline] = None) -> str:
     """
     Generates a human-readable response by sending the initial prompt and API response to DeepSeek Chat.
 
     Args:
         initial_user_prompt (str): The initial user prompt.
         api_response (dict): The response from the API.
+        deadline (Deadline, optional): The deadline of the user request.
 
     Returns:
         str: A human-readable response.
     """
     try:
-        usr_prompt = f"""
-        The user asked: "{initial_user_prompt}".
-        The API returned the following response: {api_response}.
-        Please provide a human-readable response based on the user's prompt and the API response.
-        """
-        sys_prompt = "You are a helpful assistant that generates human-readable responses based on API data."
-        response_data = call_deepseek(usr_prompt, sys_prompt)
+        usr_prompt, sys_prompt = _create_humanizer_prompts(initial_user_prompt, api_response)
+        response_data = await async_call_deepseek(usr_prompt, sys_prompt, deadline)
         assistant_content = response_data["choices"][0]["message"]["content"]
 
         return assistant_content
 
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error calling DeepSeek API: {e}")
         return "Sorry, I couldn't generate a response. Please try again later."
 
-def make_humanized_api_request(user_prompt: str, api: str) -> str:
+def _generate_human_readable_response_from_api_response(initial_user_prompt: str, api_response: dict, deadline: Optional[Deadline] = None) -> str:
+    return run_sync(_async_generate_human_readable_response_from_api_response(initial_user_prompt, api_response, deadline))
+
+async def _async_stream_human_readable_response_from_api_response(initial_user_prompt: str, api_response: dict, parent_span: Optional[Span] = None, deadline: Optional[Deadline] = None) -> AsyncIterator[str]:
     """
-    Given a user prompt and an API name, generate a human-readable response with retries.
+    Streaming variant of `_async_generate_human_readable_response_from_api_response`.
+
+    Args:
+        initial_user_prompt (str): The initial user prompt.
+        api_response (dict): The response from the API.
+        parent_span (Span, optional): The span to trace the DeepSeek stream under.
+        deadline (Deadline, optional): The deadline of the user request.
+
+    Yields:
+        str: Pieces of the human-readable response as DeepSeek generates them.
+    """
+    try:
+        usr_prompt, sys_prompt = _create_humanizer_prompts(initial_user_prompt, api_response)
+        async for content in async_stream_deepseek(usr_prompt, sys_prompt, parent_span=parent_span, deadline=deadline):
+            yield content
+
+    except (httpx.HTTPError, ValueError) as e:
+        # ValueError: a malformed event of the stream.
+        print(f"Error calling DeepSeek API: {e}")
+        yield "Sorry, I couldn't generate a response. Please try again later."
+
+def _is_rejected(api_requestor_response: ApiRequestorResponse) -> bool:
+    """Whether the API refused the request itself (a 4xx), as opposed to failing transiently."""
+    status_code = api_requestor_response.status_code
+    return status_code is not None and 400 <= status_code < 500 and not retry_policy.is_retryable(status_code)
+
+def _reduce_results(user_prompt: str, results: List[Tuple[APIRequest, ApiRequestorResponse]]) -> Tuple[str, int, int]:
+    """
+    Reduce the responses of a plan and combine them for the humanizer.
+
+    A single response is passed on as is; several share the byte budget and are
+    combined into a JSON list that says which request produced each of them.
+
+    Returns:
+        Tuple[str, int, int]: The combined response, and its size before and after reduction.
+    """
+    if len(results) == 1:
+        api_request, response = results[0]
+        reduced_response = reduce_api_response(user_prompt, api_request, response.body)
+        return reduced_response.api_response, reduced_response.original_bytes, reduced_response.reduced_bytes
+
+    combined = []
+    original_bytes = 0
+    for api_request, response in results:
+        if response.result != "success":
+            combined.append({"request": describe_request(api_request), "error": response.message})
+            continue
+        reduced_response = reduce_api_response(
+            user_prompt, api_request, response.body, max_bytes=MAX_RESPONSE_BYTES // len(results)
+        )
+        original_bytes += reduced_response.original_bytes
+        try:
+            reduced_data = json_codec.loads(reduced_response.api_response)
+        except json.JSONDecodeError:
+            # Truncated to fit the budget; pass the text on as is.
+            reduced_data = reduced_response.api_response
+        combined.append({"request": describe_request(api_request), "response": reduced_data})
+    api_response = json_codec.dumps(combined)
+    return api_response, original_bytes, len(api_response.encode())
+
+class _RequestBuild:
+    """
+    Request-building state of one API for one question: the prebuilt request,
+    if any, the prompts for the LLM builder and the question's embedding.
+    """
+
+    def __init__(self, user_prompt: str, api: str):
+        self.user_prompt = user_prompt
+        self.api = api
+        self.builder_prompt = user_prompt
+        self.system_prompt: Optional[str] = None
+        self.query_vector = None
+        self.prebuilt_api_request: Optional[APIRequest] = None
+        # Requests of the last build already sent while it was streamed.
+        self.execution: Optional[PlanExecution] = None
+
+    async def prebuild(self):
+        # Common intents are built without the LLM; otherwise try the semantic cache.
+        # The router already embedded this prompt, so the cache lookup reuses its vector.
+        with span("prebuild", api=self.api) as prebuild_span:
+            self.prebuilt_api_request = fast_path_builder.build(self.user_prompt, self.api)
+            if self.prebuilt_api_request is not None:
+                print("Using API request from the fast path.")
+                prebuild_span.set(source="fast_path")
+            else:
+                self.query_vector = await asyncio.to_thread(semantic_request_cache.embed, self.user_prompt)
+                self.prebuilt_api_request = semantic_request_cache.lookup(self.user_prompt, self.api, vector=self.query_vector)
+                if self.prebuilt_api_request is not None:
+                    print("Using API request from the semantic cache.")
+                prebuild_span.set(source="semantic_cache" if self.prebuilt_api_request is not None else None)
+        metrics.increment(f"prebuild.{prebuild_span.attributes['source'] or 'miss'}")
+
+    async def build(self, deadline: Optional[Deadline] = None) -> ApiRequestBuilderResponse:
+        if self.prebuilt_api_request is not None:
+            return self._validate(ApiRequestBuilderResponse(result="success", api_request=self.prebuilt_api_request))
+
+        with span("build", source="llm", api=self.api, stream=STREAM_REQUEST_BUILDER) as build_span:
+            if self.system_prompt is None:
+                # Built once per question; retries only change the user prompt.
+                self.system_prompt = await asyncio.to_thread(
+                    _create_system_prompt, self.api, self.user_prompt, self.query_vector
+                )
+
+            if STREAM_REQUEST_BUILDER:
+                api_request_builder_response = await self._build_streaming(build_span, deadline)
+            else:
+                api_request_builder_response = self._validate(
+                    await _async_generate_api_request(self.builder_prompt, self.system_prompt, deadline)
+                )
+            build_span.set(result=api_request_builder_response.result, feedback=self.builder_prompt is not self.user_prompt)
+            return api_request_builder_response
+
+    async def _build_streaming(self, build_span: Span, deadline: Optional[Deadline] = None) -> ApiRequestBuilderResponse:
+        """
+        Build from the streamed completion, parsing it as it arrives.
+
+        Each request is validated as soon as its JSON object closes and, unless
+        it may still be merged with later ones of its plan, sent right away,
+        while the rest of the completion is streamed. A stream that cannot be
+        a valid answer, or a request the catalog rejects, ends the build at
+        once. The requests started are kept in `self.execution`.
+        """
+        started = time.perf_counter()
+        parser = IncrementalJsonParser()
+        execution = PlanExecution(deadline)
+        api_requests: List[APIRequest] = []
+        fixes: List[str] = []
+        try:
+            # Closed on an early return, which aborts the completion.
+            async with aclosing(async_stream_deepseek(self.builder_prompt, self.system_prompt, parent_span=build_span, deadline=deadline)) as stream:
+                async for content in stream:
+                    for value in parser.feed(content):
+                        # An object with property "error" is the builder's way of saying the API cannot answer.
+                        if not parser.is_array and value.get("error"):
+                            return ApiRequestBuilderResponse(result="error", message=value["error"])
+                        api_request = APIRequest(**value)
+                        validation = validate_request(api_request, self.api)
+                        if not validation.valid:
+                            execution.cancel()
+                            return self._reject([api_request], [f"{describe_request(api_request)}: {'; '.join(validation.errors)}."])
+                        fixes.extend(validation.fixes)
+                        api_requests.append(validation.api_request)
+                        if not parser.is_array or not is_mergeable(validation.api_request):
+                            if "first_request_seconds" not in build_span.attributes:
+                                build_span.set(first_request_seconds=time.perf_counter() - started)
+                            execution.start(validation.api_request)
+            parser.finish()
+        except ValueError as e:
+            # MalformedJson and ValidationError from the answer, JSONDecodeError from a malformed event of the stream.
+            print(f"Error parsing the assistant's response: {e}")
+            metrics.increment("build.stream_aborted")
+            execution.cancel()
+            return ApiRequestBuilderResponse(result="error", message="An unknown error occured")
+        except httpx.HTTPError as e:
+            print(f"Error calling DeepSeek API: {e}")
+            execution.cancel()
+            return ApiRequestBuilderResponse(result="error", message="An unknown error occured")
+        except BaseException:
+            execution.cancel()
+            raise
+
+        if not api_requests:
+            return ApiRequestBuilderResponse(result="error", message="The assistant returned an empty plan.")
+        metrics.increment("validation.fixed" if fixes else "validation.passed")
+        if fixes:
+            print(f"Fixed the generated request: {', '.join(fixes)}.")
+        self.execution = execution
+        return ApiRequestBuilderResponse(
+            result="success", api_request=api_requests[0], api_requests=api_requests if len(api_requests) > 1 else None
+        )
+
+    def _validate(self, api_request_builder_response: ApiRequestBuilderResponse) -> ApiRequestBuilderResponse:
+        """
+        Check the built requests against the endpoint catalog before anything is sent.
+
+        Fixable mistakes are fixed in place; a request that is still invalid
+        fails the build and its errors are fed back to the next one.
+        """
+        if api_request_builder_response.result != "success":
+            return api_request_builder_response
+
+        api_requests = api_request_builder_response.plan()
+        with span("validate", api=self.api) as validate_span:
+            validations = [validate_request(api_request, self.api) for api_request in api_requests]
+            fixes = [fix for validation in validations for fix in validation.fixes]
+            errors = [
+                f"{describe_request(api_request)}: {'; '.join(validation.errors)}."
+                for api_request, validation in zip(api_requests, validations) if not validation.valid
+            ]
+            validate_span.set(fixes=len(fixes), errors=len(errors))
+
+        if errors:
+            return self._reject(api_requests, errors)
+
+        metrics.increment("validation.fixed" if fixes else "validation.passed")
+        if fixes:
+            print(f"Fixed the generated request: {', '.join(fixes)}.")
+        fixed_api_requests = [validation.api_request for validation in validations]
+        return ApiRequestBuilderResponse(
+            result="success",
+            api_request=fixed_api_requests[0],
+            api_requests=fixed_api_requests if len(fixed_api_requests) > 1 else None,
+        )
+
+    def _reject(self, api_requests: List[APIRequest], errors: List[str]) -> ApiRequestBuilderResponse:
+        metrics.increment("validation.rejected")
+        error_message = " ".join(errors)
+        print(f"Generated request is invalid: {error_message}")
+        self.correct(api_requests, error_message)
+        return ApiRequestBuilderResponse(result="error", message=f"Invalid request. {error_message}")
+
+    def discard(self):
+        """Cancel the requests started by a build whose result is not used."""
+        if self.execution is not None:
+            self.execution.cancel()
+            self.execution = None
+
+    def correct(self, failed_api_requests: List[APIRequest], error_message: str):
+        """Have the next build correct rejected requests."""
+        self.builder_prompt = _create_feedback_prompt(self.user_prompt, failed_api_requests, error_message)
+        # Fall back to the LLM builder instead of re-sending a prebuilt request.
+        self.prebuilt_api_request = None
+
+async def _async_build_speculatively(builds: List[_RequestBuild], deadline: Optional[Deadline] = None) -> Tuple[_RequestBuild, ApiRequestBuilderResponse]:
+    """
+    Build requests for several candidate APIs at once and keep the first valid one.
+
+    A build is valid once its requests pass the endpoint catalog, so a wrong
+    API's request does not win the race. The other builds are cancelled as
+    soon as one succeeds. If none succeeds, the result of the most likely API
+    (the first one) is returned.
+
+    Args:
+        builds (List[_RequestBuild]): One build per candidate API, most likely first.
+        deadline (Deadline, optional): The deadline of the user request.
+
+    Returns:
+        Tuple[_RequestBuild, ApiRequestBuilderResponse]: The chosen build and its result.
+    """
+    async def prebuild_and_build(request_build: _RequestBuild):
+        await request_build.prebuild()
+        return request_build, await request_build.build(deadline)
+
+    with span("speculate", apis=[request_build.api for request_build in builds]) as speculate_span:
+        tasks = [asyncio.create_task(prebuild_and_build(request_build)) for request_build in builds]
+        failed = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                request_build, api_request_builder_response = await next_done
+                if api_request_builder_response.result == "success":
+                    speculate_span.set(winner=request_build.api)
+                    metrics.increment("speculation.primary" if request_build is builds[0] else "speculation.alternative")
+                    return request_build, api_request_builder_response
+                failed[request_build.api] = api_request_builder_response
+        finally:
+            for task in tasks:
+                task.cancel()
+            for request_build in builds:
+                if request_build.api != speculate_span.attributes.get("winner"):
+                    request_build.discard()
+        metrics.increment("speculation.failed")
+        return builds[0], failed[builds[0].api]
+
+async def _async_fetch_api_response(user_prompt: str, api: str, deadline: Optional[Deadline] = None, alternative_api: Optional[str] = None) -> Optional[ApiRequestorResponse]:
+    """
+    Build an API request for the user prompt and send it, with retries.
+
+    Compound prompts are built as a plan of several requests, which are sent
+    concurrently and answered together.
+
+    The DeepSeek and upstream calls retry transient failures themselves, so an
+    attempt here only starts over when the builder produced nothing usable or
+    the request was rejected, by the endpoint catalog before sending or by the
+    API (4xx); the rejected request and the errors are then fed back to the
+    builder.
+
+    When routing was ambiguous, the request is built for the alternative API
+    at the same time, and whichever API yields a valid request first is used.
 
     Args:
         user_prompt (str): The user prompt that was sent to the API.
         api (str): The name of the API (coincap, nager, or weatherapi).
+        deadline (Deadline, optional): The deadline of the user request.
+        alternative_api (str, optional): The runner-up API to build a request for concurrently.
 
     Returns:
-        str: A human-readable response or error message.
+        Optional[ApiRequestorResponse]: The successful API response, or None if every attempt failed.
     """
-    max_retries = 3
     retry_count = 0
 
-    while retry_count < max_retries:
-        system_prompt_for_request_builder = _create_system_prompt(api)
-
-        api_request_builder_response = _generate_api_request(user_prompt, system_prompt_for_request_builder)
+    request_build = _RequestBuild(user_prompt, api)
+    api_request_builder_response = None
+    if alternative_api is not None and alternative_api != api:
+        request_build, api_request_builder_response = await _async_build_speculatively(
+            [request_build, _RequestBuild(user_prompt, alternative_api)], deadline
+        )
+        annotate(api=request_build.api)
+    else:
+        await request_build.prebuild()
 
-        if api_request_builder_response.result == "success":
-            print(f"Generated API Request:")
-            print(api_request_builder_response.api_request.json())
-            print()
+    # Same attempt budget as every other stage (MAX_STAGE_ATTEMPTS).
+    while retry_count < retry_policy.max_attempts:
+        if deadline is not None and deadline.expired():
+            print("Request deadline exceeded.")
+            metrics.increment("pipeline.deadline_exceeded")
+            return None
 
-            api_requestor_response = send_request(api_request_builder_response.api_request)
+        with span("attempt", number=retry_count + 1):
+            if api_request_builder_response is None:
+                api_request_builder_response = await request_build.build(deadline)
 
-            if api_requestor_response.result == "success":
-                print(f"API Response:")
-                print(api_requestor_response.api_response)
+            if api_request_builder_response.result == "success":
+                api_requests = api_request_builder_response.plan()
+                print(f"Generated API Request:")
+                for api_request in api_requests:
+                    print(api_request.json())
                 print()
 
-                human_readable_response = _generate_human_readable_response_from_api_response(
-                    user_prompt, api_requestor_response.api_response
-                )
-                return human_readable_response
+                results = await async_execute_plan(api_requests, deadline, request_build.execution)
+                request_build.execution = None
+                failures = [(api_request, response) for api_request, response in results if response.result != "success"]
+                rejected = [(api_request, response) for api_request, response in failures if _is_rejected(response)]
+
+                if len(failures) < len(results) and not rejected:
+                    if request_build.prebuilt_api_request is None and len(api_requests) == 1:
+                        semantic_request_cache.store(user_prompt, request_build.api, api_requests[0], vector=request_build.query_vector)
+
+                    with span("reduce") as reduce_span:
+                        api_response, original_bytes, reduced_bytes = _reduce_results(user_prompt, results)
+                        reduce_span.set(original_bytes=original_bytes, reduced_bytes=reduced_bytes)
+                    print(f"API Response (reduced {original_bytes} -> {reduced_bytes} bytes, {original_bytes / max(1, reduced_bytes):.1f}x):")
+                    print(api_response)
+                    print()
+
+                    return ApiRequestorResponse(result="success", api_response=api_response)
+
+                if not rejected:
+                    # The requestor already retried the transient failure; rebuilding would send the same request.
+                    for _, response in failures:
+                        print(f"API request failed with message: {response.message}")
+                    return None
+
+                error_message = " ".join(f"{describe_request(api_request)}: {response.message}" for api_request, response in rejected)
+                print(f"API rejected the request, asking the builder to correct it: {error_message}")
+                request_build.correct(api_requests, error_message)
             else:
-                print(f"API request failed with message: {api_requestor_response.message}")
-                retry_count += 1
-                continue
-        else:
-            print(f"API request builder failed with message: {api_request_builder_response.message}")
+                print(f"API request builder failed with message: {api_request_builder_response.message}")
+
+            api_request_builder_response = None
             retry_count += 1
-            continue
 
-    return "Sorry, the API request failed after multiple attempts. Please try again later."
+    return None
+
+API_FAILURE_MESSAGE = "Sorry, the API request failed after multiple attempts. Please try again later."
+
+async def async_make_humanized_api_request(user_prompt: str, api: str, alternative_api: Optional[str] = None) -> str:
+    """
+    Given a user prompt and an API name, generate a human-readable response with retries.
+
+    Args:
+        user_prompt (str): The user prompt that was sent to the API.
+        api (str): The name of the API (coincap, nager, or weatherapi).
+        alternative_api (str, optional): A runner-up API to try concurrently when routing was ambiguous.
+
+    Returns:
+        str: A human-readable response or error message.
+    """
+    deadline = retry_policy.start()
+    with span("pipeline", api=api):
+        api_requestor_response = await _async_fetch_api_response(user_prompt, api, deadline, alternative_api)
+        if api_requestor_response is None:
+            return API_FAILURE_MESSAGE
+
+        with span("humanize"):
+            return await _async_generate_human_readable_response_from_api_response(
+                user_prompt, api_requestor_response.api_response, deadline
+            )
+
+def make_humanized_api_request(user_prompt: str, api: str, alternative_api: Optional[str] = None) -> str:
+    """
+    Blocking wrapper around `async_make_humanized_api_request`.
+
+    Args:
+        user_prompt (str): The user prompt that was sent to the API.
+        api (str): The name of the API (coincap, nager, or weatherapi).
+        alternative_api (str, optional): A runner-up API to try concurrently when routing was ambiguous.
+
+    Returns:
+        str: A human-readable response or error message.
+    """
+    return run_sync(async_make_humanized_api_request(user_prompt, api, alternative_api))
+
+async def async_stream_humanized_api_request(user_prompt: str, api: str, alternative_api: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Streaming variant of `async_make_humanized_api_request`.
+
+    The API request is built and sent as before; the human-readable answer is
+    then yielded piece by piece as DeepSeek generates it.
+
+    Args:
+        user_prompt (str): The user prompt that was sent to the API.
+        api (str): The name of the API (coincap, nager, or weatherapi).
+        alternative_api (str, optional): A runner-up API to try concurrently when routing was ambiguous.
+
+    Yields:
+        str: Pieces of the human-readable response or an error message.
+    """
+    # The stream is consumed across many awaits (possibly from different tasks),
+    # so the spans are started and finished explicitly instead of with `span`.
+    deadline = retry_policy.start()
+    pipeline_span = start_span("pipeline", api=api, stream=True)
+    error = None
+    try:
+        with use_span(pipeline_span):
+            api_requestor_response = await _async_fetch_api_response(user_prompt, api, deadline, alternative_api)
+        if api_requestor_response is None:
+            yield API_FAILURE_MESSAGE
+            return
+
+        humanize_span = start_span("humanize", parent=pipeline_span, stream=True)
+        humanize_error = None
+        try:
+            async for content in _async_stream_human_readable_response_from_api_response(
+                user_prompt, api_requestor_response.api_response, parent_span=humanize_span, deadline=deadline
+            ):
+                yield content
+        except Exception as e:
+            humanize_error = e
+            raise
+        finally:
+            finish_span(humanize_span, humanize_error)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        finish_span(pipeline_span, error)
+
+def stream_humanized_api_request(user_prompt: str, api: str, alternative_api: Optional[str] = None) -> Iterator[str]:
+    """
+    Blocking generator wrapper around `async_stream_humanized_api_request`.
+
+    Args:
+        user_prompt (str): The user prompt that was sent to the API.
+        api (str): The name of the API (coincap, nager, or weatherapi).
+        alternative_api (str, optional): A runner-up API to try concurrently when routing was ambiguous.
+
+    Yields:
+        str: Pieces of the human-readable response or an error message.
+    """
+    return iterate_sync(async_stream_humanized_api_request(user_prompt, api, alternative_api))
@@ -0,0 +1,126 @@
+import json
+import re
+from typing import List
+
+# Text allowed before the JSON: whitespace and a Markdown code fence such as "```json".
+# Every prefix of an allowed preamble matches too, so it can be checked as it arrives.
+PREAMBLE_PATTERN = re.compile(r"\s*(`{1,3}[A-Za-z]*\s*)?")
+# The builder answers with a few requests; a value growing past this is not one.
+MAX_VALUE_CHARS = 20_000
+
+class MalformedJson(ValueError):
+    """The streamed text cannot be the JSON the request builder is asked for."""
+
+class IncrementalJsonParser:
+    """
+    Parses the request builder's answer while it is streamed: one JSON object,
+    or an array of objects (a plan), optionally wrapped in a code fence.
+
+    `feed` returns every object completed by the new text, so each request
+    can be used as soon as its closing brace arrives rather than when the
+    completion ends. Text that cannot lead to such an answer (prose instead
+    of JSON, an array of non-objects, mismatched brackets) raises
+    `MalformedJson` at the first offending character.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.is_array = False
+        self.done = False
+        self._preamble = ""
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escaped = False
+        self._value: List[str] = []
+
+    def feed(self, text: str) -> List[dict]:
+        """
+        Consume the next piece of the stream.
+
+        Returns:
+            List[dict]: The objects completed by this piece, in order.
+
+        Raises:
+            MalformedJson: If the stream can no longer be a valid answer.
+        """
+        completed = []
+        for char in text:
+            if self.done:
+                # Whatever follows the JSON (a closing fence, a remark) is ignored.
+                break
+            if not self.started:
+                self._start(char)
+                continue
+            if self._in_string:
+                self._value.append(char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            value = self._consume(char)
+            if value is not None:
+                completed.append(value)
+            if len(self._value) > MAX_VALUE_CHARS:
+                raise MalformedJson(f"A value is longer than {MAX_VALUE_CHARS} characters")
+        return completed
+
+    def finish(self):
+        """
+        Check that the stream ended with a complete answer.
+
+        Raises:
+            MalformedJson: If it did not.
+        """
+        if not self.done:
+            raise MalformedJson("The stream ended before the JSON was complete")
+
+    def _start(self, char: str):
+        if char in "{[":
+            self.started = True
+            self.is_array = char == "["
+            self._stack.append(char)
+            if not self.is_array:
+                self._value.append(char)
+            return
+        self._preamble += char
+        if not PREAMBLE_PATTERN.fullmatch(self._preamble):
+            raise MalformedJson(f"Expected JSON, got {self._preamble.strip()[:40]!r}")
+
+    def _consume(self, char: str):
+        in_plan = self.is_array and len(self._stack) == 1
+        if in_plan:
+            # Between the objects of a plan only separators may appear.
+            if char.isspace() or char == ",":
+                return None
+            if char == "]":
+                self._stack.pop()
+                self.done = True
+                return None
+            if char != "{":
+                raise MalformedJson(f"Expected an object in the plan, got {char!r}")
+
+        self._value.append(char)
+        if char == '"':
+            self._in_string = True
+        elif char in "{[":
+            self._stack.append(char)
+        elif char in "}]":
+            opener = self._stack.pop() if self._stack else None
+            if opener != {"}": "{", "]": "["}[char]:
+                raise MalformedJson(f"Unexpected {char!r}")
+            if len(self._stack) == (1 if self.is_array else 0):
+                return self._complete()
+        return None
+
+    def _complete(self) -> dict:
+        text = "".join(self._value)
+        self._value = []
+        if not self.is_array:
+            self.done = True
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            raise MalformedJson(f"Invalid JSON object: {e}") from e
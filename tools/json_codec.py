@@ -0,0 +1,37 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # Optional; the standard library is used without it.
+    orjson = None
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """
+    Parse JSON, straight from the raw bytes when given bytes.
+
+    Raises:
+        json.JSONDecodeError: If the data is not valid JSON (orjson's error subclasses it).
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+def dumps_bytes(data: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # Integers beyond 64 bits, non-string keys...; the standard library handles them.
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+def dumps(data: Any) -> str:
+    """Serialize to compact JSON text, keeping non-ASCII characters as they are."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data).decode()
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import Dict, Optional
+import json
+from pydantic import BaseModel, Field, field_validator
+from typing import Dict, List, Literal, Optional
 
 class APIRequest(BaseModel):
     method: str = Field(..., pattern="^(GET|POST|PUT|PATCH|DELETE)$")  # HTTP methods
@@ -20,3 +21,37 @@ class ApiRequestBuilderResponse(BaseModel):
     result: str
     message: Optional[str] = None
     api_request: Optional['APIRequest'] = None
+    # Every request of a multi-entity plan; `api_request` is the first of them.
+    api_requests: Optional[List['APIRequest']] = None
+
+    def plan(self) -> List[APIRequest]:
+        """Return the requests to send: the whole plan, or the single request."""
+        if self.api_requests:
+            return self.api_requests
+        return [self.api_request] if self.api_request is not None else []
+
+class ResponseExample(BaseModel):
+    method: Literal["GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"]
+    server: str
+    path: str
+    query: Optional[Dict[str, str]] = None
+    headers: Optional[Dict[str, str]] = None
+    body: Optional[str] = None
+
+class InteractionExample(BaseModel):
+    prompt: str
+    response: str
+
+    @field_validator('response')
+    def validate_response_is_response_example(cls, value):
+        try:
+            # Parse the string into a JSON object
+            parsed_json = json.loads(value)
+            # Validate the JSON against the ResponseExample model (a plan is a list of them)
+            for request_json in parsed_json if isinstance(parsed_json, list) else [parsed_json]:
+                ResponseExample(**request_json)
+        except json.JSONDecodeError:
+            raise ValueError("response must be a valid JSON string")
+        except ValueError as e:
+            raise ValueError(f"response JSON does not match ResponseExample schema: {e}")
+        return value
@@ -0,0 +1,344 @@
+import asyncio
+import os
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+import httpx
+from dotenv import load_dotenv
+from tools.retry import parse_retry_after
+from tools.tracing import metrics
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; buckets then stay per process.
+    fcntl = None
+
+load_dotenv()
+
+# Per API: (host, requests per second, burst, latency target in seconds).
+# Override the rate and burst with RATE_LIMIT_<NAME>="<rate>/<burst>", e.g. RATE_LIMIT_COINCAP="2/5".
+RATE_LIMITS: Dict[str, Tuple[str, float, int, float]] = {
+    # CoinCap allows 200 requests per minute without an API key.
+    "coincap": ("api.coincap.io", 3.0, 10, 2.0),
+    # WeatherAPI's free plan has a monthly quota; keep bursts short.
+    "weatherapi": ("api.weatherapi.com", 5.0, 10, 2.0),
+    "nager": ("date.nager.at", 10.0, 20, 2.0),
+    "deepseek": ("api.deepseek.com", 20.0, 40, 30.0),
+}
+
+# Directory holding the shared bucket state; when set, every process using it shares one quota per API.
+RATE_LIMIT_STATE_DIR = os.getenv("RATE_LIMIT_STATE_DIR") or None
+
+# Adaptive concurrency bounds per API.
+MIN_CONCURRENCY = int(os.getenv("MIN_UPSTREAM_CONCURRENCY", "1"))
+MAX_CONCURRENCY = int(os.getenv("MAX_UPSTREAM_CONCURRENCY", "64"))
+INITIAL_CONCURRENCY = int(os.getenv("INITIAL_UPSTREAM_CONCURRENCY", "8"))
+
+OVERLOAD_STATUS_CODES = {429, 503}
+
+class RateLimitExceeded(httpx.PoolTimeout):
+    """Waiting for a rate limit token would take longer than the request may wait."""
+
+class LocalBucketStore:
+    """Token bucket state kept in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, Tuple[float, float]] = {}
+
+    def update(self, name: str, change: Callable[[Optional[Tuple[float, float]]], Tuple[Tuple[float, float], Any]]) -> Any:
+        with self._lock:
+            self._state[name], result = change(self._state.get(name))
+            return result
+
+class FileBucketStore:
+    """
+    Token bucket state kept in small files under a directory, so that several
+    worker processes on one machine share the same quota. Each update holds an
+    exclusive `flock` on the bucket's file for a few microseconds.
+    """
+
+    RECORD = struct.Struct("dd")
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._fds: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _fd(self, name: str) -> int:
+        with self._lock:
+            fd = self._fds.get(name)
+            if fd is None:
+                fd = self._fds[name] = os.open(os.path.join(self.directory, f"{name}.bucket"), os.O_RDWR | os.O_CREAT, 0o644)
+            return fd
+
+    def update(self, name: str, change: Callable[[Optional[Tuple[float, float]]], Tuple[Tuple[float, float], Any]]) -> Any:
+        fd = self._fd(name)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            raw = os.pread(fd, self.RECORD.size, 0)
+            state = self.RECORD.unpack(raw) if len(raw) == self.RECORD.size else None
+            new_state, result = change(state)
+            os.pwrite(fd, self.RECORD.pack(*new_state), 0)
+            return result
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+class TokenBucket:
+    """
+    Token bucket limiting the request rate to one API.
+
+    Tokens are reserved rather than polled: a caller takes a token even when
+    the bucket is empty and is told how long to wait for it, which keeps the
+    order fair and needs one state update per request. A caller that cannot
+    wait that long takes nothing.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, store):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.store = store
+
+    def _refill(self, state: Optional[Tuple[float, float]], now: float) -> float:
+        if state is None:
+            return float(self.burst)
+        tokens, updated_at = state
+        return min(float(self.burst), tokens + (now - updated_at) * self.rate)
+
+    def reserve(self, max_wait: Optional[float] = None) -> Tuple[bool, float]:
+        """
+        Take a token, unless it would arrive after `max_wait` seconds.
+
+        Returns:
+            Tuple[bool, float]: Whether the token was taken, and the seconds to
+            wait before it may be used (or that it would have taken).
+        """
+        def change(state):
+            now = time.time()
+            tokens = self._refill(state, now)
+            wait = max(0.0, (1 - tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                # Rejected callers leave the bucket as it was, so they do not push back the next token.
+                return (tokens, now), (False, wait)
+            return (tokens - 1, now), (True, wait)
+
+        return self.store.update(self.name, change)
+
+    def refund(self):
+        """Give back a token taken by `reserve` that will not be used (e.g. the caller was cancelled while waiting)."""
+        def change(state):
+            now = time.time()
+            return (min(float(self.burst), self._refill(state, now) + 1), now), None
+
+        self.store.update(self.name, change)
+
+    def pause(self, seconds: float):
+        """Hold back every caller, in every process, for the given time (e.g. after a 429's Retry-After)."""
+        def change(state):
+            now = time.time()
+            return (min(self._refill(state, now), -seconds * self.rate), now), 0.0
+
+        self.store.update(self.name, change)
+
+class AdaptiveConcurrencyLimit:
+    """
+    Concurrency limit that follows the capacity of an API (AIMD).
+
+    Each request that completes within the latency target raises the limit by
+    about one per round trip; a 429/503, a timeout or a slow response halves it,
+    at most once per cooldown period. Requests above the limit wait in FIFO order.
+    """
+
+    def __init__(self, name: str, latency_target: float, initial: int = INITIAL_CONCURRENCY,
+                 min_limit: int = MIN_CONCURRENCY, max_limit: int = MAX_CONCURRENCY, cooldown: float = 1.0):
+        self.name = name
+        self.latency_target = latency_target
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    async def acquire(self, max_wait: Optional[float] = None):
+        """
+        Wait for a slot.
+
+        Raises:
+            RateLimitExceeded: If no slot frees up within `max_wait` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                return
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+        metrics.increment(f"concurrency.{self.name}.queued")
+        try:
+            done, _ = await asyncio.wait({waiter}, timeout=max_wait)
+            if not done:
+                with self._lock:
+                    expired = (loop, waiter) in self._waiters
+                    if expired:
+                        self._waiters.remove((loop, waiter))
+                if expired:
+                    waiter.cancel()
+                    metrics.increment(f"concurrency.{self.name}.timed_out")
+                    raise RateLimitExceeded(f"No {self.name} concurrency slot freed up within {max_wait:.1f}s")
+                # The slot was handed over just as the wait expired; take it.
+                await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if (loop, waiter) in self._waiters:
+                    self._waiters.remove((loop, waiter))
+                    granted = False
+                else:
+                    granted = waiter.done() and not waiter.cancelled()
+            if granted:
+                self._release_slot()
+            raise
+
+    def release(self, latency: Optional[float], overloaded: bool):
+        """
+        Free a slot and adapt the limit.
+
+        Args:
+            latency (float, optional): How long the request took, or None if it did not complete.
+            overloaded (bool): Whether the API signalled overload (429/503, timeout).
+        """
+        with self._lock:
+            now = time.monotonic()
+            if overloaded or (latency is not None and latency > self.latency_target):
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(float(self.min_limit), self.limit / 2)
+                    self._last_decrease = now
+            elif latency is not None:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            metrics.set_gauge(f"concurrency.{self.name}.limit", self.limit)
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._lock:
+            self.in_flight -= 1
+            while self._waiters and self.in_flight < int(self.limit):
+                loop, waiter = self._waiters.popleft()
+                self.in_flight += 1
+                loop.call_soon_threadsafe(self._grant, waiter)
+
+    def _grant(self, waiter: asyncio.Future):
+        if waiter.done():
+            # The waiter was cancelled after the slot was handed to it.
+            self._release_slot()
+        else:
+            waiter.set_result(None)
+
+class UpstreamLimiter:
+    """Rate limit and adaptive concurrency limit of one API."""
+
+    def __init__(self, name: str, rate: float, burst: int, latency_target: float, store):
+        self.name = name
+        self.bucket = TokenBucket(name, rate, burst, store)
+        self.concurrency = AdaptiveConcurrencyLimit(name, latency_target)
+
+    async def acquire(self, max_wait: Optional[float] = None):
+        """
+        Wait for a concurrency slot and a rate limit token.
+
+        Raises:
+            RateLimitExceeded: If the slot and the token would arrive after `max_wait` seconds.
+        """
+        started = time.monotonic()
+        await self.concurrency.acquire(max_wait)
+        if max_wait is not None:
+            max_wait = max(0.0, max_wait - (time.monotonic() - started))
+        taken, wait = self.bucket.reserve(max_wait)
+        if not taken:
+            self.concurrency.release(None, False)
+            metrics.increment(f"rate_limit.{self.name}.rejected")
+            raise RateLimitExceeded(f"Rate limit of {self.name} would delay the request by {wait:.1f}s")
+        if wait > 0:
+            metrics.increment(f"rate_limit.{self.name}.delayed")
+            metrics.observe(f"rate_limit.{self.name}.wait_seconds", wait)
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.bucket.refund()
+                self.concurrency.release(None, False)
+                raise
+
+    def release(self, latency: Optional[float], status_code: Optional[int] = None,
+                retry_after: Optional[float] = None, timed_out: bool = False):
+        overloaded = timed_out or status_code in OVERLOAD_STATUS_CODES
+        if overloaded:
+            metrics.increment(f"rate_limit.{self.name}.overloaded")
+        if retry_after:
+            self.bucket.pause(retry_after)
+        self.concurrency.release(latency, overloaded)
+
+def _parse_override(value: str, rate: float, burst: int) -> Tuple[float, int]:
+    rate_text, _, burst_text = value.partition("/")
+    return float(rate_text), int(burst_text) if burst_text else burst
+
+def _create_store():
+    if RATE_LIMIT_STATE_DIR and fcntl is not None:
+        return FileBucketStore(RATE_LIMIT_STATE_DIR)
+    if RATE_LIMIT_STATE_DIR:
+        print("File locks are not available on this platform; rate limits are kept per process.")
+    return LocalBucketStore()
+
+def _create_limiters() -> Dict[str, UpstreamLimiter]:
+    store = _create_store()
+    limiters = {}
+    for name, (host, rate, burst, latency_target) in RATE_LIMITS.items():
+        override = os.getenv(f"RATE_LIMIT_{name.upper()}")
+        if override:
+            rate, burst = _parse_override(override, rate, burst)
+        limiters[host] = UpstreamLimiter(name, rate, burst, latency_target, store)
+    return limiters
+
+limiters_by_host = _create_limiters()
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Transport that puts every request through the limiter of its API.
+
+    The wait for a token counts against the request's pool timeout, which the
+    retry policy clips to the request deadline. A slot is held until the
+    response headers arrive.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, resolve_host: Callable[[httpx.URL], str] = lambda url: url.host):
+        self.transport = transport
+        self.resolve_host = resolve_host
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        limiter = limiters_by_host.get(self.resolve_host(request.url))
+        if limiter is None:
+            return await self.transport.handle_async_request(request)
+
+        await limiter.acquire((request.extensions.get("timeout") or {}).get("pool"))
+        started = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TimeoutException:
+            limiter.release(None, timed_out=True)
+            raise
+        except BaseException:
+            limiter.release(None)
+            raise
+        limiter.release(
+            time.perf_counter() - started,
+            response.status_code,
+            parse_retry_after(response.headers.get("Retry-After")) if response.status_code in OVERLOAD_STATUS_CODES else None,
+        )
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
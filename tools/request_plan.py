@@ -0,0 +1,151 @@
+import asyncio
+import re
+from typing import Dict, List, Optional, Tuple
+from tools.api_requestor import ApiRequestorResponse, async_send_request
+from tools.models import APIRequest
+from tools.response_cache import VOLATILE_QUERY_KEYS, canonical_request_key
+from tools.retry import Deadline
+from tools.tracing import metrics, span
+
+# Single-entity lookups the API can also answer in one batched call:
+# (server pattern, path pattern with an `id` group, batched path, query key for the ids).
+MERGEABLE_REQUESTS: List[Tuple[str, str, str, str]] = [
+    (r"api\.coincap\.io", r"^/v2/assets/(?P<id>[^/]+)$", "/v2/assets", "ids"),
+]
+
+_compiled_mergeable = [
+    (re.compile(server), re.compile(path), merged_path, query_key)
+    for server, path, merged_path, query_key in MERGEABLE_REQUESTS
+]
+
+def _merge_rule(api_request: APIRequest) -> Optional[Tuple[int, str]]:
+    if api_request.method != "GET" or api_request.query or api_request.body:
+        return None
+    path = "/" + api_request.path.lstrip("/")
+    for index, (server_pattern, path_pattern, _, _) in enumerate(_compiled_mergeable):
+        if server_pattern.search(api_request.server):
+            match = path_pattern.match(path)
+            if match is not None:
+                return index, match.group("id")
+    return None
+
+def is_mergeable(api_request: APIRequest) -> bool:
+    """Whether the request may be collapsed with others of its plan into one batched call."""
+    return _merge_rule(api_request) is not None
+
+def merge_requests(api_requests: List[APIRequest]) -> List[APIRequest]:
+    """
+    Drop duplicate requests and collapse mergeable ones into batched calls.
+
+    For example, CoinCap `/v2/assets/bitcoin` and `/v2/assets/ethereum` become
+    a single `/v2/assets?ids=bitcoin,ethereum`.
+
+    Args:
+        api_requests (List[APIRequest]): The requests of a plan.
+
+    Returns:
+        List[APIRequest]: The requests to send, in the order of the plan.
+    """
+    merged: List[APIRequest] = []
+    seen = set()
+    groups: Dict[tuple, Tuple[int, List[str]]] = {}
+    for api_request in api_requests:
+        key = canonical_request_key(api_request)
+        if key in seen:
+            continue
+        seen.add(key)
+        rule = _merge_rule(api_request)
+        if rule is None:
+            merged.append(api_request)
+            continue
+        rule_index, entity_id = rule
+        group_key = (rule_index, api_request.server, tuple(sorted((api_request.headers or {}).items())))
+        if group_key not in groups:
+            groups[group_key] = (len(merged), [])
+            merged.append(api_request)
+        groups[group_key][1].append(entity_id)
+
+    for (rule_index, _, _), (position, ids) in groups.items():
+        if len(ids) < 2:
+            continue
+        _, _, merged_path, query_key = _compiled_mergeable[rule_index]
+        merged[position] = merged[position].model_copy(update={"path": merged_path, "query": {query_key: ",".join(ids)}})
+    return merged
+
+def describe_request(api_request: APIRequest) -> str:
+    """Describe a request for the humanizer, without credentials."""
+    query = "&".join(
+        f"{key}={value}"
+        for key, value in (api_request.query or {}).items()
+        if key.lower() not in VOLATILE_QUERY_KEYS
+    )
+    path = "/" + api_request.path.lstrip("/")
+    return f"{api_request.method} {path}" + (f"?{query}" if query else "")
+
+class PlanExecution:
+    """
+    Sends the requests of a plan, some of them before the whole plan is known.
+
+    `start` sends a request right away (e.g. as soon as the builder has
+    streamed it); `results` then sends the rest of the plan, after merging,
+    and reuses the calls already started.
+    """
+
+    def __init__(self, deadline: Optional[Deadline] = None):
+        self.deadline = deadline
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def start(self, api_request: APIRequest):
+        key = canonical_request_key(api_request)
+        if key not in self._tasks:
+            metrics.increment("plan.early_starts")
+            self._tasks[key] = asyncio.create_task(async_send_request(api_request, self.deadline))
+
+    def cancel(self):
+        """Cancel the requests started for a plan that will not be used."""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    async def results(self, api_requests: List[APIRequest]) -> List[Tuple[APIRequest, ApiRequestorResponse]]:
+        """
+        Send the plan and wait for every response.
+
+        Args:
+            api_requests (List[APIRequest]): The independent requests of the plan.
+
+        Returns:
+            List[Tuple[APIRequest, ApiRequestorResponse]]: Each request actually sent, with its response.
+        """
+        to_send = merge_requests(api_requests)
+        metrics.increment("plan.requests", len(api_requests))
+        metrics.increment("plan.calls", len(to_send))
+        with span("plan", requests=len(api_requests), calls=len(to_send), started_early=len(self._tasks)):
+            tasks = [
+                self._tasks.pop(canonical_request_key(api_request), None)
+                or asyncio.create_task(async_send_request(api_request, self.deadline))
+                for api_request in to_send
+            ]
+            self.cancel()
+            try:
+                responses = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+        return list(zip(to_send, responses))
+
+async def async_execute_plan(api_requests: List[APIRequest], deadline: Optional[Deadline] = None,
+                             execution: Optional[PlanExecution] = None) -> List[Tuple[APIRequest, ApiRequestorResponse]]:
+    """
+    Send the requests of a plan concurrently, after merging what can be merged.
+
+    Args:
+        api_requests (List[APIRequest]): The independent requests of the plan.
+        deadline (Deadline, optional): The deadline of the user request.
+        execution (PlanExecution, optional): Holds the requests already started for the plan.
+
+    Returns:
+        List[Tuple[APIRequest, ApiRequestorResponse]]: Each request actually sent, with its response.
+    """
+    return await (execution or PlanExecution(deadline)).results(api_requests)
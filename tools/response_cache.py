@@ -0,0 +1,318 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple, Union
+from dotenv import load_dotenv
+from tools.models import APIRequest
+
+load_dotenv()
+
+# Query parameters that do not change the upstream answer (credentials etc.).
+VOLATILE_QUERY_KEYS = {"key", "apikey", "api_key", "token"}
+
+# A TTL of None means the response never changes and can be kept forever.
+FOREVER = None
+
+def canonical_request_key(api_request: APIRequest) -> str:
+    """
+    Build a canonical cache key for an API request.
+
+    Query parameters are sorted and volatile ones (like WeatherAPI's `key`) are
+    dropped, so equivalent requests produced by the LLM share one entry.
+
+    Args:
+        api_request (APIRequest): The request to build the key for.
+
+    Returns:
+        str: The canonical key.
+    """
+    server = api_request.server.rstrip("/").lower()
+    path = "/" + api_request.path.lstrip("/")
+    query = sorted(
+        (key, str(value).strip())
+        for key, value in (api_request.query or {}).items()
+        if key.lower() not in VOLATILE_QUERY_KEYS
+    )
+    body = json.dumps(api_request.body, sort_keys=True, separators=(",", ":")) if api_request.body else ""
+    query_string = "&".join(f"{key}={value}" for key, value in query)
+    return f"{api_request.method.upper()} {server}{path}?{query_string}#{body}"
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+def _coincap_history_ttl(api_request: APIRequest, match: re.Match) -> Optional[float]:
+    query = api_request.query or {}
+    try:
+        end = int(query["end"])
+    except (KeyError, ValueError):
+        # Open-ended history keeps growing; refresh it like a live quote.
+        return 60
+    # A range that ended more than an hour ago will not get new points.
+    return FOREVER if end < _now_ms() - 3_600_000 else 60
+
+def _nager_public_holidays_ttl(api_request: APIRequest, match: re.Match) -> Optional[float]:
+    year = int(match.group("year"))
+    return FOREVER if year < datetime.now(timezone.utc).year else 86_400
+
+# (server pattern, path pattern, ttl in seconds or a callable computing it).
+# The first matching rule wins; requests that match no rule are not cached.
+TTL_POLICY: List[Tuple[str, str, object]] = [
+    (r"api\.coincap\.io", r"^/v2/assets/[^/]+/history$", _coincap_history_ttl),
+    (r"api\.coincap\.io", r"^/v2/assets/[^/]+$", 10),
+    (r"api\.coincap\.io", r"^/v2/assets$", 10),
+    (r"date\.nager\.at", r"^/api/v3/PublicHolidays/(?P<year>\d{4})/[A-Za-z]{2}$", _nager_public_holidays_ttl),
+    (r"date\.nager\.at", r"^/api/v3/AvailableCountries$", 86_400),
+    (r"date\.nager\.at", r"^/api/v3/(NextPublicHolidays|NextPublicHolidaysWorldwide|IsTodayPublicHoliday)(/.*)?$", 3_600),
+    (r"api\.weatherapi\.com", r"^/v1/forecast\.json$", 600),
+    (r"api\.weatherapi\.com", r"^/v1/current\.json$", 120),
+]
+
+_compiled_policy = [(re.compile(server), re.compile(path), ttl) for server, path, ttl in TTL_POLICY]
+
+def ttl_for(api_request: APIRequest) -> Tuple[bool, Optional[float]]:
+    """
+    Look up the cache TTL for a request.
+
+    Args:
+        api_request (APIRequest): The request to look up.
+
+    Returns:
+        Tuple[bool, Optional[float]]: Whether the request is cacheable and its
+        TTL in seconds (None for responses that never change).
+    """
+    if api_request.method.upper() != "GET":
+        return False, 0
+    path = "/" + api_request.path.lstrip("/")
+    for server_pattern, path_pattern, ttl in _compiled_policy:
+        if not server_pattern.search(api_request.server):
+            continue
+        # WeatherAPI's server carries the "/v1" prefix, so match on the full path.
+        full_path = re.sub(r"^https?://[^/]+", "", api_request.server.rstrip("/")) + path
+        match = path_pattern.match(path) or path_pattern.match(full_path)
+        if match:
+            return True, ttl(api_request, match) if callable(ttl) else ttl
+    return False, 0
+
+class _DiskTier:
+    """
+    SQLite-backed tier so cached responses survive restarts.
+
+    Bounded to `max_rows`: every `prune_every` writes, expired rows are
+    deleted, then the oldest writes beyond the bound.
+    """
+
+    def __init__(self, path: str, max_rows: int = 100_000, prune_every: int = 256):
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self._writes = 0
+        # The connection is shared by the worker threads the async API runs on.
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires_at REAL, value BLOB)"
+        )
+        self._connection.commit()
+        self.prune()
+
+    def get(self, key: str) -> Optional[Tuple[Optional[float], Union[str, bytes]]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT expires_at, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            expires_at, value = row
+            if expires_at is not None and expires_at <= time.time():
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                return None
+            return expires_at, value
+
+    def set(self, key: str, expires_at: Optional[float], value: Union[str, bytes]):
+        with self._lock:
+            # A replaced row gets a new rowid, so rowid order is write order.
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, value),
+            )
+            self._connection.commit()
+            self._writes += 1
+            if self._writes % self.prune_every:
+                return
+        self.prune()
+
+    def prune(self):
+        """Delete expired rows, then the oldest ones beyond `max_rows`."""
+        with self._lock:
+            self._connection.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+            excess = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_rows
+            if excess > 0:
+                self._connection.execute(
+                    "DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY rowid LIMIT ?)", (excess,)
+                )
+            self._connection.commit()
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+
+class ResponseCache:
+    """
+    Two-tier TTL cache for upstream API responses.
+
+    The first tier is an in-memory LRU bounded by entry count and total size,
+    the optional second tier is an SQLite file, bounded to `disk_max_rows`.
+    The async methods run the SQLite calls on worker threads.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, disk_path: Optional[str] = None,
+                 disk_max_rows: int = 100_000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Optional[float], Union[str, bytes]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk = _DiskTier(disk_path, disk_max_rows) if disk_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, api_request: APIRequest) -> Optional[Union[str, bytes]]:
+        """
+        Return the cached response body for a request, or None on a miss.
+
+        Bodies are stored as the raw bytes received; entries written by older
+        versions come back as text.
+        """
+        key = self._cacheable_key(api_request)
+        if key is None:
+            return None
+        found, value = self._get_memory(key)
+        return value if found else self._get_disk(key)
+
+    async def async_get(self, api_request: APIRequest) -> Optional[Union[str, bytes]]:
+        """Like `get`, with the SQLite lookup on a worker thread instead of the event loop."""
+        key = self._cacheable_key(api_request)
+        if key is None:
+            return None
+        found, value = self._get_memory(key)
+        if found:
+            return value
+        return await asyncio.to_thread(self._get_disk, key) if self._disk is not None else self._get_disk(key)
+
+    def set(self, api_request: APIRequest, value: Union[str, bytes], stored_at: Optional[float] = None) -> bool:
+        """
+        Store a successful response according to the endpoint's TTL policy.
+
+        Args:
+            api_request (APIRequest): The request the response answers.
+            value (Union[str, bytes]): The response body.
+            stored_at (float, optional): When the response was received, if not now (e.g. when warming the cache).
+
+        Returns:
+            bool: Whether the response was stored.
+        """
+        entry = self._set_memory(api_request, value, stored_at)
+        if entry is not None and self._disk is not None:
+            self._disk.set(*entry)
+        return entry is not None
+
+    async def async_set(self, api_request: APIRequest, value: Union[str, bytes], stored_at: Optional[float] = None) -> bool:
+        """Like `set`, with the SQLite write on a worker thread instead of the event loop."""
+        entry = self._set_memory(api_request, value, stored_at)
+        if entry is not None and self._disk is not None:
+            await asyncio.to_thread(self._disk.set, *entry)
+        return entry is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._disk is not None:
+                self._disk.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    @staticmethod
+    def _cacheable_key(api_request: APIRequest) -> Optional[str]:
+        cacheable, _ = ttl_for(api_request)
+        return canonical_request_key(api_request) if cacheable else None
+
+    def _get_memory(self, key: str) -> Tuple[bool, Optional[Union[str, bytes]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                self._remove(key)
+            if self._disk is None:
+                self.misses += 1
+            return False, None
+
+    def _get_disk(self, key: str) -> Optional[Union[str, bytes]]:
+        if self._disk is None:
+            return None
+        # Not under the memory tier's lock, so the query does not hold up other lookups.
+        disk_entry = self._disk.get(key)
+        with self._lock:
+            if disk_entry is None:
+                self.misses += 1
+                return None
+            self._insert(key, *disk_entry)
+            self.disk_hits += 1
+        return disk_entry[1]
+
+    def _set_memory(self, api_request: APIRequest, value: Union[str, bytes],
+                    stored_at: Optional[float]) -> Optional[Tuple[str, Optional[float], Union[str, bytes]]]:
+        cacheable, ttl = ttl_for(api_request)
+        if not cacheable or (ttl is not None and ttl <= 0):
+            return None
+        key = canonical_request_key(api_request)
+        expires_at = None if ttl is None else (stored_at or time.time()) + ttl
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        with self._lock:
+            self._insert(key, expires_at, value)
+        return key, expires_at, value
+
+    def _insert(self, key: str, expires_at: Optional[float], value: Union[str, bytes]):
+        if key in self._entries:
+            self._remove(key)
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (expires_at, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    disk_path=os.getenv("RESPONSE_CACHE_PATH") or None,
+    disk_max_rows=int(os.getenv("RESPONSE_CACHE_DISK_MAX_ROWS", "100000")),
+)
@@ -0,0 +1,230 @@
+import json
+import re
+from datetime import date, datetime, timezone
+from typing import Callable, List, Optional, Tuple, Union
+import numpy as np
+from pydantic import BaseModel
+from tools import json_codec
+from tools.models import APIRequest
+
+# Hard budget for the API response pasted into the humanizer prompt. Roughly
+# four bytes of JSON make one token, so this is about 1500 prompt tokens.
+MAX_RESPONSE_BYTES = 6000
+
+# Time series longer than this are downsampled before being shown to the LLM.
+MAX_SERIES_POINTS = 48
+
+ASSET_FIELDS = ["id", "rank", "symbol", "name", "priceUsd", "changePercent24Hr"]
+ASSET_OPTIONAL_FIELDS = {
+    "marketCapUsd": re.compile(r"market ?cap|piyasa değeri|market pay", re.IGNORECASE),
+    "volumeUsd24Hr": re.compile(r"volume|hacim|traded|işlem", re.IGNORECASE),
+    "supply": re.compile(r"supply|arz", re.IGNORECASE),
+    "maxSupply": re.compile(r"supply|arz", re.IGNORECASE),
+    "vwap24Hr": re.compile(r"vwap|average|ortalama", re.IGNORECASE),
+}
+HOLIDAY_FIELDS = ["date", "localName", "name", "countryCode", "types"]
+MONTHS = [
+    ("january", "ocak"), ("february", "şubat"), ("march", "mart"), ("april", "nisan"),
+    ("may", "mayıs"), ("june", "haziran"), ("july", "temmuz"), ("august", "ağustos"),
+    ("september", "eylül"), ("october", "ekim"), ("november", "kasım"), ("december", "aralık"),
+]
+# English names are whole words; Turkish ones take case suffixes, with or without an apostrophe ("ocakta", "Mayıs'ta").
+# "may" is a month only next to a number ("May 5", "5th of May", "May 2025") or after "in/of/on/...".
+_MONTH_PATTERNS = [
+    re.compile(
+        (r"\b(?:(?:in|of|on|during|until|since|by)\s+may|may\s+\d{1,4}|\d{1,2}(?:st|nd|rd|th)?\s+(?:of\s+)?may)\b" if english == "may"
+         else rf"\b{english}\b")
+        + rf"|\b{turkish}(?:['’]?[^\W\d_]{{0,4}})?\b",
+        re.IGNORECASE,
+    )
+    for english, turkish in MONTHS
+]
+UPCOMING_PATTERN = re.compile(r"\b(next|upcoming|coming|önümüzdeki|sonraki|gelecek|yaklaşan)\b", re.IGNORECASE)
+
+class ReducedResponse(BaseModel):
+    api_response: str
+    original_bytes: int
+    reduced_bytes: int
+    projector: Optional[str] = None
+
+    @property
+    def reduction_ratio(self) -> float:
+        return self.original_bytes / self.reduced_bytes if self.reduced_bytes else 1.0
+
+def _pick(item: dict, fields: List[str]) -> dict:
+    return {field: item[field] for field in fields if field in item}
+
+def _asset_fields(user_prompt: str) -> List[str]:
+    return ASSET_FIELDS + [field for field, pattern in ASSET_OPTIONAL_FIELDS.items() if pattern.search(user_prompt)]
+
+def _project_coincap_assets(user_prompt: str, api_request: APIRequest, data):
+    fields = _asset_fields(user_prompt)
+    assets = data.get("data")
+    if isinstance(assets, list):
+        data["data"] = [_pick(asset, fields) for asset in assets]
+    elif isinstance(assets, dict):
+        data["data"] = _pick(assets, fields)
+    return data
+
+def _downsample_indices(length: int, max_points: int) -> np.ndarray:
+    if length <= max_points:
+        return np.arange(length)
+    return np.unique(np.linspace(0, length - 1, max_points).round().astype(int))
+
+def _project_coincap_history(user_prompt: str, api_request: APIRequest, data):
+    points = data.get("data")
+    if not isinstance(points, list) or not points:
+        return data
+
+    prices = np.array([float(point["priceUsd"]) for point in points])
+    times = np.array([int(point["time"]) for point in points])
+
+    def at(index) -> dict:
+        index = int(index)
+        return {"priceUsd": f"{prices[index]:.6g}", "date": points[index].get("date")}
+
+    summary = {
+        "points": len(points),
+        "first": at(0),
+        "last": at(len(points) - 1),
+        "min": at(np.argmin(prices)),
+        "max": at(np.argmax(prices)),
+        "mean": f"{prices.mean():.6g}",
+        "changePercent": f"{(prices[-1] / prices[0] - 1) * 100:.4g}" if prices[0] else None,
+    }
+    indices = _downsample_indices(len(points), MAX_SERIES_POINTS)
+    series = [
+        {"priceUsd": f"{prices[i]:.6g}", "date": points[i].get("date") or datetime.fromtimestamp(times[i] / 1000, timezone.utc).isoformat()}
+        for i in indices
+    ]
+    return {"summary": summary, "data": series, "downsampled": len(series) < len(points)}
+
+def _mentioned_months(user_prompt: str) -> List[int]:
+    return [number for number, pattern in enumerate(_MONTH_PATTERNS, start=1) if pattern.search(user_prompt)]
+
+def _project_nager_holidays(user_prompt: str, api_request: APIRequest, data):
+    if not isinstance(data, list):
+        return data
+    holidays = [_pick(holiday, HOLIDAY_FIELDS) for holiday in data]
+
+    months = _mentioned_months(user_prompt)
+    if months:
+        in_window = [holiday for holiday in holidays if int(holiday["date"][5:7]) in months]
+        holidays = in_window or holidays
+    elif UPCOMING_PATTERN.search(user_prompt):
+        today = date.today().isoformat()
+        upcoming = [holiday for holiday in holidays if holiday["date"] >= today]
+        holidays = upcoming or holidays
+    return holidays
+
+def _project_weather_forecast(user_prompt: str, api_request: APIRequest, data):
+    forecast = data.get("forecast") or {}
+    for day in forecast.get("forecastday") or []:
+        # 24 hourly entries per day dominate the payload; the day summary is enough.
+        day.pop("hour", None)
+    return data
+
+def _project_weather_current(user_prompt: str, api_request: APIRequest, data):
+    current = data.get("current")
+    if isinstance(current, dict):
+        for noisy_field in ("last_updated_epoch", "wind_degree", "pressure_in", "precip_in", "vis_miles", "gust_mph", "feelslike_f", "windchill_f", "heatindex_f", "dewpoint_f"):
+            current.pop(noisy_field, None)
+    return data
+
+# (server pattern, path pattern, projector). The first match wins.
+PROJECTORS: List[Tuple[str, str, Callable]] = [
+    (r"api\.coincap\.io", r"^/v2/assets/[^/]+/history$", _project_coincap_history),
+    (r"api\.coincap\.io", r"^/v2/assets(/[^/]+)?$", _project_coincap_assets),
+    (r"date\.nager\.at", r"^/api/v3/(PublicHolidays|NextPublicHolidays|NextPublicHolidaysWorldwide)(/.*)?$", _project_nager_holidays),
+    (r"api\.weatherapi\.com", r"^(/v1)?/forecast\.json$", _project_weather_forecast),
+    (r"api\.weatherapi\.com", r"^(/v1)?/current\.json$", _project_weather_current),
+]
+
+_compiled_projectors = [(re.compile(server), re.compile(path), projector) for server, path, projector in PROJECTORS]
+
+def register_projector(server_pattern: str, path_pattern: str, projector: Callable):
+    """
+    Register a projector for an endpoint, ahead of the built-in ones.
+
+    Args:
+        server_pattern (str): Regex matched against the request's server.
+        path_pattern (str): Regex matched against the request's path.
+        projector (Callable): Called with (user_prompt, api_request, data) and returns the reduced data.
+    """
+    _compiled_projectors.insert(0, (re.compile(server_pattern), re.compile(path_pattern), projector))
+
+def _find_projector(api_request: APIRequest) -> Optional[Callable]:
+    path = "/" + api_request.path.lstrip("/")
+    for server_pattern, path_pattern, projector in _compiled_projectors:
+        if server_pattern.search(api_request.server) and path_pattern.match(path):
+            return projector
+    return None
+
+def _dumps(data) -> str:
+    return json_codec.dumps(data)
+
+def _halve_lists(data):
+    """Drop every other element of each list, recursively."""
+    if isinstance(data, list):
+        kept = data[::2] if len(data) > 1 else data
+        return [_halve_lists(item) for item in kept]
+    if isinstance(data, dict):
+        return {key: _halve_lists(value) for key, value in data.items()}
+    return data
+
+TRUNCATION_MARKER = "...(truncated)"
+
+def _truncate(text: Union[str, bytes], max_bytes: int) -> str:
+    encoded = text if isinstance(text, bytes) else text.encode()
+    if len(encoded) <= max_bytes:
+        return encoded.decode(errors="replace") if isinstance(text, bytes) else text
+    # The marker counts against the budget too, so the result is never larger than `max_bytes`.
+    if max_bytes < len(TRUNCATION_MARKER):
+        return TRUNCATION_MARKER[:max_bytes]
+    return encoded[:max_bytes - len(TRUNCATION_MARKER)].decode(errors="ignore") + TRUNCATION_MARKER
+
+def _enforce_budget(data, max_bytes: int) -> str:
+    reduced = _dumps(data)
+    while len(reduced.encode()) > max_bytes:
+        halved = _halve_lists(data)
+        halved_dump = _dumps(halved)
+        if len(halved_dump) >= len(reduced):
+            break
+        data, reduced = halved, halved_dump
+    return _truncate(reduced, max_bytes)
+
+def reduce_api_response(user_prompt: str, api_request: APIRequest, api_response: Union[str, bytes], max_bytes: int = MAX_RESPONSE_BYTES) -> ReducedResponse:
+    """
+    Shrink an upstream API response before it is pasted into the humanizer prompt.
+
+    The endpoint's projector keeps only what the prompt needs (selected fields,
+    a downsampled series with summary statistics, holidays in the asked-for
+    window), then the result is cut down to the byte budget.
+
+    Args:
+        user_prompt (str): The user prompt.
+        api_request (APIRequest): The request that produced the response.
+        api_response (Union[str, bytes]): The JSON response body; raw bytes are parsed without a text copy.
+        max_bytes (int): The hard size budget for the reduced response.
+
+    Returns:
+        ReducedResponse: The reduced response and its size before and after.
+    """
+    original_bytes = len(api_response) if isinstance(api_response, bytes) else len(api_response.encode())
+    projector = _find_projector(api_request)
+    try:
+        data = json_codec.loads(api_response)
+        if projector is not None:
+            data = projector(user_prompt, api_request, data)
+        reduced = _enforce_budget(data, max_bytes)
+    except (json.JSONDecodeError, KeyError, ValueError, TypeError, AttributeError) as e:
+        print(f"Could not project the API response: {e}")
+        projector = None
+        reduced = _truncate(api_response, max_bytes)
+
+    return ReducedResponse(
+        api_response=reduced,
+        original_bytes=original_bytes,
+        reduced_bytes=len(reduced.encode()),
+        projector=projector.__name__.lstrip("_") if projector else None,
+    )
@@ -0,0 +1,179 @@
+import asyncio
+import email.utils
+import os
+import random
+import time
+from typing import Awaitable, Callable, Optional
+import httpx
+from dotenv import load_dotenv
+from tools.tracing import annotate, metrics, span
+
+load_dotenv()
+
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("CONNECT_TIMEOUT_SECONDS", "3"))
+READ_TIMEOUT_SECONDS = float(os.getenv("READ_TIMEOUT_SECONDS", "30"))
+# Overall budget of one user request, shared by every stage and retry.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+# Attempts per stage (LLM call or upstream call), including the first one.
+MAX_STAGE_ATTEMPTS = int(os.getenv("MAX_STAGE_ATTEMPTS", "3"))
+
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """The request deadline passed before a stage could (re)start."""
+
+    def __init__(self, message: str = "Request deadline exceeded"):
+        super().__init__(message)
+
+class Deadline:
+    """Point in time by which the whole request must be answered."""
+
+    def __init__(self, seconds: Optional[float]):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a `Retry-After` header, given either in seconds or as an HTTP date.
+
+    Returns:
+        Optional[float]: The delay in seconds, or None if the header is missing or malformed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+class RetryPolicy:
+    """
+    Timeouts, deadline and backoff shared by every outbound call.
+
+    Each stage retries itself: a 429/5xx or a transport error re-sends the same
+    request after an exponential backoff with full jitter (or after the delay
+    asked for by `Retry-After`), as long as the request deadline allows it.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = READ_TIMEOUT_SECONDS,
+        deadline: Optional[float] = REQUEST_DEADLINE_SECONDS,
+        max_attempts: int = MAX_STAGE_ATTEMPTS,
+        base_delay: float = 0.25,
+        max_delay: float = 8.0,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def start(self) -> Deadline:
+        """Start the deadline of a new user request."""
+        return Deadline(self.deadline)
+
+    def timeout(self, deadline: Optional[Deadline] = None) -> httpx.Timeout:
+        """
+        Timeouts for one HTTP call, clipped to what is left of the deadline.
+
+        Raises:
+            DeadlineExceeded: If the deadline has already passed.
+        """
+        connect, read = self.connect_timeout, self.read_timeout
+        remaining = deadline.remaining() if deadline is not None else None
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded()
+            connect, read = min(connect, remaining), min(read, remaining)
+        return httpx.Timeout(connect=connect, read=read, write=read, pool=connect)
+
+    def is_retryable(self, status_code: int) -> bool:
+        return status_code in RETRYABLE_STATUS_CODES
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def backoff(self, stage: str, attempt: int, deadline: Optional[Deadline] = None, retry_after: Optional[str] = None) -> bool:
+        """
+        Wait before retrying a stage, if another attempt is allowed.
+
+        Args:
+            stage (str): The stage name, for metrics (deepseek, upstream...).
+            attempt (int): The zero-based number of the attempt that just failed.
+            deadline (Deadline, optional): The request deadline.
+            retry_after (str, optional): The `Retry-After` header of the failed response.
+
+        Returns:
+            bool: True after waiting, False if the stage should give up instead.
+        """
+        if attempt + 1 >= self.max_attempts:
+            return False
+        delay = self.delay(attempt, parse_retry_after(retry_after))
+        remaining = deadline.remaining() if deadline is not None else None
+        if remaining is not None and delay >= remaining:
+            metrics.increment(f"retry.{stage}.deadline")
+            return False
+        metrics.increment(f"retry.{stage}")
+        annotate(retries=attempt + 1)
+        await asyncio.sleep(delay)
+        return True
+
+    async def send(
+        self,
+        stage: str,
+        send: Callable[[httpx.Timeout], Awaitable[httpx.Response]],
+        deadline: Optional[Deadline] = None,
+    ) -> httpx.Response:
+        """
+        Send a request, re-sending it on retryable statuses and transport errors.
+
+        Args:
+            stage (str): The stage name, for metrics.
+            send: Sends the request once with the given timeout.
+            deadline (Deadline, optional): The request deadline.
+
+        Returns:
+            httpx.Response: The last response; its status may still be an error.
+
+        Raises:
+            httpx.TransportError: If the last attempt failed to get a response.
+            DeadlineExceeded: If the deadline passed before an attempt.
+        """
+        attempt = 0
+        while True:
+            try:
+                # One child span per attempt, so retries show up in the trace with their own timing.
+                with span("http_attempt", stage=stage, number=attempt + 1) as attempt_span:
+                    response = await send(self.timeout(deadline))
+                    attempt_span.set(status=response.status_code)
+            except DeadlineExceeded:
+                raise
+            except httpx.TransportError:
+                if not await self.backoff(stage, attempt, deadline):
+                    raise
+            else:
+                if not self.is_retryable(response.status_code):
+                    return response
+                if not await self.backoff(stage, attempt, deadline, response.headers.get("Retry-After")):
+                    return response
+                # Streamed responses hold their connection until closed.
+                await response.aclose()
+            attempt += 1
+
+retry_policy = RetryPolicy()
@@ -1,12 +1,31 @@
+import hashlib
+import json
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from pydantic import BaseModel
+from tools.tracing import span
 from semantic_router import Route
 from semantic_router.encoders import HuggingFaceEncoder
-from semantic_router.layer import RouteLayer
 
-encoder = HuggingFaceEncoder(name="sentence-transformers/all-MiniLM-L6-v2")
-# encoder = HuggingFaceEncoder(name="BAAI/bge-m3")
-# encoder = HuggingFaceEncoder(name="sentence-transformers/all-mpnet-base-v2")
-# encoder = HuggingFaceEncoder(name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-# encoder = HuggingFaceEncoder(name="nomic-ai/nomic-embed-text-v1.5")
+ENCODER_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# ENCODER_NAME = "BAAI/bge-m3"
+# ENCODER_NAME = "sentence-transformers/all-mpnet-base-v2"
+# ENCODER_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# ENCODER_NAME = "nomic-ai/nomic-embed-text-v1.5"
+
+# Same defaults as semantic_router's RouteLayer with a HuggingFaceEncoder.
+TOP_K = 5
+SCORE_THRESHOLD = 0.5
+# Route score gap below which the runner-up route's API is tried as well.
+SPECULATION_MARGIN = float(os.getenv("SPECULATION_MARGIN", "0.05"))
+
+ROUTE_INDEX_DIR = os.getenv(
+    "ROUTE_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "route_index"),
+)
 
 weather_route = Route(
     name="weather",
@@ -168,8 +187,249 @@ public_holidays_route = Route(
 )
 
 routes = [weather_route, finance_route, news_route, coin_route, public_holidays_route]
-route_layer = RouteLayer(encoder=encoder, routes=routes)
+
+# The API that answers each route; routes without one are not served yet.
+ROUTE_APIS = {"weather": "weatherapi", "coin": "coincap", "public_holidays": "nager"}
+
+_encoder = None
+_route_index = None
+_load_lock = threading.RLock()
+
+def get_encoder() -> HuggingFaceEncoder:
+    """
+    Return the router's encoder, loading the model on first use.
+    """
+    global _encoder
+    if _encoder is None:
+        with _load_lock:
+            if _encoder is None:
+                _encoder = HuggingFaceEncoder(name=ENCODER_NAME)
+    return _encoder
+
+def _route_index_hash() -> str:
+    utterances = [[route.name, route.utterances] for route in routes]
+    payload = json.dumps([ENCODER_NAME, utterances], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+def _build_route_index(path: str):
+    names = [route.name for route in routes for _ in route.utterances]
+    utterances = [utterance for route in routes for utterance in route.utterances]
+    embeddings = np.asarray(get_encoder()(utterances), dtype=np.float32)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as index_file:
+        np.save(index_file, embeddings)
+    temporary_routes_path = f"{path}.routes.json.{os.getpid()}.tmp"
+    with open(temporary_routes_path, "w") as routes_file:
+        json.dump(names, routes_file)
+    # Both files are renamed into place, the index last: other processes never read
+    # a half-written file, and once the index exists its routes file does too.
+    os.replace(temporary_routes_path, f"{path}.routes.json")
+    os.replace(temporary_path, path)
+
+def get_route_index():
+    """
+    Return the utterance embeddings and the route name of each row.
+
+    The embeddings are computed once and stored under ROUTE_INDEX_DIR in a file
+    named after a hash of the encoder name and all utterances, so editing a
+    route or switching models invalidates it. The file is memory-mapped, which
+    lets every worker process share the same pages.
+
+    Returns:
+        tuple: (embeddings matrix, array of route names, row norms).
+    """
+    global _route_index
+    if _route_index is None:
+        with _load_lock:
+            if _route_index is None:
+                path = os.path.join(ROUTE_INDEX_DIR, f"{_route_index_hash()}.npy")
+                if not os.path.exists(path):
+                    print(f"Building route index at {path}.")
+                    _build_route_index(path)
+                embeddings = np.load(path, mmap_mode="r")
+                with open(f"{path}.routes.json") as routes_file:
+                    names = np.array(json.load(routes_file))
+                _route_index = (embeddings, names, np.linalg.norm(embeddings, axis=1))
+    return _route_index
+
+def warmup():
+    """
+    Load the encoder and the route index ahead of the first query.
+    """
+    get_route_index()
+    embed_query("warmup")
+
+@lru_cache(maxsize=1024)
+def _embed_query(user_query: str) -> tuple:
+    return tuple(get_encoder()([user_query])[0])
+
+def embed_query(user_query: str) -> list:
+    """
+    Embed a query with the router's encoder.
+
+    Recent embeddings are memoized, so the semantic request cache can reuse the
+    vector that routing already computed for the same query.
+
+    Args:
+        user_query (str): The user query.
+
+    Returns:
+        list: The query embedding.
+    """
+    return list(_embed_query(user_query))
+
+class RouteResult(BaseModel):
+    name: Optional[str] = None  # None when no route passes the score threshold
+    score: float  # Best utterance similarity of the selected (or top) route
+    runner_up: Optional[str] = None
+    runner_up_score: Optional[float] = None
+    scores: Dict[str, float] = {}  # Best utterance similarity of every route
+
+    @property
+    def margin(self) -> Optional[float]:
+        """How far ahead of the runner-up the route is; small margins mean an ambiguous query."""
+        if self.runner_up_score is None:
+            return None
+        return self.score - self.runner_up_score
+
+def _similarities(vectors: np.ndarray) -> np.ndarray:
+    """Cosine similarity of each query vector (row) to every route utterance."""
+    embeddings, _, norms = get_route_index()
+    return (vectors @ embeddings.T) / np.outer(np.linalg.norm(vectors, axis=1), norms)
+
+def _route_best_scores(similarities: np.ndarray, names: np.ndarray):
+    """Best utterance similarity per route, as a (queries, routes) matrix."""
+    route_names = [route.name for route in routes]
+    best = np.stack([similarities[:, names == name].max(axis=1) for name in route_names], axis=1)
+    return route_names, best
+
+def _classify(similarities: np.ndarray, names: np.ndarray):
+    """
+    Pick a route from the similarities to every utterance.
+
+    Mirrors RouteLayer: the top-k utterances are grouped by route, the route
+    with the highest summed score wins, and it is only selected if its best
+    utterance passes the score threshold.
+    """
+    top_k = min(TOP_K, similarities.shape[0])
+    top_indices = np.argpartition(similarities, -top_k)[-top_k:]
+    scores_by_route = {}
+    for index in top_indices:
+        scores_by_route.setdefault(str(names[index]), []).append(float(similarities[index]))
+    top_route = max(scores_by_route, key=lambda name: sum(scores_by_route[name]))
+    if max(scores_by_route[top_route]) > SCORE_THRESHOLD:
+        return top_route
+    return None
+
+def _route_vectors(vectors: np.ndarray) -> List[RouteResult]:
+    _, names, _ = get_route_index()
+    similarities = _similarities(vectors)
+    route_names, best_scores = _route_best_scores(similarities, names)
+
+    results = []
+    for row, row_best in zip(similarities, best_scores):
+        selected = _classify(row, names)
+        order = np.argsort(-row_best, kind="stable")
+        top = route_names.index(selected) if selected is not None else int(order[0])
+        runner_up = next((int(index) for index in order if index != top), None)
+        results.append(RouteResult(
+            name=selected,
+            score=float(row_best[top]),
+            runner_up=route_names[runner_up] if runner_up is not None else None,
+            runner_up_score=float(row_best[runner_up]) if runner_up is not None else None,
+            scores={name: float(score) for name, score in zip(route_names, row_best)},
+        ))
+    return results
+
+def route_queries(user_queries: List[str], batch_size: int = 32) -> List[RouteResult]:
+    """
+    Route many queries at once, for offline jobs.
+
+    Queries are encoded in batches (sorted by length to keep padding low) and
+    scored against every route utterance with one matrix product per batch.
+    The scoring is the same code path `route_query` uses, so the selected
+    routes match the single-query results.
+
+    Args:
+        user_queries (List[str]): The queries to route.
+        batch_size (int): How many queries to encode per forward pass.
+
+    Returns:
+        List[RouteResult]: One result per query, in input order, with the
+        selected route, its score and the runner-up route.
+    """
+    if not user_queries:
+        return []
+    with span("route_batch", queries=len(user_queries)):
+        return _route_queries(user_queries, batch_size)
+
+def _route_queries(user_queries: List[str], batch_size: int) -> List[RouteResult]:
+    order = sorted(range(len(user_queries)), key=lambda index: len(user_queries[index]))
+    results: List[Optional[RouteResult]] = [None] * len(user_queries)
+    for batch_start in range(0, len(order), batch_size):
+        batch = order[batch_start:batch_start + batch_size]
+        vectors = np.asarray(get_encoder()([user_queries[index] for index in batch], batch_size=batch_size))
+        for index, result in zip(batch, _route_vectors(vectors)):
+            results[index] = result
+    return results
+
+def embed_and_route(user_queries: List[str]) -> Tuple[np.ndarray, List[RouteResult]]:
+    """
+    Encode queries in one forward pass and route them.
+
+    This is the unit of work of the router worker processes (see
+    tools/router_pool.py); the embeddings are returned too, so the caller can
+    reuse them for the semantic cache and example selection.
+
+    Args:
+        user_queries (List[str]): The queries to route.
+
+    Returns:
+        Tuple[np.ndarray, List[RouteResult]]: One embedding (row) and one result per query.
+    """
+    vectors = np.asarray(get_encoder()(user_queries, batch_size=max(len(user_queries), 1)), dtype=np.float32)
+    return vectors, _route_vectors(vectors)
+
+def route_query_with_scores(user_query: str) -> RouteResult:
+    """
+    Route a query and return the score of every route.
+
+    Args:
+        user_query (str): The user query.
+
+    Returns:
+        RouteResult: The selected route, its runner-up and all route scores.
+    """
+    with span("route") as route_span:
+        vector = np.asarray([embed_query(user_query)])
+        route_result = _route_vectors(vector)[0]
+        route_span.set(route=route_result.name, score=route_result.score, margin=route_result.margin)
+    return route_result
 
 def route_query(user_query):
-    selected_route = route_layer(user_query).name
-    return selected_route
\ No newline at end of file
+    return route_query_with_scores(user_query).name
+
+def candidate_apis(route_result: RouteResult, margin: float = SPECULATION_MARGIN) -> List[str]:
+    """
+    The APIs worth building a request for.
+
+    That is the selected route's API, plus the runner-up's when the runner-up
+    scored within `margin` of the selected route (coin vs finance, weather vs
+    public holidays...), so both can be tried at once.
+
+    Args:
+        route_result (RouteResult): The routing result.
+        margin (float): The largest score gap at which the runner-up is still tried.
+
+    Returns:
+        List[str]: The API names, most likely first; empty if no API can answer.
+    """
+    if route_result.name is None:
+        return []
+    apis = [ROUTE_APIS[route_result.name]] if route_result.name in ROUTE_APIS else []
+    runner_up_api = ROUTE_APIS.get(route_result.runner_up)
+    if runner_up_api is not None and runner_up_api not in apis and route_result.margin is not None and route_result.margin < margin:
+        apis.append(runner_up_api)
+    return apis
@@ -0,0 +1,308 @@
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from tools import example_bank
+from tools.router import RouteResult, embed_and_route, warmup
+from tools.tracing import metrics, span
+
+load_dotenv()
+
+# Encoder worker processes; each loads the model once. 0 encodes in the calling thread instead.
+ROUTER_PROCESSES = int(os.getenv("ROUTER_PROCESSES", str(min(4, os.cpu_count() or 1))))
+# Queries arriving within this window (milliseconds) are encoded in one forward pass.
+ROUTER_BATCH_WINDOW_MS = float(os.getenv("ROUTER_BATCH_WINDOW_MS", "2"))
+ROUTER_MAX_BATCH = int(os.getenv("ROUTER_MAX_BATCH", "32"))
+# Normalized query text -> (embedding, route) entries kept in the parent process.
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "4096"))
+# Torch threads per worker process; more than one oversubscribes the cores the pool already spreads over.
+ROUTER_TORCH_THREADS = int(os.getenv("ROUTER_TORCH_THREADS", "1"))
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+def normalize_query(user_query: str) -> str:
+    """
+    The cache key of a query: Unicode-normalized, with runs of whitespace collapsed.
+
+    Only differences the encoder cannot see are removed, so a cached embedding
+    is the one the encoder would compute for the query itself.
+    """
+    return _WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", user_query)).strip()
+
+def _init_worker(torch_threads: int):
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    # Load the encoder and map the route index once, before the first batch.
+    warmup()
+    # Build any missing example index here, so the server process maps it without loading the model.
+    example_bank.warmup()
+
+def _ping() -> int:
+    time.sleep(0.05)
+    return os.getpid()
+
+class RouterPool:
+    """
+    Routing backend that spreads the encoder over several processes.
+
+    A MiniLM forward pass holds the GIL, so encoder threads in the server
+    process run one at a time. Here, queries are queued to a dispatcher thread
+    that collects the ones arriving within `batch_window` seconds (up to
+    `max_batch`) and submits each batch to a pool of worker processes, which
+    encode it in one forward pass and route it. Batches run on all workers at
+    once, so routing throughput grows with the cores.
+
+    In front of the pool sits an LRU of normalized query text -> (embedding,
+    route), and identical queries already queued share one slot of a batch.
+    With `processes=0`, or until `start` is called (scripts and the CLI never
+    call it), the same cache fronts an in-thread encoder, so no process is
+    ever spawned behind a caller's back.
+    """
+
+    def __init__(self, processes: int = ROUTER_PROCESSES, batch_window: float = ROUTER_BATCH_WINDOW_MS / 1000,
+                 max_batch: int = ROUTER_MAX_BATCH, cache_size: int = ROUTE_CACHE_SIZE, torch_threads: int = ROUTER_TORCH_THREADS):
+        self.processes = processes
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.torch_threads = torch_threads
+        self._cache: "OrderedDict[str, Tuple[np.ndarray, RouteResult]]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self.started = False
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+    def start(self):
+        """
+        Start the worker processes and wait until each has loaded the model,
+        so the first queries do not pay for it. Without processes, load the
+        encoder in this process instead.
+        """
+        if self.processes <= 0:
+            warmup()
+            return
+        self.started = True
+        executor = self._get_executor()
+        # A worker runs its initializer before its first task, and holds a ping
+        # for a moment, so the pings of a round spread over the ready workers.
+        pids = set()
+        for _ in range(10):
+            pids.update(future.result() for future in [executor.submit(_ping) for _ in range(self.processes)])
+            if len(pids) >= self.processes:
+                break
+        print(f"Router pool started with {len(pids)} worker processes.")
+
+    def close(self):
+        self.started = False
+        with self._lock:
+            dispatcher, self._dispatcher = self._dispatcher, None
+            executor, self._executor = self._executor, None
+        if dispatcher is not None:
+            self._queue.put(None)
+            dispatcher.join()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def route(self, user_query: str) -> RouteResult:
+        """
+        Route a query, blocking until its batch is done.
+
+        Args:
+            user_query (str): The user query.
+
+        Returns:
+            RouteResult: The selected route, its runner-up and all route scores.
+        """
+        with span("route") as route_span:
+            route_result = self._lookup(user_query, route_span).result()[1]
+            route_span.set(route=route_result.name, score=route_result.score, margin=route_result.margin)
+        return route_result
+
+    async def async_route(self, user_query: str, executor=None) -> RouteResult:
+        """
+        Route a query without blocking the event loop.
+
+        Args:
+            user_query (str): The user query.
+            executor (optional): Threads for the in-process encoder when there
+                are no worker processes (default: the loop's executor).
+
+        Returns:
+            RouteResult: The selected route, its runner-up and all route scores.
+        """
+        if not self.pooled and not self._cached(user_query):
+            # Run in a copy of this context, so the route span stays a child of the caller's span.
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(executor, context.run, self.route, user_query)
+        with span("route") as route_span:
+            route_result = (await asyncio.wrap_future(self._lookup(user_query, route_span)))[1]
+            route_span.set(route=route_result.name, score=route_result.score, margin=route_result.margin)
+        return route_result
+
+    def embed(self, user_query: str) -> list:
+        """
+        Embed a query with the router's encoder.
+
+        Routing a query caches its embedding, so the semantic request cache and
+        the example selection reuse the vector instead of encoding it again.
+        """
+        return self._lookup(user_query).result()[0].tolist()
+
+    @property
+    def pooled(self) -> bool:
+        """Whether queries go to the worker processes rather than an in-thread encoder."""
+        return self.processes > 0 and self.started
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "processes": self.processes if self.pooled else 0,
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "batches": self.batches,
+                "mean_batch_size": self.misses / self.batches if self.batches else 0.0,
+            }
+
+    def _cached(self, user_query: str) -> bool:
+        with self._lock:
+            return normalize_query(user_query) in self._cache
+
+    def _lookup(self, user_query: str, route_span=None) -> Future:
+        key = normalize_query(user_query)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+            else:
+                future = self._pending.get(key)
+                queued = future is None
+                if queued:
+                    future = self._pending[key] = Future()
+                    self.misses += 1
+        if entry is not None:
+            metrics.increment("router.cache_hits")
+            if route_span is not None:
+                route_span.set(cached=True)
+            done = Future()
+            done.set_result(entry)
+            return done
+        if queued:
+            metrics.increment("router.cache_misses")
+            if not self.pooled:
+                try:
+                    self._complete([key], *embed_and_route([key]))
+                except Exception as e:
+                    self._fail([key], e)
+            else:
+                self._ensure_dispatcher()
+                self._queue.put(key)
+        return future
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Spawned rather than forked: the parent may already run torch and HTTP threads.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.torch_threads,),
+                )
+            return self._executor
+
+    def _ensure_dispatcher(self):
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="router-dispatcher", daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            key = self._queue.get()
+            if key is None:
+                return
+            batch = [key]
+            closes_at = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    key = self._queue.get(timeout=max(closes_at - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if key is None:
+                    self._queue.put(None)
+                    break
+                batch.append(key)
+            self._submit(batch)
+
+    def _submit(self, keys: List[str]):
+        metrics.observe("router.batch_size", len(keys))
+        if not self.started:
+            self._fail(keys, RuntimeError("The router pool is closed"))
+            return
+        try:
+            # Creates a fresh pool if the last one broke.
+            executor = self._get_executor()
+            submitted = executor.submit(embed_and_route, keys)
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._fail(keys, e)
+            return
+        # The next batch is assembled while this one is encoded by a worker.
+        submitted.add_done_callback(lambda done: self._on_batch_done(keys, executor, done))
+
+    def _on_batch_done(self, keys: List[str], executor: ProcessPoolExecutor, done: Future):
+        error = done.exception()
+        if error is not None:
+            self._fail(keys, error, executor)
+            return
+        self._complete(keys, *done.result())
+
+    def _complete(self, keys: List[str], vectors: np.ndarray, route_results: List[RouteResult]):
+        with self._lock:
+            self.batches += 1
+            futures = []
+            for key, vector, route_result in zip(keys, vectors, route_results):
+                self._cache[key] = (vector, route_result)
+                self._cache.move_to_end(key)
+                futures.append(self._pending.pop(key))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for future, vector, route_result in zip(futures, vectors, route_results):
+            future.set_result((vector, route_result))
+
+    def _fail(self, keys: List[str], error: BaseException, executor: Optional[ProcessPoolExecutor] = None):
+        if isinstance(error, BrokenProcessPool):
+            # A worker died (out of memory, killed); start a fresh pool for the next batch.
+            print(f"Router worker pool broke: {error}. Restarting it.")
+            metrics.increment("router.pool_restarts")
+            with self._lock:
+                if executor is not None and self._executor is executor:
+                    self._executor = None
+        with self._lock:
+            futures = [self._pending.pop(key) for key in keys]
+        for future in futures:
+            future.set_exception(error)
+
+router_pool = RouterPool()
@@ -0,0 +1,216 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+import numpy as np
+from tools.fast_path import prompt_entities
+from tools.models import APIRequest
+
+# Prompts whose meaning depends on "now". A cached request for them carries
+# timestamps computed at the time it was built, so it can only be reused when
+# those timestamps can be re-derived.
+TIME_RELATIVE_PATTERN = re.compile(
+    r"\b("
+    r"now|today|tonight|tomorrow|yesterday|current(ly)?|latest|recent|upcoming|"
+    r"last|past|next|previous|this (week|month|year|weekend)|ago|"
+    r"şimdi|şu an|bugün|bu gece|yarın|dün|güncel|son|geçen|gelecek|önümüzdeki|haftaya|"
+    r"bu (hafta|ay|yıl)|önce|sonra"
+    r")\b",
+    re.IGNORECASE,
+)
+
+# CoinCap history ranges are the only timestamps we know how to re-derive:
+# shifting `start` and `end` by the time elapsed keeps the window relative.
+SHIFTABLE_TIME_PARAMS = {"start", "end"}
+
+_NUMBER_PATTERN = re.compile(r"\d+")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+# Relative-time words that name the same period, so "bugün" matches "today" and "latest" matches "now".
+PERIOD_SYNONYMS = {
+    "current": "now", "currently": "now", "latest": "now", "şimdi": "now", "şu an": "now", "güncel": "now",
+    "bugün": "today", "bu gece": "tonight", "yarın": "tomorrow", "dün": "yesterday",
+    "past": "last", "previous": "last", "son": "last", "geçen": "last",
+    "upcoming": "next", "gelecek": "next", "önümüzdeki": "next",
+    "bu hafta": "this week", "bu ay": "this month", "bu yıl": "this year", "önce": "ago",
+}
+
+def prompt_subject(prompt: str) -> frozenset:
+    """
+    What a prompt is about beyond its wording: the assets, countries and cities
+    it names, and its relative-time words ("today", "tomorrow", "last").
+    """
+    periods = frozenset()
+    for match in TIME_RELATIVE_PATTERN.finditer(prompt):
+        word = _WHITESPACE_PATTERN.sub(" ", match.group(0).lower())
+        periods |= {("period", PERIOD_SYNONYMS.get(word, word))}
+    return prompt_entities(prompt) | periods
+
+def is_time_relative(prompt: str) -> bool:
+    return TIME_RELATIVE_PATTERN.search(prompt) is not None
+
+def _rederive_timestamps(api_request: APIRequest, created_at: float) -> Optional[APIRequest]:
+    query = api_request.query or {}
+    present = SHIFTABLE_TIME_PARAMS.intersection(query)
+    if not present:
+        # "Current price" style requests carry no timestamps and stay valid.
+        return api_request
+    if present != SHIFTABLE_TIME_PARAMS:
+        # A window with only one end cannot be shifted as a whole.
+        return None
+    try:
+        shift_ms = int((time.time() - created_at) * 1000)
+        shifted_query = dict(query)
+        for key in SHIFTABLE_TIME_PARAMS:
+            shifted_query[key] = str(int(query[key]) + shift_ms)
+    except ValueError:
+        return None
+    return api_request.model_copy(update={"query": shifted_query})
+
+class _Entry:
+    __slots__ = ("prompt", "numbers", "subject", "time_relative", "api_request", "created_at")
+
+    def __init__(self, prompt: str, api_request: APIRequest):
+        self.prompt = prompt
+        self.numbers = tuple(_NUMBER_PATTERN.findall(prompt))
+        self.subject = prompt_subject(prompt)
+        self.time_relative = is_time_relative(prompt)
+        self.api_request = api_request
+        self.created_at = time.time()
+
+class SemanticRequestCache:
+    """
+    Cache of LLM-built API requests keyed on (query embedding, API name).
+
+    A lookup serves the request of the most similar cached prompt for the same
+    API if its cosine similarity is above `threshold`. Besides similarity, a hit
+    requires the numbers in both prompts to be identical (so "top 5" never
+    serves "top 10") and the same assets, countries, cities and relative-time
+    words (so Ethereum never gets Bitcoin's request, Austria Germany's or
+    "tomorrow" today's), and time-relative prompts are only served when the
+    cached request's timestamps can be shifted to the present.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[str], list],
+        threshold: float = 0.92,
+        max_entries: int = 512,
+        ttl: Optional[float] = 3_600,
+    ):
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._vectors: dict = {}
+        self._api_of: dict = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refused = 0
+        self.evictions = 0
+
+    def lookup(self, prompt: str, api: str, vector: Optional[list] = None) -> Optional[APIRequest]:
+        """
+        Return a cached request for a similar prompt, or None on a miss.
+
+        Args:
+            prompt (str): The user prompt.
+            api (str): The name of the API(coincap, nager or weatherapi).
+            vector (list, optional): The prompt embedding, if already computed.
+
+        Returns:
+            Optional[APIRequest]: The cached request.
+        """
+        query_vector = self._normalize(vector if vector is not None else self.embed(prompt))
+        with self._lock:
+            self._expire()
+            ids = [entry_id for entry_id, entry_api in self._api_of.items() if entry_api == api]
+            if not ids:
+                self.misses += 1
+                return None
+            matrix = np.stack([self._vectors[entry_id] for entry_id in ids])
+            scores = matrix @ query_vector
+            best = int(np.argmax(scores))
+            entry_id = ids[best]
+            entry = self._entries[entry_id]
+            if (
+                scores[best] < self.threshold
+                or entry.numbers != tuple(_NUMBER_PATTERN.findall(prompt))
+                or entry.subject != prompt_subject(prompt)
+            ):
+                self.misses += 1
+                return None
+
+            api_request = entry.api_request
+            if is_time_relative(prompt) or entry.time_relative:
+                api_request = _rederive_timestamps(api_request, entry.created_at) if entry.time_relative else None
+                if api_request is None:
+                    self.refused += 1
+                    return None
+
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return api_request
+
+    def store(self, prompt: str, api: str, api_request: APIRequest, vector: Optional[list] = None):
+        """
+        Remember the request the builder produced for a prompt.
+        """
+        query_vector = self._normalize(vector if vector is not None else self.embed(prompt))
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(prompt, api_request)
+            self._vectors[entry_id] = query_vector
+            self._api_of[entry_id] = api
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors.clear()
+            self._api_of.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses + self.refused
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "refused_time_relative": self.refused,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        deadline = time.time() - self.ttl
+        expired = [entry_id for entry_id, entry in self._entries.items() if entry.created_at < deadline]
+        for entry_id in expired:
+            self._evict(entry_id)
+
+    def _evict(self, entry_id: int):
+        del self._entries[entry_id]
+        del self._vectors[entry_id]
+        del self._api_of[entry_id]
+        self.evictions += 1
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+def _embed_with_router(prompt: str) -> list:
+    # Imported lazily so that importing the pipeline does not load the encoder.
+    # Routing the prompt already cached its embedding in the router pool.
+    from tools.router_pool import router_pool
+    return router_pool.embed(prompt)
+
+semantic_request_cache = SemanticRequestCache(embed=_embed_with_router)
@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import json
+import threading
+import weakref
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from tools.tracing import annotate, metrics
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls into one.
+
+    The first caller for a key runs the call; callers that arrive while it is
+    in flight wait for it and get the same result, or the same exception.
+    The sync API runs every call on the shared background loop (see
+    `tools.http_client.run_sync`), so sync callers from any thread coalesce
+    too. In-flight calls are tracked per event loop.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future]]" = weakref.WeakKeyDictionary()
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `call` unless an identical call is already in flight, and return its result.
+
+        Args:
+            key (str): Identifies identical calls (a canonical request key or a prompt hash).
+            call: Starts the call; only invoked by the first caller.
+
+        Returns:
+            The result of the call, shared with every coalesced caller.
+        """
+        loop = asyncio.get_running_loop()
+        in_flight = self._calls.setdefault(loop, {})
+        while True:
+            future = in_flight.get(key)
+            if future is None:
+                break
+            with self._lock:
+                self.coalesced += 1
+            metrics.increment(f"single_flight.{self.name}.coalesced")
+            annotate(coalesced=True)
+            try:
+                # Shielded, so a cancelled follower does not cancel the shared call.
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The caller running the call was cancelled; try again.
+
+        future = loop.create_future()
+        in_flight[key] = future
+        with self._lock:
+            self.calls += 1
+        metrics.increment(f"single_flight.{self.name}.calls")
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting for it.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = sum(len(calls) for calls in self._calls.values())
+            total = self.calls + self.coalesced
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": in_flight,
+                "coalesced_rate": self.coalesced / total if total else 0.0,
+            }
+
+class _SharedStream:
+    """The items a streamed call produced so far, and a future resolved whenever more arrive."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.updated = loop.create_future()
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        updated, self.updated = self.updated, self.loop.create_future()
+        updated.set_result(None)
+
+class StreamFlight:
+    """
+    Coalesces identical concurrent streamed calls into one.
+
+    The first caller for a key starts the stream in a task of its own; every
+    caller, the first included, gets all items from the beginning, then each
+    new item as it arrives, and the same exception if the stream fails. The
+    stream is aborted once every caller has stopped reading it.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._streams: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, _SharedStream]]" = weakref.WeakKeyDictionary()
+        self.calls = 0
+        self.coalesced = 0
+
+    async def stream(self, key: str, start: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        Stream the items of `start()` unless an identical stream is already in flight, and share its items.
+
+        Args:
+            key (str): Identifies identical calls (a prompt hash).
+            start: Opens the stream; only invoked by the first caller.
+
+        Yields:
+            The items of the stream, shared with every coalesced caller.
+        """
+        loop = asyncio.get_running_loop()
+        in_flight = self._streams.setdefault(loop, {})
+        shared = in_flight.get(key)
+        if shared is None:
+            shared = in_flight[key] = _SharedStream(loop)
+            with self._lock:
+                self.calls += 1
+            metrics.increment(f"single_flight.{self.name}.calls")
+            shared.task = loop.create_task(self._produce(key, shared, start()))
+        else:
+            with self._lock:
+                self.coalesced += 1
+            metrics.increment(f"single_flight.{self.name}.coalesced")
+            annotate(coalesced=True)
+
+        shared.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(shared.items):
+                    index += 1
+                    yield shared.items[index - 1]
+                if shared.done:
+                    if shared.error is not None:
+                        raise shared.error
+                    return
+                # Not awaited directly, so a cancelled caller does not cancel the future the others wait on.
+                await asyncio.wait({shared.updated})
+        finally:
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and not shared.done:
+                # Nobody reads the stream any more; a new caller starts a fresh one.
+                if in_flight.get(key) is shared:
+                    del in_flight[key]
+                shared.task.cancel()
+
+    async def _produce(self, key: str, shared: _SharedStream, iterator: AsyncIterator[Any]):
+        try:
+            async with aclosing(iterator):
+                async for item in iterator:
+                    shared.items.append(item)
+                    shared.notify()
+        except BaseException as e:
+            # Cancelled included: the callers still reading get it instead of waiting forever.
+            shared.error = e
+        finally:
+            in_flight = self._streams.get(shared.loop) or {}
+            if in_flight.get(key) is shared:
+                del in_flight[key]
+            shared.done = True
+            shared.notify()
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = sum(len(streams) for streams in self._streams.values())
+            total = self.calls + self.coalesced
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": in_flight,
+                "coalesced_rate": self.coalesced / total if total else 0.0,
+            }
+
+def prompt_key(*parts) -> str:
+    """Hash the parts of an LLM call (model, prompts...) into a single-flight key."""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode()).hexdigest()
+
+upstream_flights = SingleFlight("upstream")
+deepseek_flights = SingleFlight("deepseek")
+deepseek_stream_flights = StreamFlight("deepseek_stream")
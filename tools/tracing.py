@@ -0,0 +1,231 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Samples kept per histogram for percentile estimates.
+HISTOGRAM_WINDOW = 10_000
+
+class Histogram:
+    """Latency/size histogram over a sliding window of recent samples."""
+
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self._samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> dict:
+        if not self._samples:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(np.fromiter(self._samples, dtype=float), [50, 95, 99])
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "max": max(self._samples),
+        }
+
+class MetricsRegistry:
+    """In-process registry of counters, gauges and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._histograms: Dict[str, Histogram] = {}
+
+    def increment(self, name: str, amount: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": {name: histogram.snapshot() for name, histogram in self._histograms.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+class TraceSink:
+    """Appends finished traces, one JSON object per line, to a local file."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, trace: "Trace"):
+        if not self.path:
+            return
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as trace_file:
+                trace_file.write(line + "\n")
+
+class Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List["Span"] = []
+
+    def to_dict(self) -> dict:
+        return {"trace_id": self.trace_id, "spans": [span.to_dict() for span in self.spans]}
+
+class Span:
+    __slots__ = ("name", "trace", "span_id", "parent_id", "started_at", "duration", "attributes", "status", "_started")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.name = name
+        self.trace = parent.trace if parent is not None else Trace()
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.attributes = dict(attributes)
+        self.status = "ok"
+
+    def set(self, **attributes):
+        """Attach attributes (status codes, sizes, cache hits, token usage...) to the span."""
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+metrics = MetricsRegistry()
+trace_sink = TraceSink(os.getenv("TRACE_PATH") or None)
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes) -> Span:
+    """
+    Start a span without making it the current one.
+
+    Use this for work that outlives a single await, such as a stream consumed
+    chunk by chunk; pair it with `finish_span`.
+
+    Args:
+        name (str): The stage name.
+        parent (Span, optional): The parent span; defaults to the current span.
+        **attributes: Initial span attributes.
+
+    Returns:
+        Span: The started span.
+    """
+    return Span(name, parent if parent is not None else _current_span.get(), attributes)
+
+def finish_span(finished_span: Span, error: Optional[BaseException] = None):
+    """
+    End a span, record its duration and, for a root span, write its trace.
+    """
+    finished_span.duration = time.perf_counter() - finished_span._started
+    if error is not None:
+        finished_span.status = "error"
+        finished_span.set(error=repr(error))
+        metrics.increment(f"stage.{finished_span.name}.errors")
+    finished_span.trace.spans.append(finished_span)
+    metrics.observe(f"stage.{finished_span.name}.seconds", finished_span.duration)
+    if finished_span.parent_id is None:
+        trace_sink.write(finished_span.trace)
+
+@contextmanager
+def use_span(active_span: Span):
+    """Make a started span the current one for the enclosed block."""
+    token = _current_span.set(active_span)
+    try:
+        yield active_span
+    finally:
+        _current_span.reset(token)
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a pipeline stage.
+
+    Spans nest through a context variable, so they follow the request across
+    awaits, asyncio tasks and `asyncio.to_thread`. The duration goes to the
+    `stage.<name>.seconds` histogram, and the whole trace is written to the
+    JSONL sink when its root span ends.
+
+    Args:
+        name (str): The stage name (route, build, upstream, humanize...).
+        **attributes: Initial span attributes.
+
+    Yields:
+        Span: The span, to attach more attributes to.
+    """
+    new_span = start_span(name, **attributes)
+    error = None
+    try:
+        with use_span(new_span):
+            yield new_span
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        finish_span(new_span, error)
+
+def annotate(**attributes):
+    """Attach attributes to the current span, if there is one."""
+    active_span = _current_span.get()
+    if active_span is not None:
+        active_span.set(**attributes)
+
+def record_usage(usage: Optional[dict], target_span: Optional[Span] = None):
+    """
+    Record the `usage` block of a DeepSeek response on a span (the current one
+    by default) and in the token counters.
+    """
+    if not usage:
+        return
+    if target_span is not None:
+        target_span.set(usage=usage)
+    else:
+        annotate(usage=usage)
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens", "prompt_cache_hit_tokens"):
+        if key in usage:
+            metrics.increment(f"deepseek.{key}", usage[key])